@@ -1,4 +1,5 @@
 import Agents.llm as llm
+import Agents.prompts as prompts
 
 # Define the tool schema for answer understanding
 ANS_UNDERSTANDING_TOOL_SCHEMA = [
@@ -77,7 +78,17 @@ All extracted information MUST be in French.
 STRICTLY adhere to the defined function schema for the output format. Do NOT include any properties or fields that are not explicitly defined in the tool's 'parameters' section. Ensure all boolean values are `true` or `false`.
 """
 
-def ans_understanding(text, question, answer):
+# PROMPT_VARIANT=compact (Agents/prompts.py)
+COMPACT_INSTRUCTIONS = """
+Analyze the 'Student Answer' against the 'Text' and 'Question'. All scores are 0-100.
+-   concepts_found: each relevant concept of the answer with relevance_score (relation to the question and text) and completeness_score (how thoroughly it is explained). Exact match with the text: 100 and 100 (spelling mistakes do not count); near match: 95-99; partial: proportional. Judge meaning, not exact wording.
+-   overall_semantic_alignment: alignment of the whole answer with the expected content.
+-   named_entities and dates: only those written in the answer.
+-   structure: coherent, has_intro, has_body, has_conclusion.
+Base everything on the 'Text', 'Question' and 'Student Answer' only. Answer in French. Output only the fields of the tool schema.
+"""
+
+def ans_understanding(text, question, answer, tier=0):
     prompt = f"""
 Text: {text}
 
@@ -88,9 +99,11 @@ Student Answer: {answer}
     # Call llm.completion with the tool schema and force it to call our function
     return llm.completion(
         prompt, 
-        INSTRUCTIONS, 
-        tools=ANS_UNDERSTANDING_TOOL_SCHEMA, 
-        tool_choice={"type": "function", "function": {"name": "understand_answer"}}
+        prompts.instructions("ans_understanding", INSTRUCTIONS, COMPACT_INSTRUCTIONS),
+        tools=prompts.tool_schema("ans_understanding", ANS_UNDERSTANDING_TOOL_SCHEMA),
+        tool_choice={"type": "function", "function": {"name": "understand_answer"}},
+        agent="ans_understanding",
+        tier=tier
     )
 
 def test():
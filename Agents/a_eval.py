@@ -1,5 +1,6 @@
 # Agents/a_eval.py
 import Agents.llm as llm
+import Agents.prompts as prompts
 import json
 
 # Define the tool schema for evaluation
@@ -35,6 +36,36 @@ EVAL_TOOL_SCHEMA = [
     }
 ]
 
+# Packed mode: several answers to the same question graded in one completion.
+EVAL_PACKED_TOOL_SCHEMA = [
+    {
+        "type": "function",
+        "function": {
+            "name": "evaluate_answers",
+            "description": "Score each student answer independently based on the given rubric and its semantic analysis.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "evaluations": {
+                        "type": "array",
+                        "description": "One evaluation per student answer.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "answer_id": {"type": "integer", "description": "The id of the evaluated answer."},
+                                "scores": EVAL_TOOL_SCHEMA[0]["function"]["parameters"]["properties"]["scores"],
+                                "total_score": EVAL_TOOL_SCHEMA[0]["function"]["parameters"]["properties"]["total_score"]
+                            },
+                            "required": ["answer_id", "scores", "total_score"]
+                        }
+                    }
+                },
+                "required": ["evaluations"]
+            }
+        }
+    }
+]
+
 INSTRUCTIONS = """
 Score the student’s answer based on the given rubric, considering the detailed semantic analysis from 'Answer Understanding'.
 For each rubric item, assign a score from 0 up to the item's weight.
@@ -59,7 +90,57 @@ All responses MUST be in French.
 IMPORTANT: When generating the JSON for the tool call, STRICTLY adhere to the defined schema. Do NOT include any properties or fields that are not explicitly defined in the tool's 'parameters' section. Ensure all boolean values are `true` or `false`.
 """
 
-def eval(text, question, answer, rubric, answer_understanding):
+PACKED_SUFFIX = """
+**Several answers:** You are given several student answers to the same question, each introduced by its `Answer id`.
+Score each answer independently of the others, exactly as if it were the only one, and return one entry in 'evaluations'
+per answer id, with that answer's 'scores' and 'total_score'.
+"""
+PACKED_INSTRUCTIONS = INSTRUCTIONS + PACKED_SUFFIX
+
+# PROMPT_VARIANT=compact (Agents/prompts.py)
+COMPACT_INSTRUCTIONS = """
+Score the student's answer on each rubric concept, from 0 up to the concept's weight, using the 'Answer Understanding' analysis:
+-   concept clearly addressed by a found concept with high relevance and completeness (90-100): full or nearly full weight;
+-   partially addressed, or lower relevance/completeness: proportional partial credit;
+-   not addressed or irrelevant: 0 or very low. A completely irrelevant or nonsensical answer gets a total_score of 0.
+The overall semantic alignment is the main indicator of overall quality; the answer must agree with the 'Text'; use the structure only for organization-related concepts.
+Give exactly one score per rubric concept (no other concept); total_score is the sum of the scores. Same inputs must give the same scores.
+Answer in French. Output only the fields of the tool schema.
+"""
+COMPACT_PACKED_INSTRUCTIONS = COMPACT_INSTRUCTIONS + PACKED_SUFFIX
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token), used to size packed prompts."""
+    return len(text) // 4 + 1
+
+def format_shared_context(text, question, rubric):
+    """Prompt prefix shared by every answer to the same question."""
+    return f"""
+Context Text: {text}
+
+Question: {question}
+
+Rubric: {json.dumps(rubric, ensure_ascii=False)}
+"""
+
+def format_answer_block(answer_id, answer, answer_understanding):
+    """Per-answer part of a packed prompt."""
+    block = f"""
+Answer id: {answer_id}
+
+Student Answer: {answer}
+
+Extracted Concepts: {json.dumps(answer_understanding.get("concepts_found"), ensure_ascii=False)}
+
+Answer Structure: {json.dumps(answer_understanding.get("structure"), ensure_ascii=False)}
+"""
+    if answer_understanding.get("local_semantic_alignment") is not None:
+        block += f"""
+Local Semantic Alignment (0-100): {answer_understanding["local_semantic_alignment"]}
+"""
+    return block
+
+def eval(text, question, answer, rubric, answer_understanding, tier=0):
     if not all([text, question, answer, rubric, answer_understanding]):
         print("DEBUG a_eval: Condition 'not all([text, question, answer, rubric, answer_understanding])' is TRUE. One or more inputs are falsey.")
         if not rubric:
@@ -87,13 +168,46 @@ Rubric: {json.dumps(rubric, ensure_ascii=False)}
 Extracted Concepts: {json.dumps(extracted_concepts, ensure_ascii=False)}
 
 Answer Structure: {json.dumps(answer_structure_details, ensure_ascii=False)}
+"""
+    # Lexical alignment computed locally by Agents/similarity.py, when the workflow provides it.
+    if answer_understanding.get("local_semantic_alignment") is not None:
+        prompt += f"""
+Local Semantic Alignment (0-100): {answer_understanding["local_semantic_alignment"]}
 """
     # Call llm.completion with the tool schema and force it to call our function
     return llm.completion(
         prompt, 
-        INSTRUCTIONS, 
-        tools=EVAL_TOOL_SCHEMA, 
-        tool_choice={"type": "function", "function": {"name": "evaluate_answer"}}
+        prompts.instructions("eval", INSTRUCTIONS, COMPACT_INSTRUCTIONS),
+        tools=prompts.tool_schema("eval", EVAL_TOOL_SCHEMA),
+        tool_choice={"type": "function", "function": {"name": "evaluate_answer"}},
+        agent="eval",
+        tier=tier
+    )
+
+def eval_packed(text, question, answers, rubric, answer_understandings, tier=0):
+    """
+    Grades several answers to the same question in one completion: the context text, question and rubric
+    are sent once. answers[i] is graded with answer_understandings[i] and returned with answer_id i.
+    """
+    if not all([text, question, answers, rubric]) or len(answers) != len(answer_understandings):
+        print("DEBUG a_eval: eval_packed called with missing inputs or mismatched answers/answer_understandings.")
+        return None
+    for answer_understanding in answer_understandings:
+        if answer_understanding.get("concepts_found") is None or answer_understanding.get("structure") is None:
+            print("DEBUG a_eval: eval_packed received an answer_understanding without 'concepts_found' or 'structure'.")
+            return None
+
+    prompt = format_shared_context(text, question, rubric) + "\nStudent Answers:\n" + "".join(
+        format_answer_block(answer_id, answer, answer_understanding)
+        for answer_id, (answer, answer_understanding) in enumerate(zip(answers, answer_understandings))
+    )
+    return llm.completion(
+        prompt,
+        prompts.instructions("eval", PACKED_INSTRUCTIONS, COMPACT_PACKED_INSTRUCTIONS),
+        tools=prompts.tool_schema("eval", EVAL_PACKED_TOOL_SCHEMA),
+        tool_choice={"type": "function", "function": {"name": "evaluate_answers"}},
+        agent="eval",
+        tier=tier
     )
 
 def test():
@@ -1,5 +1,6 @@
 # Agents/a_final_eval.py
 import Agents.llm as llm
+import Agents.prompts as prompts
 import json
 
 # Define the tool schema for final evaluation
@@ -42,7 +43,14 @@ All responses MUST be in French.
 IMPORTANT: When generating the JSON for the tool call, STRICTLY adhere to the defined schema. Do NOT include any properties or fields that are not explicitly defined in the tool's 'parameters' section. Ensure all boolean values are `true` or `false`.
 """
 
-def final_eval(text, question, answer, rubric, answer_understanding, rubric_score, grammar_penalty_percent, breakdown_scores):
+# PROMPT_VARIANT=compact (Agents/prompts.py)
+COMPACT_INSTRUCTIONS = """
+Write feedback for the student (2-4 sentences, in French) and output the pre-calculated final score unchanged.
+State what the answer covered well (concepts with high scores) and what is missing or inaccurate (concepts with low scores), using the 'Breakdown Scores' and the answer analysis (relevance, completeness, semantic alignment).
+Judge only against the text and rubric: no outside information or advice. Output only the fields of the tool schema.
+"""
+
+def final_eval(text, question, answer, rubric, answer_understanding, rubric_score, grammar_penalty_percent, breakdown_scores, tier=0):
     # Input validation
     if not all([text, question, answer, rubric, answer_understanding]) or breakdown_scores is None:
         print("DEBUG a_final_eval: One of the core inputs (text, question, answer, rubric, answer_understanding, breakdown_scores) is missing or None.")
@@ -82,9 +90,11 @@ Output ONLY the JSON as specified.
     # Call llm.completion with the tool schema and force it to call our function
     return llm.completion(
         prompt, 
-        INSTRUCTIONS, 
-        tools=FINAL_EVAL_TOOL_SCHEMA, 
-        tool_choice={"type": "function", "function": {"name": "provide_final_evaluation"}}
+        prompts.instructions("final_eval", INSTRUCTIONS, COMPACT_INSTRUCTIONS),
+        tools=prompts.tool_schema("final_eval", FINAL_EVAL_TOOL_SCHEMA),
+        tool_choice={"type": "function", "function": {"name": "provide_final_evaluation"}},
+        agent="final_eval",
+        tier=tier
     )
 
 def test():
@@ -1,10 +1,26 @@
 # Agents/a_grammar_language.py
 import Agents.llm as llm
+import Agents.prompts as prompts
+import Agents.tracing as tracing
+import collections
 import json
+import os
+import re
+import sqlite3
+import threading
 import time
 
 MAX_ATTEMPTS = 5 # Define max retry attempts for getting valid tool call response
 
+# --- Sentence-level memoization (GRAMMAR_SENTENCE_CACHE=1) ---
+# Answers are split into sentences; each distinct (normalized) sentence is evaluated once and its errors and
+# penalty are cached, so grammar cost scales with distinct sentences rather than with submissions.
+SENTENCE_CACHE_ENABLED = os.environ.get("GRAMMAR_SENTENCE_CACHE", "0") == "1"
+SENTENCE_CACHE_MAX_ENTRIES = int(os.environ.get("GRAMMAR_SENTENCE_CACHE_MAX_ENTRIES", "10000"))
+# Optional SQLite file backing the in-memory LRU (shared across restarts and processes).
+SENTENCE_CACHE_PATH = os.environ.get("GRAMMAR_SENTENCE_CACHE_PATH", "")
+SENTENCE_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("GRAMMAR_SENTENCE_CACHE_DISK_MAX_ENTRIES", "200000"))
+
 # Define the tool schema for grammar evaluation
 # Updated GRAMMAR_TOOL_SCHEMA to include 'accentuation' and enum for type
 GRAMMAR_TOOL_SCHEMA = [
@@ -98,7 +114,19 @@ All responses MUST be in French.
 IMPORTANT: When generating the JSON for the tool call, STRICTLY adhere to the defined schema, including the `enum` for the error `type`. Do NOT include any properties or fields that are not explicitly defined in the tool's 'parameters' section.
 """
 
-def grammar(answer):
+# PROMPT_VARIANT=compact (Agents/prompts.py)
+COMPACT_INSTRUCTIONS = """
+You are a French language evaluator. List ONLY clear, undeniable errors of standard French in the student's answer, each with its `type`, the exact incorrect `text` (present in the answer) and a `suggestion`.
+-   Correct usage or valid style choices (e.g. "des chiffres", "au tableau") are NOT errors. Never invent errors.
+-   The suggestion is a real, correctly spelled French word or phrase, the minimal correction of the text only (e.g. "ecrit" -> "écrit", never "crit"); no added words; same meaning. Do not change a noun's gender unless it clearly disagrees with visible words (e.g. "le maitresse intelligent").
+-   Types: grammar (conjugation, agreement, prepositions, pronouns: "ils mange" -> "ils mangent"); spelling (wrong or missing letters: "expliqe" -> "explique"); accentuation (accents only: "lecon" -> "leçon", "eleve" -> "élève"); style (only severe clarity problems).
+penalty (0-10, percent): 0 when there is no error, otherwise proportional to the severity and frequency of the errors (a few accent errors: about 0.5-1.5; grammar or spelling errors that hurt understanding: more).
+Answer in French. Output only the fields of the tool schema.
+"""
+
+def grammar(answer, tier=0):
+    if SENTENCE_CACHE_ENABLED:
+        return grammar_memoized(answer, tier)
     prompt = f"""
 Student's Answer to evaluate:
 {answer}
@@ -110,9 +138,11 @@ Student's Answer to evaluate:
             # Call llm.completion with the tool schema and force it to call our function
             res = llm.completion(
                 prompt, 
-                INSTRUCTIONS, 
-                tools=GRAMMAR_TOOL_SCHEMA, 
-                tool_choice={"type": "function", "function": {"name": "evaluate_grammar"}}
+                prompts.instructions("grammar", INSTRUCTIONS, COMPACT_INSTRUCTIONS),
+                tools=prompts.tool_schema("grammar", GRAMMAR_TOOL_SCHEMA),
+                tool_choice={"type": "function", "function": {"name": "evaluate_grammar"}},
+                agent="grammar",
+                tier=tier
             )
             
             # llm.completion now returns the parsed arguments directly if a tool is called
@@ -142,13 +172,214 @@ Student's Answer to evaluate:
                 return res # Return the parsed dictionary
             else:
                 print(f"LLM completion returned unexpected format on attempt {attempt + 1}: {res}")
-                time.sleep(1) # Wait before retrying
+                tracing.sleep(1, "retry") # Wait before retrying
+        except llm.CircuitOpenError:
+            # The backend is unhealthy; retrying here would only delay the degraded path.
+            raise
         except Exception as e:
             print(f"Error during LLM completion or tool call processing on attempt {attempt + 1}: {e}")
-            time.sleep(1) # Wait before retrying
+            tracing.sleep(1, "retry") # Wait before retrying
 
     raise ValueError(f"Failed to get valid tool call arguments from Grammar and Language agent after {MAX_ATTEMPTS} attempts.")
 
+GRAMMAR_SENTENCES_TOOL_SCHEMA = [
+    {
+        "type": "function",
+        "function": {
+            "name": "evaluate_grammar_sentences",
+            "description": "Evaluate the grammar, spelling, accentuation, and clarity of each sentence of a student's answer.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "sentences": {
+                        "type": "array",
+                        "description": "One evaluation per sentence.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "sentence_id": {"type": "integer", "description": "The id of the evaluated sentence."},
+                                "penalty": GRAMMAR_TOOL_SCHEMA[0]["function"]["parameters"]["properties"]["penalty"],
+                                "errors": GRAMMAR_TOOL_SCHEMA[0]["function"]["parameters"]["properties"]["errors"]
+                            },
+                            "required": ["sentence_id", "penalty", "errors"]
+                        }
+                    }
+                },
+                "required": ["sentences"]
+            }
+        }
+    }
+]
+
+SENTENCES_SUFFIX = """
+**Sentence by sentence:** You are given sentences from students' answers, each introduced by its id in brackets.
+Evaluate each sentence on its own, exactly as you would evaluate an answer made of that sentence only, and return
+one entry in 'sentences' per sentence id, with that sentence's 'penalty' and 'errors' (the `text` of each error must be
+present in that sentence).
+"""
+SENTENCES_INSTRUCTIONS = INSTRUCTIONS + SENTENCES_SUFFIX
+COMPACT_SENTENCES_INSTRUCTIONS = COMPACT_INSTRUCTIONS + SENTENCES_SUFFIX
+
+def split_sentences(answer):
+    """Splits an answer into sentences (on ., !, ?, … and line breaks)."""
+    return [sentence.strip() for sentence in re.split(r"(?<=[.!?…])\s+|\n+", answer or "") if sentence.strip()]
+
+def normalize_sentence(sentence):
+    """Normalized sentence: whitespace collapsed. Case, accents and punctuation matter for grammar and are kept."""
+    return " ".join(sentence.split())
+
+def sentence_cache_key(sentence, tier=0):
+    """
+    Cache key of a normalized sentence evaluated on a model tier: the model and the prompt variant are part of
+    the key, so an escalated tier is not served a lower tier's result and a model or prompt change invalidates
+    the entries stored on disk.
+    """
+    return f"{llm.model_for('grammar', tier)}|{prompts.variant_for('grammar')}|{sentence}"
+
+class SentenceCache:
+    """
+    Bounded LRU of per-sentence results {"penalty", "errors"} by sentence_cache_key, optionally backed by a SQLite file: entries
+    evicted from memory stay on disk (up to disk_max_entries, least recently stored first out).
+    """
+
+    def __init__(self, max_entries=SENTENCE_CACHE_MAX_ENTRIES, path=SENTENCE_CACHE_PATH, disk_max_entries=SENTENCE_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._inserts_since_prune = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS sentences (sentence TEXT PRIMARY KEY, result TEXT NOT NULL, stored_at REAL NOT NULL)")
+            self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                return result
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT result FROM sentences WHERE sentence = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            result = json.loads(row[0])
+            self._remember(key, result)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._remember(key, result)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sentences (sentence, result, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(result, ensure_ascii=False), time.time())
+                )
+                self._db.commit()
+                self._inserts_since_prune += 1
+                if self._inserts_since_prune >= 1000:
+                    self._inserts_since_prune = 0
+                    self._db.execute(
+                        "DELETE FROM sentences WHERE sentence NOT IN (SELECT sentence FROM sentences ORDER BY stored_at DESC LIMIT ?)",
+                        (self.disk_max_entries,)
+                    )
+                    self._db.commit()
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+sentence_cache = SentenceCache()
+
+def _valid_sentence_errors(sentence, errors):
+    """Same filtering as grammar(), plus: the error text must be in the sentence."""
+    return [
+        error for error in errors
+        if isinstance(error, dict) and error.get("suggestion") and error.get("suggestion") != error.get("text")
+        and error.get("text") and error["text"] in sentence
+    ]
+
+def evaluate_sentences(sentences, tier=0):
+    """
+    Evaluates sentences in one completion (retrying the sentences missing from the output).
+    Returns:
+        A dict sentence -> {"penalty", "errors"}.
+    """
+    results = {}
+    pending = list(sentences)
+    for attempt in range(MAX_ATTEMPTS):
+        if not pending:
+            break
+        prompt = "\nSentences to evaluate:\n" + "\n".join(f"[{sentence_id}] {sentence}" for sentence_id, sentence in enumerate(pending)) + "\n"
+        try:
+            res = llm.completion(
+                prompt,
+                prompts.instructions("grammar", SENTENCES_INSTRUCTIONS, COMPACT_SENTENCES_INSTRUCTIONS),
+                tools=prompts.tool_schema("grammar", GRAMMAR_SENTENCES_TOOL_SCHEMA),
+                tool_choice={"type": "function", "function": {"name": "evaluate_grammar_sentences"}},
+                agent="grammar",
+                tier=tier
+            )
+        except llm.CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"Error during sentence-level grammar evaluation on attempt {attempt + 1}: {e}")
+            tracing.sleep(1, "retry")
+            continue
+        entries = res.get("sentences") if isinstance(res, dict) else None
+        if not isinstance(entries, list):
+            print(f"LLM completion returned unexpected format on attempt {attempt + 1}: {res}")
+            tracing.sleep(1, "retry")
+            continue
+        for entry in entries:
+            sentence_id = entry.get("sentence_id") if isinstance(entry, dict) else None
+            if not isinstance(sentence_id, int) or not 0 <= sentence_id < len(pending) or pending[sentence_id] in results:
+                continue
+            sentence = pending[sentence_id]
+            errors = _valid_sentence_errors(sentence, entry.get("errors") or [])
+            penalty = entry.get("penalty") if isinstance(entry.get("penalty"), (int, float)) else 0
+            results[sentence] = {"penalty": max(0, min(10, penalty)) if errors else 0, "errors": errors}
+        pending = [sentence for sentence in pending if sentence not in results]
+    if pending:
+        raise ValueError(f"Failed to evaluate {len(pending)} sentence(s) with the Grammar and Language agent after {MAX_ATTEMPTS} attempts.")
+    return results
+
+def merge_sentence_results(sentences, results):
+    """
+    Merges per-sentence results into the answer-level {penalty, errors}: errors are concatenated and the
+    penalty is the average of the sentence penalties weighted by sentence length (in words).
+    """
+    errors = [error for sentence in sentences for error in results[sentence]["errors"]]
+    if not errors:
+        return {"penalty": 0, "errors": []}
+    word_counts = [max(1, len(sentence.split())) for sentence in sentences]
+    penalty = sum(results[sentence]["penalty"] * words for sentence, words in zip(sentences, word_counts)) / sum(word_counts)
+    return {"penalty": round(penalty, 2), "errors": errors}
+
+def grammar_memoized(answer, tier=0):
+    """Sentence-level memoized equivalent of grammar(): only sentences never seen before are sent to the LLM."""
+    sentences = [normalize_sentence(sentence) for sentence in split_sentences(answer)]
+    if not sentences:
+        return {"penalty": 0, "errors": []}
+    results = {}
+    for sentence in dict.fromkeys(sentences):
+        cached = sentence_cache.get(sentence_cache_key(sentence, tier))
+        if cached is not None:
+            results[sentence] = cached
+    unseen = [sentence for sentence in dict.fromkeys(sentences) if sentence not in results]
+    if unseen:
+        for sentence, result in evaluate_sentences(unseen, tier).items():
+            sentence_cache.put(sentence_cache_key(sentence, tier), result)
+            results[sentence] = result
+    return merge_sentence_results(sentences, results)
+
 def test():
     test_answer = "La maitresse explique la lecon de mathematiques et elle ecrit au tableau"
     # test_answer = "Bonne compréhension générale. Vous avez bien identifié les causes"
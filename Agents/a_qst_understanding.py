@@ -1,4 +1,5 @@
 import Agents.llm as llm
+import Agents.prompts as prompts
 
 # Define the tool schema for question understanding
 QST_UNDERSTANDING_TOOL_SCHEMA = [
@@ -44,7 +45,13 @@ All responses MUST be in French.
 IMPORTANT: When generating the JSON for the tool call, STRICTLY adhere to the defined schema. Do NOT include any properties or fields that are not explicitly defined in the tool's 'parameters' section. Ensure all boolean values are `true` or `false`.
 """
 
-def qst_understanding(text, question):
+# PROMPT_VARIANT=compact (Agents/prompts.py)
+COMPACT_INSTRUCTIONS = """
+From the 'Text' and 'Question', give: the question type (descriptive, analytical or argumentative); the key concepts expected in a complete answer (specific keywords or phrases taken *only* from the 'Text'); the teacher's expectations for the answer.
+Answer in French. Output only the fields of the tool schema.
+"""
+
+def qst_understanding(text, question, tier=0):
     prompt = f"""
 Text: {text}
 
@@ -53,9 +60,11 @@ Question: {question}
     # Call llm.completion with the tool schema and force it to call our function
     return llm.completion(
         prompt, 
-        INSTRUCTIONS, 
-        tools=QST_UNDERSTANDING_TOOL_SCHEMA, 
-        tool_choice={"type": "function", "function": {"name": "understand_question"}}
+        prompts.instructions("qst_understanding", INSTRUCTIONS, COMPACT_INSTRUCTIONS),
+        tools=prompts.tool_schema("qst_understanding", QST_UNDERSTANDING_TOOL_SCHEMA),
+        tool_choice={"type": "function", "function": {"name": "understand_question"}},
+        agent="qst_understanding",
+        tier=tier
     )
 
 def test():
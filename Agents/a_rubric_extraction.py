@@ -1,4 +1,5 @@
 import Agents.llm as llm
+import Agents.prompts as prompts
 
 # Define the tool schema for rubric extraction
 RUBRIC_EXTRACTION_TOOL_SCHEMA = [
@@ -58,7 +59,13 @@ All responses MUST be in French.
 IMPORTANT: When generating the JSON for the tool call, STRICTLY adhere to the defined schema. Do NOT include any properties or fields that are not explicitly defined in the tool's 'parameters' section. Ensure all boolean values are `true` or `false`.
 """
 
-def rubric_extract(text, question, key_concepts_expected):
+# PROMPT_VARIANT=compact (Agents/prompts.py)
+COMPACT_INSTRUCTIONS = """
+From the 'Text', 'Question' and 'Key Concepts Expected', define a scoring rubric: one entry per important concept (named after the 'Key Concepts Expected'), with keywords taken from the 'Text' and 'Question' and a weight (percentage); the weights add up to 100.
+At least one entry; comprehensive but not overly granular. Answer in French. Output only the fields of the tool schema.
+"""
+
+def rubric_extract(text, question, key_concepts_expected, tier=0):
     if not text or not question or not key_concepts_expected:
         return None
 
@@ -74,9 +81,11 @@ Key Concepts Expected: {key_concepts_str}
     # Call llm.completion with the tool schema and force it to call our function
     return llm.completion(
         prompt, 
-        INSTRUCTIONS, 
-        tools=RUBRIC_EXTRACTION_TOOL_SCHEMA, 
-        tool_choice={"type": "function", "function": {"name": "extract_rubric"}}
+        prompts.instructions("rubric_extraction", INSTRUCTIONS, COMPACT_INSTRUCTIONS),
+        tools=prompts.tool_schema("rubric_extraction", RUBRIC_EXTRACTION_TOOL_SCHEMA),
+        tool_choice={"type": "function", "function": {"name": "extract_rubric"}},
+        agent="rubric_extraction",
+        tier=tier
     )
 
 def test():
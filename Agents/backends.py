@@ -0,0 +1,174 @@
+# Agents/backends.py
+# LLM backends behind llm.completion. Each backend turns (messages, model, tools, tool_choice) into an
+# LLMResponse; llm.py picks the backend per agent (LLM_BACKEND / LLM_BACKEND_<AGENT_KEY>).
+import collections
+import json
+import os
+import threading
+
+import httpx
+from groq import Groq
+
+# tool_arguments: parsed arguments of the function call (dict) or None if no tool was called.
+# content: plain message content when no tool was called.
+# usage: {"prompt_tokens", "completion_tokens", "total_tokens"} when reported by the server.
+LLMResponse = collections.namedtuple("LLMResponse", ["tool_arguments", "content", "usage"])
+
+DEFAULT_BACKEND = os.environ.get("LLM_BACKEND", "groq")
+LOCAL_BASE_URL = os.environ.get("LLM_LOCAL_BASE_URL", "http://127.0.0.1:8080/v1")
+# Grammar-constrained JSON (response_format json_schema) instead of tool calls on local servers.
+LOCAL_CONSTRAINED_JSON = os.environ.get("LLM_LOCAL_CONSTRAINED_JSON", "1") == "1"
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("LLM_HTTP_TIMEOUT_SECONDS", "120"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "32"))
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return {key: usage.get(key) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    return {key: getattr(usage, key, None) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+class LLMBackend:
+    """Base class: a chat-completion backend shared by all agents routed to it."""
+    name = "base"
+
+    def chat(self, messages, model, tools=None, tool_choice=None):
+        raise NotImplementedError
+
+class GroqBackend(LLMBackend):
+    """Groq SDK backend. The SDK client keeps a pooled HTTP connection and is created on first use."""
+    name = "groq"
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = Groq(
+                    api_key=self.api_key or os.environ.get("GROQ_API_KEY"),
+                    http_client=httpx.Client(
+                        timeout=HTTP_TIMEOUT_SECONDS,
+                        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+                    ),
+                )
+            return self._client
+
+    def chat(self, messages, model, tools=None, tool_choice=None):
+        # Add tools to the request if provided
+        if tools:
+            chat_completion = self.client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=0.0,
+                seed=42,
+                stream=False,
+                tools=tools,
+                tool_choice=tool_choice # Can be "auto", "none", or {"type": "function", "function": {"name": "my_function"}}
+            )
+        else:
+            chat_completion = self.client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=0.0,
+                seed=42,
+                stream=False,
+            )
+
+        message = chat_completion.choices[0].message
+        usage = _usage_dict(getattr(chat_completion, "usage", None))
+        # Check if the model called a tool
+        if message.tool_calls:
+            tool_call = message.tool_calls[0]
+            if tool_call.type != "function":
+                # If an unexpected tool type is returned, it's an error.
+                raise ValueError(f"Unexpected tool type returned: {tool_call.type}")
+            return LLMResponse(json.loads(tool_call.function.arguments), None, usage)
+        return LLMResponse(None, message.content, usage)
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Any server exposing the OpenAI /chat/completions API (llama.cpp server, vLLM, ...), typically running
+    on the same host. Requests share one pooled keep-alive HTTP client.
+    When constrained_json is True and a specific function is requested, the tool's parameter schema is
+    sent as a json_schema response_format so that the server constrains decoding to valid JSON.
+    """
+    name = "openai_compatible"
+
+    def __init__(self, base_url=LOCAL_BASE_URL, api_key=None, constrained_json=LOCAL_CONSTRAINED_JSON,
+                 timeout_seconds=HTTP_TIMEOUT_SECONDS, max_connections=HTTP_MAX_CONNECTIONS):
+        self.base_url = base_url.rstrip("/")
+        self.constrained_json = constrained_json
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._http = httpx.Client(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=timeout_seconds,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    @staticmethod
+    def _forced_function(tools, tool_choice):
+        if not tools or not isinstance(tool_choice, dict):
+            return None
+        function_name = tool_choice.get("function", {}).get("name")
+        for tool in tools:
+            if tool.get("function", {}).get("name") == function_name:
+                return tool["function"]
+        return None
+
+    def chat(self, messages, model, tools=None, tool_choice=None):
+        payload = {"model": model, "messages": messages, "temperature": 0.0, "seed": 42, "stream": False}
+        forced_function = self._forced_function(tools, tool_choice) if self.constrained_json else None
+        if forced_function:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": forced_function["name"], "schema": forced_function["parameters"], "strict": True},
+            }
+        elif tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = tool_choice
+
+        response = self._http.post("/chat/completions", json=payload)
+        response.raise_for_status()
+        body = response.json()
+        message = body["choices"][0]["message"]
+        usage = _usage_dict(body.get("usage"))
+        if forced_function:
+            return LLMResponse(json.loads(message.get("content") or ""), None, usage)
+        if message.get("tool_calls"):
+            tool_call = message["tool_calls"][0]
+            if tool_call.get("type", "function") != "function":
+                raise ValueError(f"Unexpected tool type returned: {tool_call.get('type')}")
+            arguments = tool_call["function"]["arguments"]
+            return LLMResponse(json.loads(arguments) if isinstance(arguments, str) else arguments, None, usage)
+        return LLMResponse(None, message.get("content"), usage)
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name=None):
+    """
+    Returns the shared backend instance for a name: "groq", "local" (LLM_LOCAL_BASE_URL) or an
+    http(s):// base URL of any OpenAI-compatible server.
+    """
+    name = name or DEFAULT_BACKEND
+    with _backends_lock:
+        if name not in _backends:
+            if name == "groq":
+                _backends[name] = GroqBackend()
+            elif name == "local":
+                _backends[name] = OpenAICompatibleBackend(LOCAL_BASE_URL)
+            elif name.startswith(("http://", "https://")):
+                _backends[name] = OpenAICompatibleBackend(name)
+            else:
+                raise ValueError(f"Unknown LLM backend: {name}")
+        return _backends[name]
+
+def register_backend(name, backend):
+    """Registers (or replaces) a backend instance under a name, e.g. for benchmarks or offline runs."""
+    with _backends_lock:
+        _backends[name] = backend
@@ -0,0 +1,253 @@
+# Agents/dispatcher.py
+# Priority-aware dispatch of LLM calls, so that live game answers are not starved by bulk regrading.
+# Every llm.completion call takes one of LLM_DISPATCH_CONCURRENCY slots. Waiting calls are started in
+# weighted fair queuing order (each call gets a virtual finish tag of 1/weight after the previous call of its
+# class), and LLM_DISPATCH_INTERACTIVE_RESERVED slots are only usable by interactive calls, so interactive
+# calls never wait behind a full set of bulk calls. In addition, bulk workflows pause at stage boundaries
+# (see stage_boundary) while interactive calls are waiting or running.
+# The class of a call is taken from the caller's context: wrap work in `with dispatcher.priority("bulk"):`.
+# Within a class, the slot goes to a tenant (Agents/tenants.py) chosen by deficit round robin: each tenant with
+# waiting calls is credited weight * DISPATCH_DRR_QUANTUM_TOKENS per round and is served while its credit covers
+# the estimated tokens of its next call, and tenants at their max_concurrency are skipped. A school running an
+# exam session therefore gets its share of the slots, not all of them.
+import collections
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import Agents.tenants as tenants
+
+PRIORITY_CLASSES = ("interactive", "normal", "bulk")
+DEFAULT_PRIORITY = "normal"
+
+# 0 disables the dispatcher (calls go straight to the backend).
+DISPATCH_CONCURRENCY = int(os.environ.get("LLM_DISPATCH_CONCURRENCY", "16"))
+DISPATCH_INTERACTIVE_RESERVED = int(os.environ.get("LLM_DISPATCH_INTERACTIVE_RESERVED", "4"))
+# Relative share of the slots each class gets when all classes have calls waiting.
+DISPATCH_WEIGHTS = {
+    "interactive": float(os.environ.get("LLM_DISPATCH_WEIGHT_INTERACTIVE", "16")),
+    "normal": float(os.environ.get("LLM_DISPATCH_WEIGHT_NORMAL", "4")),
+    "bulk": float(os.environ.get("LLM_DISPATCH_WEIGHT_BULK", "1")),
+}
+# Longest a bulk workflow waits at one stage boundary, so that a continuous interactive load slows bulk
+# work down without stopping it completely.
+BULK_MAX_PAUSE_SECONDS = float(os.environ.get("LLM_DISPATCH_BULK_MAX_PAUSE_SECONDS", "30"))
+# Credit (in estimated tokens) given to a tenant per round robin visit, times its weight.
+DISPATCH_DRR_QUANTUM_TOKENS = int(os.environ.get("LLM_DISPATCH_DRR_QUANTUM_TOKENS", "2000"))
+WAIT_WINDOW_SIZE = 1000 # Recent queue waits kept per class (and per tenant) for the metrics
+
+_priority = contextvars.ContextVar("llm_priority", default=DEFAULT_PRIORITY)
+
+def validate_priority(priority_class):
+    if priority_class not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {priority_class} (expected one of {', '.join(PRIORITY_CLASSES)})")
+    return priority_class
+
+def current_priority():
+    return _priority.get()
+
+@contextlib.contextmanager
+def priority(priority_class):
+    """Runs the enclosed LLM calls (in this thread) with the given priority class."""
+    token = _priority.set(validate_priority(priority_class))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def set_thread_priority(priority_class):
+    """Sets the priority class of the calling thread (e.g. as a ThreadPoolExecutor initializer)."""
+    _priority.set(validate_priority(priority_class))
+
+class PriorityDispatcher:
+    def __init__(self, concurrency=DISPATCH_CONCURRENCY, interactive_reserved=DISPATCH_INTERACTIVE_RESERVED, weights=None,
+                 quantum_tokens=DISPATCH_DRR_QUANTUM_TOKENS):
+        self.concurrency = concurrency
+        self.interactive_reserved = min(interactive_reserved, max(0, concurrency - 1))
+        self.weights = weights or DISPATCH_WEIGHTS
+        self.quantum_tokens = quantum_tokens
+        self._condition = threading.Condition()
+        # Finish tags of the waiting calls of each class (one per call, in arrival order).
+        self._queues = {priority_class: collections.deque() for priority_class in PRIORITY_CLASSES}
+        # Waiting calls of each class per tenant, in round robin order (tenants without waiting calls are removed).
+        self._tenant_queues = {priority_class: collections.OrderedDict() for priority_class in PRIORITY_CLASSES}
+        self._deficits = {priority_class: collections.defaultdict(float) for priority_class in PRIORITY_CLASSES}
+        self._credited = {priority_class: set() for priority_class in PRIORITY_CLASSES}
+        self._last_finish_tags = dict.fromkeys(PRIORITY_CLASSES, 0.0)
+        self._virtual_time = 0.0
+        self._in_flight = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._tenant_in_flight = collections.defaultdict(int)
+        self._waits = {priority_class: collections.deque(maxlen=WAIT_WINDOW_SIZE) for priority_class in PRIORITY_CLASSES}
+        self._tenant_waits = collections.defaultdict(lambda: collections.deque(maxlen=WAIT_WINDOW_SIZE))
+        self._completed = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._bulk_pause_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.concurrency > 0
+
+    def _has_free_slot(self, priority_class):
+        in_flight = sum(self._in_flight.values())
+        if in_flight >= self.concurrency:
+            return False
+        if priority_class == "interactive":
+            return True
+        return in_flight - self._in_flight["interactive"] < self.concurrency - self.interactive_reserved
+
+    def _tenant_eligible(self, tenant_id):
+        return self._tenant_in_flight[tenant_id] < tenants.quota(tenant_id)["max_concurrency"]
+
+    def _next_class(self):
+        """Class whose head-of-queue call has the smallest finish tag among the classes that can start a call."""
+        candidates = [
+            (queue[0], priority_class) for priority_class, queue in self._queues.items()
+            if queue and self._has_free_slot(priority_class)
+            and any(self._tenant_eligible(tenant_id) for tenant_id in self._tenant_queues[priority_class])
+        ]
+        return min(candidates)[1] if candidates else None
+
+    def _next_waiter(self, priority_class):
+        """Deficit round robin over the tenants with waiting calls of this class (at least one is eligible)."""
+        tenant_queues = self._tenant_queues[priority_class]
+        deficits, credited = self._deficits[priority_class], self._credited[priority_class]
+        while True:
+            tenant_id, waiters = next(iter(tenant_queues.items()))
+            if self._tenant_eligible(tenant_id):
+                if tenant_id not in credited:
+                    deficits[tenant_id] += self.quantum_tokens * tenants.quota(tenant_id)["weight"]
+                    credited.add(tenant_id)
+                if waiters[0]["cost"] <= deficits[tenant_id]:
+                    waiter = waiters.popleft()
+                    deficits[tenant_id] -= waiter["cost"]
+                    if not waiters:
+                        # A tenant with nothing waiting keeps no credit for later.
+                        del tenant_queues[tenant_id]
+                        deficits.pop(tenant_id, None)
+                        credited.discard(tenant_id)
+                    return waiter
+            credited.discard(tenant_id)
+            tenant_queues.move_to_end(tenant_id)
+
+    def _schedule(self):
+        """Grants free slots to waiting calls (caller holds the condition)."""
+        granted = False
+        while True:
+            priority_class = self._next_class()
+            if priority_class is None:
+                break
+            self._virtual_time = self._queues[priority_class].popleft()
+            waiter = self._next_waiter(priority_class)
+            waiter["granted"] = True
+            self._in_flight[priority_class] += 1
+            self._tenant_in_flight[waiter["tenant"]] += 1
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def acquire(self, priority_class, tenant_id=tenants.DEFAULT_TENANT, cost=1):
+        """
+        Blocks until a slot is granted to a call of this class and tenant, of cost estimated tokens.
+        Returns the time spent waiting.
+        """
+        enqueued_at = time.monotonic()
+        waiter = {"tenant": tenant_id, "cost": max(1, cost), "granted": False}
+        with self._condition:
+            finish_tag = max(self._virtual_time, self._last_finish_tags[priority_class]) + 1.0 / self.weights[priority_class]
+            self._last_finish_tags[priority_class] = finish_tag
+            self._queues[priority_class].append(finish_tag)
+            self._tenant_queues[priority_class].setdefault(tenant_id, collections.deque()).append(waiter)
+            self._schedule()
+            self._condition.wait_for(lambda: waiter["granted"])
+            wait_seconds = time.monotonic() - enqueued_at
+            self._waits[priority_class].append(wait_seconds)
+            self._tenant_waits[tenant_id].append(wait_seconds)
+        return wait_seconds
+
+    def release(self, priority_class, tenant_id=tenants.DEFAULT_TENANT):
+        with self._condition:
+            self._in_flight[priority_class] -= 1
+            self._tenant_in_flight[tenant_id] -= 1
+            self._completed[priority_class] += 1
+            self._schedule()
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, priority_class=None, tenant_id=None, cost=1):
+        priority_class = priority_class or current_priority()
+        tenant_id = tenant_id or tenants.current_tenant()
+        if not self.enabled:
+            yield
+            return
+        self.acquire(priority_class, tenant_id, cost)
+        try:
+            yield
+        finally:
+            self.release(priority_class, tenant_id)
+
+    def interactive_pending(self):
+        with self._condition:
+            return bool(self._queues["interactive"]) or self._in_flight["interactive"] > 0
+
+    def pause_bulk(self, max_pause_seconds=BULK_MAX_PAUSE_SECONDS):
+        """Waits while interactive calls are queued or running (at most max_pause_seconds)."""
+        started_at = time.monotonic()
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self._queues["interactive"] and self._in_flight["interactive"] == 0,
+                timeout=max_pause_seconds,
+            )
+            paused_seconds = time.monotonic() - started_at
+            self._bulk_pause_seconds += paused_seconds
+        return paused_seconds
+
+    def metrics(self):
+        """
+        Returns per-class dispatch metrics:
+            {class: {"queued", "in_flight", "completed", "wait_p50_seconds", "wait_p95_seconds", "wait_max_seconds"}}
+        plus "bulk_pause_seconds" (total time bulk workflows spent paused at stage boundaries) and
+        "tenants": {tenant: {"queued", "in_flight", "wait_p50_seconds", "wait_p95_seconds"}}.
+        """
+        with self._condition:
+            snapshot = {"concurrency": self.concurrency, "interactive_reserved": self.interactive_reserved,
+                        "bulk_pause_seconds": round(self._bulk_pause_seconds, 3)}
+            for priority_class in PRIORITY_CLASSES:
+                waits = sorted(self._waits[priority_class])
+                snapshot[priority_class] = {
+                    "queued": len(self._queues[priority_class]),
+                    "in_flight": self._in_flight[priority_class],
+                    "completed": self._completed[priority_class],
+                    "wait_p50_seconds": round(waits[len(waits) // 2], 4) if waits else None,
+                    "wait_p95_seconds": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 4) if waits else None,
+                    "wait_max_seconds": round(waits[-1], 4) if waits else None,
+                }
+            snapshot["tenants"] = {}
+            for tenant_id in set(self._tenant_waits) | set(self._tenant_in_flight):
+                waits = sorted(self._tenant_waits[tenant_id])
+                snapshot["tenants"][tenant_id] = {
+                    "queued": sum(len(queues.get(tenant_id, ())) for queues in self._tenant_queues.values()),
+                    "in_flight": self._tenant_in_flight[tenant_id],
+                    "wait_p50_seconds": round(waits[len(waits) // 2], 4) if waits else None,
+                    "wait_p95_seconds": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 4) if waits else None,
+                }
+        return snapshot
+
+dispatcher = PriorityDispatcher()
+
+def slot(cost=1):
+    """Slot for one LLM call of the current priority class and tenant, of cost estimated tokens."""
+    return dispatcher.slot(cost=cost)
+
+def stage_boundary():
+    """
+    Called by the workflow before each agent call: a bulk workflow pauses here while interactive calls
+    are queued or running, so that it does not take the slots they are about to need.
+    Returns the time spent paused (0 when not paused).
+    """
+    if dispatcher.enabled and current_priority() == "bulk" and dispatcher.interactive_pending():
+        return dispatcher.pause_bulk()
+    return 0.0
+
+def metrics():
+    return dispatcher.metrics()
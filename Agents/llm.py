@@ -1,13 +1,301 @@
-from groq import Groq
+import collections
+import contextvars
+import hashlib
 import os
 import re
 import json # Import json for potential validation/debugging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-client = Groq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
+import Agents.backends as backends
+import Agents.dispatcher as dispatcher
+import Agents.tenants as tenants
+import Agents.shared_state as shared_state
+import Agents.tracing as tracing
 
-def completion(prompt, instructions, model="gemma2-9b-it", tools=None, tool_choice=None):
+# --- Model routing ---
+# Model tiers ordered from the fastest/cheapest to the largest. Every agent starts on tier 0;
+# workflow.py escalates to the next tier only when the cascade decides the output is not good enough.
+DEFAULT_MODEL_TIERS = ["gemma2-9b-it", "llama-3.3-70b-versatile"]
+
+# Agent keys used for per-agent routing.
+AGENT_KEYS = ["qst_understanding", "rubric_extraction", "ans_understanding", "grammar", "eval", "final_eval"]
+QUESTION_AGENT_KEYS = AGENT_KEYS[:2] # Stages 1-2, skipped when the question artifacts are already known
+ANSWER_AGENT_KEYS = AGENT_KEYS[2:]
+
+def _parse_model_list(value):
+    return [model.strip() for model in (value or "").split(",") if model.strip()]
+
+# Global tiers can be overridden with LLM_MODEL_TIERS="fast-model,large-model".
+MODEL_TIERS = _parse_model_list(os.environ.get("LLM_MODEL_TIERS")) or DEFAULT_MODEL_TIERS
+
+# Per-agent tiers can be overridden with LLM_MODELS_<AGENT_KEY>, e.g. LLM_MODELS_GRAMMAR="llama-3.1-8b-instant".
+AGENT_MODEL_TIERS = {
+    agent_key: _parse_model_list(os.environ.get(f"LLM_MODELS_{agent_key.upper()}")) or MODEL_TIERS
+    for agent_key in AGENT_KEYS
+}
+
+# Per-agent backend: LLM_BACKEND_<AGENT_KEY>=groq|local|http://host:port/v1 (defaults to LLM_BACKEND).
+AGENT_BACKENDS = {
+    agent_key: os.environ.get(f"LLM_BACKEND_{agent_key.upper()}", backends.DEFAULT_BACKEND)
+    for agent_key in AGENT_KEYS
+}
+
+def backend_name_for(agent=None):
+    return AGENT_BACKENDS.get(agent, backends.DEFAULT_BACKEND)
+
+def model_tiers(agent=None):
+    """Returns the ordered list of models (fastest first) configured for an agent."""
+    return AGENT_MODEL_TIERS.get(agent, MODEL_TIERS)
+
+def model_for(agent=None, tier=0):
+    """Returns the model configured for an agent at a given tier (clamped to the last tier)."""
+    tiers = model_tiers(agent)
+    return tiers[max(0, min(tier, len(tiers) - 1))]
+
+# --- Request hedging ---
+# When enabled (LLM_HEDGE=1), a call that has not returned after the LLM_HEDGE_PERCENTILE latency of
+# recent calls for the same stage is duplicated; the first response wins and the other is discarded.
+HEDGE_ENABLED = os.environ.get("LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.95"))
+# Global cap: at most this fraction of requests may be hedged. Each hedge is also charged to the tenant's token
+# quota and the rate limiter, and is only sent if both have headroom at the trigger (see _charge_hedge).
+HEDGE_MAX_RATE = float(os.environ.get("LLM_HEDGE_MAX_RATE", "0.05"))
+HEDGE_MAX_WORKERS = int(os.environ.get("LLM_HEDGE_MAX_WORKERS", "16"))
+LATENCY_WINDOW_SIZE = 200 # Recent latencies kept per stage
+LATENCY_MIN_SAMPLES = 20 # No hedging for a stage until this many latencies were observed
+
+class LatencyTracker:
+    """Keeps a sliding window of recent call latencies per stage and answers quantile queries."""
+
+    def __init__(self, window_size=LATENCY_WINDOW_SIZE, min_samples=LATENCY_MIN_SAMPLES):
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=self.window_size))
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def quantile(self, stage, q):
+        """Returns the q-quantile (0-1) of recent latencies for a stage, or None if there are too few samples."""
+        with self._lock:
+            samples = sorted(self._samples[stage])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+class HedgeBudget:
+    """Token bucket earning max_rate tokens per request; each hedge spends one token."""
+
+    def __init__(self, max_rate=HEDGE_MAX_RATE, burst=5.0):
+        self.max_rate = max_rate
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def deposit(self):
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.max_rate)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            self.hedges += 1
+            return True
+
+    def refund(self):
+        """Gives back the token of a hedge that was not sent."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1.0)
+            self.hedges -= 1
+
+latency_tracker = LatencyTracker()
+hedge_budget = HedgeBudget()
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+
+def _timed_call(stage, request_function):
+    with tracing.span("llm.request", stage=stage):
+        start_time = time.monotonic()
+        response = request_function()
+        latency_tracker.record(stage, time.monotonic() - start_time)
+    return response
+
+def _submit(stage, request_function):
+    # Each request runs in its own copy of the caller's context.
+    return _hedge_executor.submit(contextvars.copy_context().run, _timed_call, stage, request_function)
+
+def _priority_rank():
+    """Rank of the current priority class for the rate-limit wait (0 = interactive, served first)."""
+    return dispatcher.PRIORITY_CLASSES.index(dispatcher.current_priority())
+
+def _charge_hedge(tenant_id, rate_bucket, estimated_tokens):
+    """
+    Charges a hedge request to the tenant's token quota and the rate limiter without waiting: a duplicate is only
+    worth sending if both have headroom now. The charge is kept at the estimate (the discarded response's usage
+    is never reported).
+    Returns:
+        True if the hedge was charged, False (nothing charged) if either had no headroom.
+    """
+    try:
+        tenant_reservation = tenants.acquire_token_quota(tenant_id, estimated_tokens, wait=False)
+    except shared_state.RateLimitWaitTimeout:
+        return False
+    if shared_state.rate_limits_enabled():
+        try:
+            shared_state.acquire_rate_limit(rate_bucket, estimated_tokens, wait=False, priority_rank=_priority_rank())
+        except shared_state.RateLimitWaitTimeout:
+            tenants.settle_token_quota(tenant_id, tenant_reservation, 0)
+            return False
+    return True
+
+def _hedged_call(stage, request_function, charge_hedge=None):
+    """
+    Runs request_function, sending a duplicate if it has not returned by the stage's hedge trigger (and
+    charge_hedge(), if given, charged it to the quotas).
+    Returns the first successful response; raises only if every request failed.
+    """
+    hedge_budget.deposit()
+    trigger_seconds = latency_tracker.quantile(stage, HEDGE_PERCENTILE)
+    if trigger_seconds is None:
+        return _timed_call(stage, request_function)
+
+    primary = _submit(stage, request_function)
+    done, _ = wait([primary], timeout=trigger_seconds)
+    if done or not hedge_budget.try_spend():
+        return primary.result()
+    if charge_hedge is not None and not charge_hedge():
+        hedge_budget.refund()
+        tracing.current_span().add_event("hedge_skipped", reason="no_quota_headroom")
+        return primary.result()
+
+    hedge = _submit(stage, request_function)
+    tracing.current_span().add_event("hedge_sent", trigger_seconds=round(trigger_seconds, 3))
+    pending = {primary, hedge}
+    first_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    hedge_budget.hedge_wins += 1
+                tracing.set_attributes(hedged=True, hedge_won=future is hedge)
+                # Cancel the loser; a request already in flight cannot be interrupted, its response is dropped.
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+            first_error = first_error or future.exception()
+    raise first_error
+
+# --- Circuit breaker ---
+# Opens after LLM_BREAKER_FAILURES consecutive failures (a call slower than LLM_BREAKER_LATENCY_SECONDS
+# counts as a failure) and then fails fast for LLM_BREAKER_COOLDOWN_SECONDS. After the cooldown a single
+# probe call is let through (half-open): success closes the breaker, failure re-opens it.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+BREAKER_LATENCY_THRESHOLD_SECONDS = float(os.environ.get("LLM_BREAKER_LATENCY_SECONDS", "30"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 latency_threshold_seconds=BREAKER_LATENCY_THRESHOLD_SECONDS,
+                 cooldown_seconds=BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.latency_threshold_seconds = latency_threshold_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """True while calls are being rejected (open and still cooling down, or a probe is in flight)."""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.cooldown_seconds
+            return self.state == self.HALF_OPEN and self._probe_in_flight
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                    raise CircuitOpenError("LLM circuit breaker is open; failing fast.")
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError("LLM circuit breaker is half-open and a probe is in flight; failing fast.")
+                self._probe_in_flight = True
+
+    def record_success(self, latency_seconds):
+        if latency_seconds > self.latency_threshold_seconds:
+            self.record_failure()
+            return
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"LLM circuit breaker opened after {self.consecutive_failures} consecutive failures.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+# One breaker per backend, so that an unhealthy local server does not cut off Groq (and vice versa).
+breakers = collections.defaultdict(CircuitBreaker)
+breaker = breakers[backends.DEFAULT_BACKEND]
+
+def is_unavailable(agents=None):
+    """
+    True if the breaker of a backend used by one of the agents (default: every workflow agent, AGENT_KEYS) is
+    open: the workflow then switches to degraded grading. Breakers of backends these agents are not routed to
+    (LLM_BACKEND_<AGENT_KEY>) are ignored.
+    """
+    backend_names = {backend_name_for(agent) for agent in (AGENT_KEYS if agents is None else agents)}
+    return any(breakers[backend_name].is_open() for backend_name in backend_names if backend_name in breakers)
+
+# --- Fleet-wide rate limiting and response cache (Agents/shared_state.py) ---
+# Completion tokens assumed before the actual usage is known (corrected afterwards).
+ESTIMATED_COMPLETION_TOKENS = 300
+# When enabled (LLM_SHARED_CACHE=1), responses are cached fleet-wide by (backend, model, messages, tools):
+# requests are deterministic (temperature 0, fixed seed), so a node can reuse another node's response.
+SHARED_CACHE_ENABLED = os.environ.get("LLM_SHARED_CACHE", "0") == "1"
+SHARED_CACHE_TTL_SECONDS = float(os.environ.get("LLM_SHARED_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+def _response_cache_key(backend_name, model, messages, tools, tool_choice):
+    payload = json.dumps([backend_name, model, messages, tools, tool_choice], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _estimate_tokens(messages):
+    return sum(len(message["content"]) for message in messages) // 4 + ESTIMATED_COMPLETION_TOKENS
+
+def completion(prompt, instructions, model=None, tools=None, tool_choice=None, agent=None, tier=0):
+    # An explicit model wins; otherwise route on the agent's configured tiers.
+    if model is None:
+        model = model_for(agent, tier)
+    with tracing.span("llm.completion", agent=agent, model=model, tier=tier, backend=backend_name_for(agent)):
+        return _completion(prompt, instructions, model, tools, tool_choice, agent)
+
+def _completion(prompt, instructions, model, tools, tool_choice, agent):
     messages = [
         {
             "role": "system",
@@ -19,38 +307,72 @@ def completion(prompt, instructions, model="gemma2-9b-it", tools=None, tool_choi
         }
     ]
 
-    # Add tools to the request if provided
-    if tools:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=0.0,
-            seed=42,
-            stream=False,
-            tools=tools,
-            tool_choice=tool_choice # Can be "auto", "none", or {"type": "function", "function": {"name": "my_function"}}
-        )
-    else:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=0.0,
-            seed=42,
-            stream=False,
-        )
-
-    # Check if the model called a tool
-    if chat_completion.choices[0].message.tool_calls:
-        tool_call = chat_completion.choices[0].message.tool_calls[0]
-        if tool_call.type == "function":
-            # Return the arguments of the function call as a dictionary
-            return json.loads(tool_call.function.arguments)
-        else:
-            # Handle other tool types if necessary, though for now we only expect 'function'
-            # If an unexpected tool type is returned, it's an error.
-            raise ValueError(f"Unexpected tool type returned: {tool_call.type}")
-    else:
-        # If no tool was called, return the regular message content
-        # This path should ideally not be taken if tool_choice is set to 'required' or a specific tool.
-        res = chat_completion.choices[0].message.content
-        return res
+    backend_name = backend_name_for(agent)
+    backend = backends.get_backend(backend_name)
+    backend_breaker = breakers[backend_name]
+
+    cache_key = None
+    if SHARED_CACHE_ENABLED:
+        cache_key = _response_cache_key(backend_name, model, messages, tools, tool_choice)
+        cached = shared_state.cache_get("llm", cache_key)
+        tracing.set_attributes(cache_hit=cached is not None)
+        if cached is not None:
+            return cached["tool_arguments"] if cached["tool_arguments"] is not None else cached["content"]
+
+    def create_chat_completion():
+        return backend.chat(messages, model, tools=tools, tool_choice=tool_choice)
+
+    stage = agent or model
+    estimated_tokens = _estimate_tokens(messages)
+    # The tenant's own token quota is checked before taking a slot, so a throttled tenant does not hold one.
+    tenant_id = tenants.current_tenant()
+    tracing.set_attributes(estimated_tokens=estimated_tokens, tenant_id=tenant_id, priority_class=dispatcher.current_priority())
+    with tracing.span("tenant_quota.wait"):
+        tenant_reservation = tenants.acquire_token_quota(tenant_id, estimated_tokens)
+    # The reservations are settled with the reported usage, or refunded in full if no response came back
+    # (rate-limit wait timeout, open breaker, failed or timed-out call).
+    actual_tokens = 0
+    try:
+        # Calls are started in priority order, shared fairly between tenants (Agents/dispatcher.py). Calls holding a
+        # slot then wait for rate-limit capacity in priority order too, so interactive calls get it first.
+        dispatch_start_ns = time.time_ns()
+        with dispatcher.slot(cost=estimated_tokens):
+            tracing.record_span("dispatch.wait", dispatch_start_ns)
+            # Waits for fleet-wide capacity instead of sending a request the provider would reject with a 429.
+            rate_bucket = f"{backend_name}:{model}"
+            rate_reservation = None
+            if shared_state.rate_limits_enabled():
+                with tracing.span("rate_limit.wait", bucket=rate_bucket):
+                    rate_reservation = shared_state.acquire_rate_limit(rate_bucket, estimated_tokens, priority_rank=_priority_rank())
+            try:
+                backend_breaker.before_call()
+                start_time = time.monotonic()
+                try:
+                    if HEDGE_ENABLED:
+                        response = _hedged_call(stage, create_chat_completion,
+                                                lambda: _charge_hedge(tenant_id, rate_bucket, estimated_tokens))
+                    else:
+                        response = _timed_call(stage, create_chat_completion)
+                except Exception:
+                    backend_breaker.record_failure()
+                    raise
+                backend_breaker.record_success(time.monotonic() - start_time)
+                actual_tokens = (response.usage or {}).get("total_tokens")
+            finally:
+                if rate_reservation is not None:
+                    shared_state.settle_rate_limit(rate_bucket, rate_reservation, actual_tokens)
+    finally:
+        tenants.settle_token_quota(tenant_id, tenant_reservation, actual_tokens)
+    tenants.usage.record_call(tenant_id, response.usage)
+    usage = response.usage or {}
+    tracing.set_attributes(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+                           total_tokens=usage.get("total_tokens"), tool_call=response.tool_arguments is not None)
+    if cache_key is not None:
+        shared_state.cache_set("llm", cache_key, {"tool_arguments": response.tool_arguments, "content": response.content}, SHARED_CACHE_TTL_SECONDS)
+
+    # Return the arguments of the function call as a dictionary if the model called a tool
+    if response.tool_arguments is not None:
+        return response.tool_arguments
+    # If no tool was called, return the regular message content
+    # This path should ideally not be taken if tool_choice is set to 'required' or a specific tool.
+    return response.content
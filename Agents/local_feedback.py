@@ -0,0 +1,102 @@
+# Agents/local_feedback.py
+# Local (LLM-free) French feedback built from templates, from the rubric concepts, the per-concept
+# breakdown_scores and the grammar errors. Used instead of the final evaluation agent (stage 6) for
+# clear-cut results - every concept at full weight, or every concept at 0 - where the LLM would only
+# restate the breakdown, or for every result with FEEDBACK_MODE=template.
+import os
+
+# "auto": templates for clear-cut results, LLM otherwise; "template": always templates; "llm": always the LLM.
+FEEDBACK_MODE = os.environ.get("FEEDBACK_MODE", "auto")
+MAX_LISTED_CORRECTIONS = 3
+SCORE_TOLERANCE = 0.01 # Scores within this of the concept weight count as full marks
+
+ERROR_TYPE_LABELS = {
+    "grammar": "de grammaire",
+    "spelling": "d'orthographe",
+    "accentuation": "d'accentuation",
+    "style": "de style",
+}
+
+def _concept_ratios(rubric, breakdown_scores):
+    """Score / weight of each rubric concept (None if the breakdown does not cover every concept)."""
+    scores = {entry.get("concept"): entry.get("score") for entry in breakdown_scores or [] if isinstance(entry, dict)}
+    ratios = []
+    for rubric_entry in rubric or []:
+        score, weight = scores.get(rubric_entry.get("concept")), rubric_entry.get("weight", 0)
+        if not isinstance(score, (int, float)) or not weight:
+            return None
+        ratios.append((rubric_entry.get("concept"), score / weight))
+    return ratios or None
+
+def clear_cut_outcome(rubric, breakdown_scores):
+    """
+    Returns:
+        "full" if every rubric concept got its full weight, "none" if every concept got 0, None otherwise
+        (the result is nuanced and its feedback is left to the LLM).
+    """
+    ratios = _concept_ratios(rubric, breakdown_scores)
+    if ratios is None:
+        return None
+    if all(ratio >= 1 - SCORE_TOLERANCE for _, ratio in ratios):
+        return "full"
+    if all(ratio <= 0 for _, ratio in ratios):
+        return "none"
+    return None
+
+def use_template(rubric, breakdown_scores):
+    """Whether stage 6 should use the template feedback for this breakdown (see FEEDBACK_MODE)."""
+    if FEEDBACK_MODE == "template":
+        return _concept_ratios(rubric, breakdown_scores) is not None
+    if FEEDBACK_MODE == "auto":
+        return clear_cut_outcome(rubric, breakdown_scores) is not None
+    return False
+
+def _join(items):
+    items = [f"« {item} »" for item in items]
+    return items[0] if len(items) == 1 else f"{', '.join(items[:-1])} et {items[-1]}"
+
+def _grammar_sentences(grammar_errors):
+    errors = [error for error in grammar_errors or [] if isinstance(error, dict) and error.get("text") and error.get("suggestion")]
+    if not errors:
+        return ["La langue est correcte."]
+    error_types = []
+    for error in errors:
+        label = ERROR_TYPE_LABELS.get(error.get("type"), "de langue")
+        if label not in error_types:
+            error_types.append(label)
+    corrections = ", ".join(f"« {error['text']} » → « {error['suggestion']} »" for error in errors[:MAX_LISTED_CORRECTIONS])
+    noun = "Une erreur" if len(errors) == 1 else f"{len(errors)} erreurs"
+    return [f"{noun} {' et '.join(error_types)} à corriger : {corrections}."]
+
+def build_feedback(rubric, breakdown_scores, grammar_errors=None):
+    """Builds a 2-4 sentence French feedback from the rubric concepts, their scores and the grammar errors."""
+    ratios = _concept_ratios(rubric, breakdown_scores) or []
+    covered = [concept for concept, ratio in ratios if ratio >= 1 - SCORE_TOLERANCE]
+    partial = [concept for concept, ratio in ratios if 0 < ratio < 1 - SCORE_TOLERANCE]
+    missing = [concept for concept, ratio in ratios if ratio <= 0]
+
+    if ratios and len(covered) == len(ratios):
+        sentences = [f"Très bonne réponse : vous avez traité tous les points attendus ({_join(covered)}) en vous appuyant sur le texte."]
+    elif ratios and len(missing) == len(ratios):
+        sentences = [
+            "Votre réponse ne reprend pas les éléments attendus du texte.",
+            f"Relisez le texte et la question, puis reprenez les points attendus : {_join(missing)}.",
+        ]
+    else:
+        sentences = []
+        if covered:
+            sentences.append(f"Vous avez bien traité : {_join(covered)}.")
+        if partial:
+            sentences.append(f"Ces points sont évoqués mais pourraient être développés à l'aide du texte : {_join(partial)}.")
+        if missing:
+            sentences.append(f"Pensez à aborder aussi : {_join(missing)}.")
+    return " ".join(sentences + _grammar_sentences(grammar_errors))
+
+def final_evaluation(rubric, rubric_score, grammar_penalty_percent, breakdown_scores, grammar_errors=None):
+    """
+    Local replacement for a_final_eval.final_eval.
+    Returns:
+        A dict shaped like the final evaluation agent's output: {"final_score": number, "feedback": str}.
+    """
+    final_score = max(0, min(100, rubric_score * (1 - (grammar_penalty_percent / 100.0))))
+    return {"final_score": final_score, "feedback": build_feedback(rubric, breakdown_scores, grammar_errors)}
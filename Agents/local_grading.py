@@ -0,0 +1,84 @@
+# Agents/local_grading.py
+# Local (LLM-free) grading used while the LLM backend is unavailable. Results are provisional.
+import re
+import unicodedata
+
+PROVISIONAL_FEEDBACK_NO_RUBRIC = (
+    "Votre réponse a bien été enregistrée. Le service de correction est momentanément indisponible : "
+    "elle sera corrigée automatiquement dès son rétablissement."
+)
+
+def normalize_text(text):
+    """Lowercases, strips accents and collapses punctuation/whitespace (used for keyword matching)."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text.casefold()))
+
+def _concept_terms(rubric_entry):
+    terms = [keyword for keyword in rubric_entry.get("keywords", []) if normalize_text(keyword)]
+    # Concepts without keywords are matched on their own name.
+    return terms or [rubric_entry.get("concept", "")]
+
+def _term_found(term, normalized_answer_padded):
+    normalized_term = normalize_text(term)
+    return bool(normalized_term) and f" {normalized_term} " in normalized_answer_padded
+
+def heuristic_scores(answer, rubric):
+    """
+    Scores an answer against a rubric by keyword matching.
+    A concept gets its full weight when at least two of its terms (or all of them, if fewer) appear
+    in the answer, and a proportional share otherwise.
+    Returns:
+        A dict shaped like the evaluation agent's output: {"scores": [...], "total_score": number}.
+    """
+    normalized_answer_padded = f" {normalize_text(answer)} "
+    scores = []
+    for rubric_entry in rubric:
+        terms = _concept_terms(rubric_entry)
+        hits = sum(1 for term in terms if _term_found(term, normalized_answer_padded))
+        needed = min(2, len(terms))
+        ratio = min(1.0, hits / needed) if needed else 0.0
+        scores.append({"concept": rubric_entry.get("concept"), "score": round(rubric_entry.get("weight", 0) * ratio, 2)})
+    return {"scores": scores, "total_score": round(sum(entry["score"] for entry in scores), 2)}
+
+def templated_feedback(rubric, scores):
+    """Builds a short French feedback from the rubric concepts and their local scores."""
+    weights = {entry.get("concept"): entry.get("weight", 0) for entry in rubric}
+    covered = [entry["concept"] for entry in scores if entry["score"] > 0 and entry["score"] >= weights.get(entry["concept"], 0)]
+    partial = [entry["concept"] for entry in scores if 0 < entry["score"] < weights.get(entry["concept"], 0)]
+    missing = [entry["concept"] for entry in scores if entry["score"] <= 0]
+
+    sentences = []
+    if covered:
+        sentences.append(f"Votre réponse aborde les points suivants : {', '.join(covered)}.")
+    if partial:
+        sentences.append(f"Ces points sont évoqués mais pourraient être développés : {', '.join(partial)}.")
+    if missing:
+        sentences.append(f"Pensez à parler de : {', '.join(missing)}.")
+    if not covered and not partial:
+        sentences = ["Votre réponse ne reprend pas les éléments attendus du texte."] + sentences
+    sentences.append("Cette note est provisoire et sera confirmée par une correction complète.")
+    return " ".join(sentences)
+
+def degraded_evaluation(answer, rubric=None):
+    """
+    Grades an answer without any LLM call.
+    Returns:
+        A final result dict (final_score, feedback, breakdown) flagged as provisional. final_score is
+        None when no rubric is available.
+    """
+    if not rubric:
+        return {
+            "final_score": None,
+            "feedback": PROVISIONAL_FEEDBACK_NO_RUBRIC,
+            "provisional": True,
+            "grading_mode": "degraded",
+        }
+    evaluation = heuristic_scores(answer, rubric)
+    return {
+        "final_score": max(0, min(100, evaluation["total_score"])),
+        "feedback": templated_feedback(rubric, evaluation["scores"]),
+        "breakdown_scores": evaluation["scores"],
+        "provisional": True,
+        "grading_mode": "degraded",
+    }
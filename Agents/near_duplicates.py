@@ -0,0 +1,92 @@
+# Agents/near_duplicates.py
+# Near-duplicate answers within a batch. For short factual questions many students give the same answer up to
+# punctuation, accents or word order; the batch workflow grades one representative per cluster with the full
+# pipeline and reuses its content scores for the other members (which only get their own grammar pass).
+# Answers are compared on their normalized word shingles (words and pairs of adjacent words): MinHash
+# signatures and LSH banding find the candidate pairs, which are then confirmed on the exact Jaccard similarity
+# of their shingles. The rules are conservative: answers that differ by a negation, a number or the rubric
+# keywords they contain are never merged.
+import hashlib
+import os
+import zlib
+
+import numpy as np
+
+from Agents.local_grading import heuristic_scores, normalize_text
+
+DEDUP_ENABLED = os.environ.get("BATCH_DEDUP", "1") == "1"
+DEDUP_SIMILARITY_THRESHOLD = float(os.environ.get("BATCH_DEDUP_THRESHOLD", "0.7"))
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16 # 16 bands of 4 rows: pairs with a Jaccard similarity of 0.5 are candidates half of the time
+MINHASH_PRIME = 4294967311 # Smallest prime above 2**32
+MINHASH_SEED = 20240901
+
+NEGATION_WORDS = {"ne", "n", "pas", "jamais", "rien", "aucun", "aucune", "personne", "ni", "plus", "sans", "non"}
+
+_rng = np.random.default_rng(MINHASH_SEED)
+# a < 2**31 keeps a * hash + b below 2**64 (hashes are 32-bit CRCs).
+_PERMUTATION_A = _rng.integers(1, 2**31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERMUTATION_B = _rng.integers(0, 2**31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def shingles(answer):
+    """Set of the normalized words of the answer and of its pairs of adjacent words."""
+    words = normalize_text(answer).split()
+    return set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+def minhash_signature(answer_shingles):
+    """MinHash signature (MINHASH_PERMUTATIONS values) of a non-empty set of shingles."""
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in answer_shingles], dtype=np.uint64)
+    permuted = (hashes[:, None] * _PERMUTATION_A + _PERMUTATION_B) % np.uint64(MINHASH_PRIME)
+    return permuted.min(axis=0)
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second) if first or second else 1.0
+
+def _meaning_markers(answer, answer_shingles, rubric):
+    """Negation words, numbers and rubric keyword matches of the answer: near-duplicates must have the same ones."""
+    markers = frozenset(shingle for shingle in answer_shingles if " " not in shingle and (shingle in NEGATION_WORDS or shingle.isdigit()))
+    keyword_scores = tuple(entry["score"] for entry in heuristic_scores(answer, rubric)["scores"]) if rubric else ()
+    return markers, keyword_scores
+
+def cluster_id_for(answer):
+    """Stable id of the cluster represented by answer (the same across batches, for audit)."""
+    return "c-" + hashlib.sha1(normalize_text(answer).encode("utf-8")).hexdigest()[:10]
+
+def cluster_answers(answers, rubric=None, threshold=DEDUP_SIMILARITY_THRESHOLD):
+    """
+    Groups near-duplicate answers. Each answer joins the first earlier representative whose shingles have a
+    Jaccard similarity >= threshold with its own (and the same negations, numbers and rubric keyword matches),
+    or becomes a representative itself, so every member is close to its representative (no chaining).
+    Returns:
+        A list with one entry per answer, in order: {"cluster_id", "representative" (index of the cluster's
+        representative, the answer's own index for representatives), "similarity" (to the representative)}.
+    """
+    rows_per_band = MINHASH_PERMUTATIONS // LSH_BANDS
+    band_buckets = [{} for _ in range(LSH_BANDS)]
+    representatives = {} # representative index -> (shingles, markers)
+    assignments = []
+    for index, answer in enumerate(answers):
+        answer_shingles = shingles(answer)
+        if not answer_shingles:
+            assignments.append({"cluster_id": cluster_id_for(answer), "representative": index, "similarity": 1.0})
+            continue
+        markers = _meaning_markers(answer, answer_shingles, rubric)
+        signature = minhash_signature(answer_shingles)
+        band_keys = [signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes() for band in range(LSH_BANDS)]
+
+        candidates = sorted({candidate for band, key in enumerate(band_keys) for candidate in band_buckets[band].get(key, ())})
+        match = None
+        for candidate in candidates:
+            candidate_shingles, candidate_markers = representatives[candidate]
+            similarity = jaccard(answer_shingles, candidate_shingles)
+            if similarity >= threshold and markers == candidate_markers:
+                match = (candidate, similarity)
+                break
+        if match is not None:
+            assignments.append({"cluster_id": assignments[match[0]]["cluster_id"], "representative": match[0], "similarity": round(match[1], 3)})
+            continue
+        representatives[index] = (answer_shingles, markers)
+        for band, key in enumerate(band_keys):
+            band_buckets[band].setdefault(key, []).append(index)
+        assignments.append({"cluster_id": cluster_id_for(answer), "representative": index, "similarity": 1.0})
+    return assignments
@@ -0,0 +1,132 @@
+# Agents/prescreen.py
+# Local (LLM-free) pre-screen of student answers. Answers that are certainly worth 0 (empty, gibberish,
+# not written in the language of the text, or with no word in common with the text and the question) are
+# graded immediately with a standard feedback instead of going through the four answer-level LLM stages.
+# The rules are deliberately conservative: anything uncertain passes on to the LLM.
+import os
+import re
+import unicodedata
+
+from Agents.local_grading import normalize_text
+
+PRESCREEN_ENABLED = os.environ.get("PRESCREEN", "1") == "1"
+# Off-topic only when the answer has at least this many content words and none of them appears in the
+# text, the question or the expected concepts (short answers are left to the LLM).
+PRESCREEN_OFFTOPIC_MIN_WORDS = int(os.environ.get("PRESCREEN_OFFTOPIC_MIN_WORDS", "4"))
+# Share of the answer's words that must look like gibberish.
+PRESCREEN_GIBBERISH_RATIO = float(os.environ.get("PRESCREEN_GIBBERISH_RATIO", "0.6"))
+STEM_LENGTH = 5 # Words are compared on their first characters (crude stemming: "jouent" ~ "jouer")
+
+FEEDBACK_BY_REASON = {
+    "empty": "Aucune réponse n'a été saisie. Relisez la question et le texte, puis rédigez votre réponse.",
+    "gibberish": "Votre réponse n'est pas compréhensible. Relisez la question et répondez par une phrase en vous appuyant sur le texte.",
+    "language": "Votre réponse n'est pas rédigée en français. Répondez en français en vous appuyant sur le texte.",
+    "off_topic": "Votre réponse ne correspond pas à la question posée. Relisez le texte et la question, puis répondez en vous appuyant sur le texte.",
+}
+
+FRENCH_STOPWORDS = {
+    "le", "la", "les", "l", "de", "des", "du", "d", "un", "une", "et", "est", "sont", "en", "que", "qui", "il", "elle",
+    "ils", "elles", "ne", "pas", "a", "au", "aux", "sur", "dans", "pour", "par", "avec", "ce", "cette", "ces", "son",
+    "sa", "ses", "leur", "leurs", "on", "nous", "vous", "je", "tu", "se", "s", "y", "mais", "ou", "donc", "car", "c",
+    "qu", "j", "n", "m", "t", "lui", "plus", "tres", "fait", "font",
+}
+ENGLISH_STOPWORDS = {
+    "the", "and", "is", "are", "of", "to", "it", "they", "he", "she", "was", "were", "with", "for", "that", "this",
+    "his", "her", "their", "what", "because", "have", "has", "from", "there", "be", "by", "an", "not", "you",
+}
+# Common French text, used as the reference of plausible letter pairs together with the answer's own context.
+_REFERENCE_TEXT = (
+    "Le petit garçon regarde par la fenêtre pendant que sa mère prépare le repas. Il pleut depuis ce matin et les "
+    "enfants ne peuvent pas sortir jouer dans le jardin. Alors ils lisent des histoires, dessinent des animaux et "
+    "construisent une cabane avec des chaises et des couvertures. Quand le soleil revient, tout le monde court "
+    "dehors pour sauter dans les flaques d'eau. Les oiseaux chantent, le chien aboie et la journée devient joyeuse. "
+    "Chaque semaine, la classe visite la bibliothèque du quartier où chacun choisit un livre qu'il emporte chez lui."
+)
+
+def _bigrams(word):
+    return {word[index:index + 2] for index in range(len(word) - 1)}
+
+def _known_bigrams(*texts):
+    bigrams = set()
+    for text in texts:
+        for word in normalize_text(text).split():
+            bigrams |= _bigrams(word)
+    return bigrams
+
+_REFERENCE_BIGRAMS = _known_bigrams(_REFERENCE_TEXT)
+
+def _looks_like_gibberish(word, known_bigrams):
+    if len(word) < 4:
+        return False
+    if not re.search(r"[aeiouy]", word) or re.search(r"[^aeiouy]{5,}", word) or re.search(r"(.)\1{3,}", word):
+        return True
+    word_bigrams = _bigrams(word)
+    return len(word_bigrams - known_bigrams) / len(word_bigrams) > 0.5
+
+def _stems(words):
+    return {word[:STEM_LENGTH] for word in words if len(word) >= 3 and word not in FRENCH_STOPWORDS and word not in ENGLISH_STOPWORDS}
+
+def _non_latin_share(answer):
+    letters = [char for char in answer if char.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(1 for char in letters if "LATIN" not in unicodedata.name(char, "")) / len(letters)
+
+def _is_french(text_words):
+    return sum(word in FRENCH_STOPWORDS for word in text_words) >= sum(word in ENGLISH_STOPWORDS for word in text_words)
+
+def prescreen(answer, text, question, key_concepts_expected=None, rubric=None):
+    """
+    Checks an answer without any LLM call.
+    Returns:
+        A dict {"verdict": "reject" | "pass", "reason": "empty" | "gibberish" | "language" | "off_topic" | None,
+                "signals": {...}} - an answer is only rejected when it is certainly worth 0.
+    """
+    words = normalize_text(answer).split()
+    alpha_words = [word for word in words if word.isalpha()]
+    signals = {"words": len(words)}
+    if not words:
+        return {"verdict": "reject", "reason": "empty", "signals": signals}
+
+    context_terms = [question] + list(key_concepts_expected or [])
+    for rubric_entry in rubric or []:
+        context_terms.append(rubric_entry.get("concept") or "")
+        context_terms.extend(rubric_entry.get("keywords") or [])
+    context_words = normalize_text(" ".join([text] + context_terms)).split()
+    answer_stems = _stems(alpha_words)
+    overlap = len(answer_stems & _stems(context_words))
+    known_bigrams = _REFERENCE_BIGRAMS | _known_bigrams(text, question)
+    gibberish_words = [word for word in alpha_words if _looks_like_gibberish(word, known_bigrams)]
+    signals.update({
+        "content_words": len(answer_stems),
+        "overlap": overlap,
+        "gibberish_ratio": round(len(gibberish_words) / len(alpha_words), 2) if alpha_words else 0.0,
+        "non_latin_share": round(_non_latin_share(answer), 2),
+        "french_stopwords": sum(word in FRENCH_STOPWORDS for word in words),
+        "english_stopwords": sum(word in ENGLISH_STOPWORDS for word in words),
+    })
+
+    if overlap == 0:
+        # The language check only applies to French texts.
+        if _is_french(normalize_text(text).split()) and (
+            signals["non_latin_share"] > 0.5
+            or (signals["english_stopwords"] >= 2 and signals["french_stopwords"] == 0
+                and signals["english_stopwords"] >= 0.3 * len(words))
+        ):
+            return {"verdict": "reject", "reason": "language", "signals": signals}
+        if alpha_words and signals["gibberish_ratio"] >= PRESCREEN_GIBBERISH_RATIO:
+            return {"verdict": "reject", "reason": "gibberish", "signals": signals}
+        if len(answer_stems) >= PRESCREEN_OFFTOPIC_MIN_WORDS:
+            return {"verdict": "reject", "reason": "off_topic", "signals": signals}
+    return {"verdict": "pass", "reason": None, "signals": signals}
+
+def rejected_result(report, rubric=None):
+    """Final result of a rejected answer: 0 on every rubric concept, with the reason's standard feedback."""
+    breakdown_scores = [{"concept": rubric_entry.get("concept"), "score": 0} for rubric_entry in rubric or []]
+    return {
+        "final_score": 0,
+        "feedback": FEEDBACK_BY_REASON[report["reason"]],
+        "breakdown_scores": breakdown_scores,
+        "grading_mode": "prescreen",
+        "prescreen_reason": report["reason"],
+    }
@@ -0,0 +1,51 @@
+# Agents/prompts.py
+# Prompt variants. Every agent call resends the agent's INSTRUCTIONS and tool schema, so their size is paid on
+# each of the six calls of an evaluation (latency and tokens-per-minute headroom). The "compact" variant of an
+# agent uses its COMPACT_INSTRUCTIONS and a tool schema without property descriptions (types, enums, bounds and
+# required fields are kept, so the output is validated exactly as before - see validation.py).
+# Prompt sizes per stage, and the regression check: python -m benchmark.prompt_budget
+import copy
+import os
+
+import Agents.llm as llm
+
+PROMPT_VARIANTS = ("full", "compact")
+PROMPT_VARIANT = os.environ.get("PROMPT_VARIANT", "full")
+# Per-agent variant with PROMPT_VARIANT_<AGENT_KEY>, e.g. PROMPT_VARIANT_GRAMMAR=compact.
+AGENT_PROMPT_VARIANTS = {
+    agent_key: os.environ.get(f"PROMPT_VARIANT_{agent_key.upper()}", PROMPT_VARIANT)
+    for agent_key in llm.AGENT_KEYS
+}
+
+_compact_schemas = {}
+
+def variant_for(agent):
+    return AGENT_PROMPT_VARIANTS.get(agent, PROMPT_VARIANT)
+
+def instructions(agent, full_instructions, compact_instructions):
+    """The agent's system prompt for its configured variant."""
+    return compact_instructions if variant_for(agent) == "compact" else full_instructions
+
+def _strip_descriptions(node):
+    if isinstance(node, dict):
+        return {key: _strip_descriptions(value) for key, value in node.items() if key != "description"}
+    if isinstance(node, list):
+        return [_strip_descriptions(value) for value in node]
+    return node
+
+def compact_schema(tool_schema):
+    """Copy of a *_TOOL_SCHEMA without the descriptions of its parameters (the function description is kept)."""
+    compact = copy.deepcopy(tool_schema)
+    for tool in compact:
+        tool["function"]["parameters"] = _strip_descriptions(tool["function"]["parameters"])
+    return compact
+
+def tool_schema(agent, full_schema):
+    """The agent's tool schema for its configured variant (compact schemas are built once)."""
+    if variant_for(agent) != "compact":
+        return full_schema
+    cached = _compact_schemas.get(id(full_schema))
+    if cached is None:
+        # The full schema is kept in the entry so that its id cannot be reused by another object.
+        cached = _compact_schemas[id(full_schema)] = (full_schema, compact_schema(full_schema))
+    return cached[1]
@@ -0,0 +1,233 @@
+# Agents/shared_state.py
+# State shared by every process of a deployment: a distributed rate limiter (requests and tokens per
+# minute, so that the fleet as a whole stays under the provider limits) and shared caches (LLM responses,
+# question artifacts), so that work done by one node is reused by the others.
+# SHARED_STATE_BACKEND=memory keeps everything process-local (single process); SHARED_STATE_BACKEND=mongo
+# stores it in MongoDB (MONGO_URI / MONGO_DB_NAME, the database already used by flask-app.py).
+import collections
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "memory")
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB_NAME = os.environ.get("MONGO_DB_NAME", "evaluation_results_db")
+RATE_WINDOWS_COLLECTION_NAME = "shared_rate_windows"
+CACHE_COLLECTION_NAME = "shared_cache"
+
+# Rate limits per model, for the whole fleet (0 = no limit).
+RATE_LIMIT_RPM = int(os.environ.get("LLM_RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_TPM = int(os.environ.get("LLM_RATE_LIMIT_TPM", "0"))
+# Limits are enforced over fixed windows of this length (limits scaled accordingly): shorter windows
+# smooth bursts at window boundaries.
+RATE_WINDOW_SECONDS = float(os.environ.get("LLM_RATE_WINDOW_SECONDS", "10"))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "120"))
+
+class RateLimitWaitTimeout(RuntimeError):
+    """Raised when a call could not get rate-limit capacity within RATE_LIMIT_MAX_WAIT_SECONDS."""
+
+class MemoryStore:
+    """Process-local store (single-process deployments and tests)."""
+
+    def __init__(self):
+        self._windows = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def try_consume(self, bucket, window_start, requests, tokens, request_limit, token_limit):
+        """Adds (requests, tokens) to the bucket's window if that keeps it within both limits. Returns True if added."""
+        with self._lock:
+            for key in [key for key in self._windows if key[1] < window_start]:
+                del self._windows[key]
+            used_requests, used_tokens = self._windows.get((bucket, window_start), (0, 0))
+            if (request_limit and used_requests + requests > request_limit) or (token_limit and used_tokens + tokens > token_limit):
+                return False
+            self._windows[(bucket, window_start)] = (used_requests + requests, used_tokens + tokens)
+            return True
+
+    def add_tokens(self, bucket, window_start, tokens):
+        """Unconditionally corrects a window's token count (estimate vs. actual usage)."""
+        with self._lock:
+            used_requests, used_tokens = self._windows.get((bucket, window_start), (0, 0))
+            self._windows[(bucket, window_start)] = (used_requests, used_tokens + tokens)
+
+    def cache_get(self, namespace, key):
+        with self._lock:
+            entry = self._cache.get((namespace, key))
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._cache[(namespace, key)]
+                return None
+            return value
+
+    def cache_set(self, namespace, key, value, ttl_seconds):
+        with self._lock:
+            self._cache[(namespace, key)] = (value, time.time() + ttl_seconds)
+
+    def cache_delete(self, namespace, key):
+        with self._lock:
+            self._cache.pop((namespace, key), None)
+
+class MongoStore:
+    """
+    MongoDB store. Rate windows are documents {_id: "<bucket>|<window_start>", requests, tokens}, updated
+    with a conditional $inc so that concurrent processes never exceed the limits; cache entries are
+    {_id: "<namespace>|<key>", value}. Both expire through TTL indexes on expires_at.
+    """
+
+    def __init__(self, uri=MONGO_URI, db_name=MONGO_DB_NAME):
+        from pymongo import MongoClient
+        db = MongoClient(uri)[db_name]
+        self._windows = db[RATE_WINDOWS_COLLECTION_NAME]
+        self._cache = db[CACHE_COLLECTION_NAME]
+        self._windows.create_index("expires_at", expireAfterSeconds=0)
+        self._cache.create_index("expires_at", expireAfterSeconds=0)
+
+    def try_consume(self, bucket, window_start, requests, tokens, request_limit, token_limit):
+        from pymongo.errors import DuplicateKeyError
+        window_filter = {"_id": f"{bucket}|{window_start}"}
+        if request_limit:
+            window_filter["requests"] = {"$lte": request_limit - requests}
+        if token_limit:
+            window_filter["tokens"] = {"$lte": token_limit - tokens}
+        try:
+            self._windows.update_one(
+                window_filter,
+                {"$inc": {"requests": requests, "tokens": tokens},
+                 "$setOnInsert": {"expires_at": datetime.utcfromtimestamp(window_start) + timedelta(seconds=2 * RATE_WINDOW_SECONDS)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The window exists but is full: the filter did not match, and the upsert collided with it.
+            return False
+        return True
+
+    def add_tokens(self, bucket, window_start, tokens):
+        self._windows.update_one({"_id": f"{bucket}|{window_start}"}, {"$inc": {"tokens": tokens}})
+
+    def cache_get(self, namespace, key):
+        entry = self._cache.find_one({"_id": f"{namespace}|{key}"})
+        if entry is None or entry["expires_at"] < datetime.utcnow():
+            return None
+        return entry["value"]
+
+    def cache_set(self, namespace, key, value, ttl_seconds):
+        self._cache.replace_one(
+            {"_id": f"{namespace}|{key}"},
+            {"value": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl_seconds)},
+            upsert=True,
+        )
+
+    def cache_delete(self, namespace, key):
+        self._cache.delete_one({"_id": f"{namespace}|{key}"})
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Returns the shared store selected by SHARED_STATE_BACKEND (created on first use)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SHARED_STATE_BACKEND == "mongo":
+                _store = MongoStore()
+            elif SHARED_STATE_BACKEND == "memory":
+                _store = MemoryStore()
+            else:
+                raise ValueError(f"Unknown SHARED_STATE_BACKEND: {SHARED_STATE_BACKEND}")
+        return _store
+
+def set_store(store):
+    """Replaces the shared store (e.g. a MongoStore on an existing connection)."""
+    global _store
+    with _store_lock:
+        _store = store
+
+def rate_limits_enabled():
+    return bool(RATE_LIMIT_RPM or RATE_LIMIT_TPM)
+
+# Callers of this process waiting for capacity, per bucket and priority rank: a caller only takes capacity when
+# no caller of a higher priority (lower rank) is waiting for the same bucket.
+_rate_waiters = threading.Condition()
+_waiting_ranks = collections.defaultdict(collections.Counter)
+
+def _outranked(bucket, priority_rank):
+    """Whether a caller of a higher priority is waiting for the bucket (caller holds _rate_waiters)."""
+    return any(count for rank, count in _waiting_ranks[bucket].items() if rank < priority_rank)
+
+def acquire_rate_limit(bucket, estimated_tokens, requests_per_minute=None, tokens_per_minute=None, wait=True, priority_rank=0):
+    """
+    Blocks until the bucket (e.g. "groq:<model>") has capacity for one request of estimated_tokens in the
+    current window, then records it. The limits default to LLM_RATE_LIMIT_RPM / LLM_RATE_LIMIT_TPM (0 = no limit).
+    Waiting callers of this process are served by priority_rank (0 first, e.g. the index of the dispatcher
+    priority class): when a window opens, lower-priority callers wait until the higher-priority ones got capacity.
+    With wait=False, the request is only recorded if the current window has capacity now (and no higher-priority
+    caller is waiting).
+    Returns:
+        The reservation (window start, tokens charged), to pass to settle_rate_limit once the actual usage is
+        known. The tokens charged are capped at the window's token limit, so they can be lower than estimated_tokens.
+    Raises:
+        RateLimitWaitTimeout: if no capacity was found within RATE_LIMIT_MAX_WAIT_SECONDS (immediately with wait=False).
+    """
+    requests_per_minute = RATE_LIMIT_RPM if requests_per_minute is None else requests_per_minute
+    tokens_per_minute = RATE_LIMIT_TPM if tokens_per_minute is None else tokens_per_minute
+    request_limit = int(requests_per_minute * RATE_WINDOW_SECONDS / 60) if requests_per_minute else 0
+    token_limit = int(tokens_per_minute * RATE_WINDOW_SECONDS / 60) if tokens_per_minute else 0
+    if request_limit:
+        request_limit = max(1, request_limit)
+    if token_limit:
+        # A request larger than a whole window is let through alone rather than blocked forever.
+        estimated_tokens = min(estimated_tokens, token_limit)
+    deadline = time.monotonic() + RATE_LIMIT_MAX_WAIT_SECONDS
+    store = get_store()
+    with _rate_waiters:
+        _waiting_ranks[bucket][priority_rank] += 1
+    try:
+        while True:
+            now = time.time()
+            window_start = int(now // RATE_WINDOW_SECONDS * RATE_WINDOW_SECONDS)
+            with _rate_waiters:
+                outranked = _outranked(bucket, priority_rank)
+            if not outranked and store.try_consume(bucket, window_start, 1, estimated_tokens, request_limit, token_limit):
+                return window_start, estimated_tokens
+            # Outranked callers are woken as soon as a higher-priority caller stops waiting, others at the next window.
+            wait_seconds = window_start + RATE_WINDOW_SECONDS - now
+            if not wait or time.monotonic() + (0 if outranked else wait_seconds) > deadline:
+                raise RateLimitWaitTimeout(f"No rate-limit capacity for {bucket} within {RATE_LIMIT_MAX_WAIT_SECONDS}s.")
+            with _rate_waiters:
+                _rate_waiters.wait(timeout=wait_seconds + 0.01)
+    finally:
+        with _rate_waiters:
+            _waiting_ranks[bucket][priority_rank] -= 1
+            if not _waiting_ranks[bucket][priority_rank]:
+                del _waiting_ranks[bucket][priority_rank]
+            _rate_waiters.notify_all()
+
+def settle_rate_limit(bucket, reservation, actual_tokens):
+    """Corrects the window's token count of a reservation with the actual usage reported by the provider."""
+    window_start, charged_tokens = reservation
+    if actual_tokens is not None and actual_tokens != charged_tokens:
+        get_store().add_tokens(bucket, window_start, actual_tokens - charged_tokens)
+
+# Caches are best effort: an unreachable store is a cache miss, not a failed evaluation.
+def cache_get(namespace, key):
+    try:
+        return get_store().cache_get(namespace, key)
+    except Exception as e:
+        print(f"Shared cache read failed ({namespace}): {e}")
+        return None
+
+def cache_set(namespace, key, value, ttl_seconds):
+    try:
+        get_store().cache_set(namespace, key, value, ttl_seconds)
+    except Exception as e:
+        print(f"Shared cache write failed ({namespace}): {e}")
+
+def cache_delete(namespace, key):
+    try:
+        get_store().cache_delete(namespace, key)
+    except Exception as e:
+        print(f"Shared cache delete failed ({namespace}): {e}")
@@ -0,0 +1,107 @@
+# Agents/similarity.py
+# Local, CPU-only semantic alignment between student answers and the expected content.
+# Answers and references (text passages and key_concepts_expected) are represented by accent-insensitive
+# character n-grams weighted by IDF; a whole batch of answers is scored with a single matrix multiply.
+import functools
+import re
+
+import numpy as np
+
+from Agents.local_grading import normalize_text
+
+NGRAM_RANGE = (3, 5)
+# Share of the alignment coming from key concept coverage vs. best passage coverage.
+CONCEPT_WEIGHT = 0.7
+PASSAGE_WEIGHT = 0.3
+
+def split_passages(text):
+    """Splits the context text into sentence-level passages."""
+    return [passage.strip() for passage in re.split(r"(?<=[.!?;])\s+|\n{2,}", text or "") if passage.strip()]
+
+def char_ngrams(text, ngram_range=NGRAM_RANGE):
+    """Set of character n-grams of each normalized word, padded with spaces at word boundaries."""
+    ngrams = set()
+    low, high = ngram_range
+    for word in normalize_text(text).split():
+        padded = f" {word} "
+        for size in range(low, high + 1):
+            for start in range(max(1, len(padded) - size + 1)):
+                ngrams.add(padded[start:start + size])
+    return ngrams
+
+class SimilarityEngine:
+    """
+    Precomputes the reference matrix for one (text, key concepts) pair.
+    Each reference row holds the IDF weights of its n-grams, normalized to sum to 1, so that
+    answer_presence @ references.T is the share of each reference's (IDF-weighted) n-grams found in the
+    answer: concept coverage for concept rows, passage coverage for passage rows.
+    """
+
+    def __init__(self, text, key_concepts, ngram_range=NGRAM_RANGE):
+        self.ngram_range = ngram_range
+        self.key_concepts = [concept for concept in (key_concepts or []) if normalize_text(concept)]
+        self.passages = split_passages(text)
+        references = [char_ngrams(reference, ngram_range) for reference in self.key_concepts + self.passages]
+
+        self.vocabulary = {}
+        for reference_ngrams in references:
+            for ngram in reference_ngrams:
+                self.vocabulary.setdefault(ngram, len(self.vocabulary))
+
+        presence = np.zeros((len(references), len(self.vocabulary)), dtype=np.float32)
+        for row, reference_ngrams in enumerate(references):
+            presence[row, [self.vocabulary[ngram] for ngram in reference_ngrams]] = 1.0
+        document_frequency = presence.sum(axis=0)
+        idf = np.log((1.0 + len(references)) / (1.0 + document_frequency)) + 1.0
+
+        weighted = presence * idf
+        row_sums = weighted.sum(axis=1, keepdims=True)
+        self.references = np.divide(weighted, row_sums, out=np.zeros_like(weighted), where=row_sums > 0)
+
+    def _presence_matrix(self, answers):
+        presence = np.zeros((len(answers), len(self.vocabulary)), dtype=np.float32)
+        for row, answer in enumerate(answers):
+            columns = [self.vocabulary[ngram] for ngram in char_ngrams(answer, self.ngram_range) if ngram in self.vocabulary]
+            presence[row, columns] = 1.0
+        return presence
+
+    def score(self, answers):
+        """
+        Scores a batch of answers.
+        Returns:
+            A dict of NumPy arrays:
+            - "alignment": (n_answers,) overall alignment, 0-100.
+            - "concept_coverage": (n_answers, n_concepts) coverage of each key concept, 0-1.
+            - "passage_coverage": (n_answers,) coverage of the best matching passage, 0-1.
+        """
+        n_concepts = len(self.key_concepts)
+        coverage = self._presence_matrix(answers) @ self.references.T  # The single matrix multiply.
+        concept_coverage = coverage[:, :n_concepts]
+        passage_coverage = coverage[:, n_concepts:].max(axis=1) if self.passages else np.zeros(len(answers), dtype=np.float32)
+
+        if n_concepts:
+            alignment = CONCEPT_WEIGHT * concept_coverage.mean(axis=1) + PASSAGE_WEIGHT * passage_coverage
+        else:
+            alignment = passage_coverage
+        return {
+            "alignment": np.clip(np.round(alignment * 100.0, 2), 0, 100),
+            "concept_coverage": concept_coverage,
+            "passage_coverage": passage_coverage,
+        }
+
+@functools.lru_cache(maxsize=64)
+def _cached_engine(text, key_concepts):
+    return SimilarityEngine(text, list(key_concepts))
+
+def get_engine(text, key_concepts):
+    """Returns a (cached) engine for a (text, key concepts) pair."""
+    return _cached_engine(text or "", tuple(key_concepts or ()))
+
+def compute_alignments(text, key_concepts, answers):
+    """Overall alignment (0-100) for each answer, as a list of floats."""
+    if not answers:
+        return []
+    return [round(float(value), 2) for value in get_engine(text, key_concepts).score(list(answers))["alignment"]]
+
+def compute_alignment(text, key_concepts, answer):
+    return compute_alignments(text, key_concepts, [answer])[0]
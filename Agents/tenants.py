@@ -0,0 +1,176 @@
+# Agents/tenants.py
+# Tenants (schools) sharing the deployment and its LLM account. Every LLM call is attributed to the tenant of
+# the caller's context (`with tenants.tenant("ecole-a"):`, set by flask-app.py from the X-Tenant-ID header),
+# and each tenant gets:
+#   - a concurrency quota: at most max_concurrency of its calls in flight (enforced by Agents/dispatcher.py,
+#     which also shares the slots between tenants by deficit round robin, in proportion to their weight);
+#   - a token quota: tokens_per_minute for the whole fleet, through the shared rate limiter (shared_state.py);
+#   - usage metrics (calls, tokens, evaluations, time throttled by the quota), kept in memory and flushed to
+#     the MongoDB collection TENANT_USAGE_COLLECTION_NAME as one document per tenant and day.
+# Quotas: TENANT_QUOTAS='{"ecole-a": {"max_concurrency": 8, "tokens_per_minute": 60000, "weight": 2}}', and
+# TENANT_DEFAULT_* for the tenants not listed.
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import Agents.shared_state as shared_state
+
+DEFAULT_TENANT = "default"
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+TENANT_DEFAULT_MAX_CONCURRENCY = int(os.environ.get("TENANT_DEFAULT_MAX_CONCURRENCY", "8"))
+TENANT_DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("TENANT_DEFAULT_TOKENS_PER_MINUTE", "0")) # 0 = no limit
+TENANT_DEFAULT_WEIGHT = float(os.environ.get("TENANT_DEFAULT_WEIGHT", "1"))
+TENANT_QUOTAS = json.loads(os.environ.get("TENANT_QUOTAS", "{}"))
+TENANT_USAGE_COLLECTION_NAME = os.environ.get("MONGO_TENANT_USAGE_COLLECTION_NAME", "tenant_usage")
+TENANT_USAGE_FLUSH_SECONDS = float(os.environ.get("TENANT_USAGE_FLUSH_SECONDS", "10"))
+USAGE_FIELDS = ("calls", "prompt_tokens", "completion_tokens", "total_tokens", "evaluations", "throttled_seconds")
+
+_tenant = contextvars.ContextVar("tenant_id", default=DEFAULT_TENANT)
+
+def is_valid_tenant_id(tenant_id):
+    return isinstance(tenant_id, str) and bool(TENANT_ID_PATTERN.match(tenant_id))
+
+def current_tenant():
+    return _tenant.get()
+
+@contextlib.contextmanager
+def tenant(tenant_id):
+    """Attributes the enclosed LLM calls (in this thread) to tenant_id."""
+    if not is_valid_tenant_id(tenant_id):
+        raise ValueError(f"Invalid tenant id: {tenant_id!r}")
+    token = _tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+def set_thread_tenant(tenant_id):
+    """Sets the tenant of the calling thread (e.g. in a ThreadPoolExecutor initializer)."""
+    _tenant.set(tenant_id)
+
+def quota(tenant_id):
+    """The tenant's quota: {"max_concurrency", "tokens_per_minute", "weight"} (TENANT_QUOTAS over the defaults)."""
+    configured = TENANT_QUOTAS.get(tenant_id, {})
+    return {
+        "max_concurrency": int(configured.get("max_concurrency", TENANT_DEFAULT_MAX_CONCURRENCY)),
+        "tokens_per_minute": int(configured.get("tokens_per_minute", TENANT_DEFAULT_TOKENS_PER_MINUTE)),
+        "weight": max(0.01, float(configured.get("weight", TENANT_DEFAULT_WEIGHT))),
+    }
+
+# --- Token quota ---
+
+def acquire_token_quota(tenant_id, estimated_tokens, wait=True):
+    """
+    Waits for the tenant's fleet-wide token quota to have room for estimated_tokens (with wait=False, only
+    charges it if there is room now).
+    Returns:
+        The reservation to pass to settle_token_quota, or None if the tenant has no token quota.
+    Raises:
+        shared_state.RateLimitWaitTimeout: if the quota stayed exhausted for RATE_LIMIT_MAX_WAIT_SECONDS (immediately
+        with wait=False).
+    """
+    tokens_per_minute = quota(tenant_id)["tokens_per_minute"]
+    if not tokens_per_minute:
+        return None
+    start_time = time.monotonic()
+    reservation = shared_state.acquire_rate_limit(f"tenant:{tenant_id}", estimated_tokens, requests_per_minute=0,
+                                                  tokens_per_minute=tokens_per_minute, wait=wait)
+    throttled_seconds = time.monotonic() - start_time
+    if throttled_seconds > 0.05:
+        usage.record(tenant_id, throttled_seconds=throttled_seconds)
+    return reservation
+
+def settle_token_quota(tenant_id, reservation, actual_tokens):
+    if reservation is not None:
+        shared_state.settle_rate_limit(f"tenant:{tenant_id}", reservation, actual_tokens)
+
+# --- Usage metrics ---
+
+class TenantUsage:
+    """
+    Per-tenant usage counters: totals since the process started (for /metrics/tenants), and increments not
+    yet written to MongoDB, flushed by a background thread (see start_flusher).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = collections.defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        self._pending = collections.defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        self._collection = None
+        self._flusher = None
+
+    def record(self, tenant_id, **increments):
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        with self._lock:
+            for field, value in increments.items():
+                if value:
+                    self._totals[tenant_id][field] += value
+                    self._pending[(tenant_id, day)][field] += value
+
+    def record_call(self, tenant_id, usage_dict):
+        usage_dict = usage_dict or {}
+        self.record(
+            tenant_id, calls=1, prompt_tokens=usage_dict.get("prompt_tokens") or 0,
+            completion_tokens=usage_dict.get("completion_tokens") or 0, total_tokens=usage_dict.get("total_tokens") or 0,
+        )
+
+    def totals(self):
+        with self._lock:
+            return {tenant_id: {field: round(value, 3) if isinstance(value, float) else value for field, value in counters.items()}
+                    for tenant_id, counters in self._totals.items()}
+
+    def flush(self):
+        """Writes the pending increments to the collection (kept for the next flush if the write fails)."""
+        if self._collection is None:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, collections.defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        for (tenant_id, day), increments in pending.items():
+            try:
+                self._collection.update_one(
+                    {"_id": f"{tenant_id}:{day}"},
+                    {"$inc": {field: value for field, value in increments.items() if value},
+                     "$set": {"tenant_id": tenant_id, "day": day, "updated_at": datetime.now(timezone.utc)}},
+                    upsert=True,
+                )
+            except Exception as e:
+                print(f"Tenant usage flush failed ({tenant_id}, {day}): {e}")
+                with self._lock:
+                    for field, value in increments.items():
+                        self._pending[(tenant_id, day)][field] += value
+
+    def start_flusher(self, collection, interval_seconds=TENANT_USAGE_FLUSH_SECONDS):
+        """Flushes the usage to collection every interval_seconds, in a daemon thread."""
+        self._collection = collection
+        if self._flusher is not None:
+            return
+
+        def flush_periodically():
+            while True:
+                time.sleep(interval_seconds)
+                self.flush()
+
+        self._flusher = threading.Thread(target=flush_periodically, name="tenant-usage-flush", daemon=True)
+        self._flusher.start()
+
+usage = TenantUsage()
+
+def record_evaluation(tenant_id):
+    usage.record(tenant_id, evaluations=1)
+
+def read_daily_usage(collection, tenant_id=None, days=7):
+    """Stored usage documents of the last days (all tenants, or one), most recent first."""
+    since = datetime.fromtimestamp(time.time() - days * 86400, timezone.utc).strftime("%Y-%m-%d")
+    query = {"day": {"$gte": since}}
+    if tenant_id:
+        query["tenant_id"] = tenant_id
+    return [
+        {key: value for key, value in document.items() if key not in ("_id", "updated_at")}
+        for document in collection.find(query).sort([("day", -1), ("tenant_id", 1)])
+    ]
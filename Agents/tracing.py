@@ -0,0 +1,271 @@
+# Agents/tracing.py
+# OpenTelemetry-style tracing of a run: the workflow, each agent call and its attempts, retry sleeps, LLM calls
+# (with their quota, dispatch and rate-limit waits) and MongoDB writes are spans with attributes (stage, model,
+# tokens, attempt, cache hit...), so the time of a slow evaluation can be attributed exactly.
+# Spans are exported in batches by a background thread, with TRACING_EXPORTER:
+#   - "jsonl": one span per line in TRACING_JSONL_PATH;
+#   - "otlp": OTLP/HTTP JSON to a collector (TRACING_OTLP_ENDPOINT, e.g. the OpenTelemetry Collector or Jaeger);
+#   - "off" (default): spans are not created at all (span() yields a no-op span).
+# The current span is carried by a context variable; work handed to another thread keeps its parent with
+# propagate(). Incoming W3C traceparent headers are continued (see start_span).
+import atexit
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+import httpx
+
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "off")
+TRACING_JSONL_PATH = os.environ.get("TRACING_JSONL_PATH", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.environ.get("TRACING_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "student-answer-grading")
+TRACING_EXPORT_INTERVAL_SECONDS = float(os.environ.get("TRACING_EXPORT_INTERVAL_SECONDS", "2"))
+TRACING_MAX_QUEUED_SPANS = int(os.environ.get("TRACING_MAX_QUEUED_SPANS", "10000")) # Oldest spans are dropped beyond
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+def enabled():
+    return TRACING_EXPORTER in ("jsonl", "otlp")
+
+class Span:
+    """One timed operation of a trace. Attribute values are str, bool, int or float."""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "start_time_ns", "end_time_ns", "attributes", "events",
+                 "status", "status_message")
+
+    def __init__(self, name, trace_id, parent_span_id=None, attributes=None, start_time_ns=None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.start_time_ns = start_time_ns or time.time_ns()
+        self.end_time_ns = None
+        self.attributes = {}
+        self.events = []
+        self.status = "OK"
+        self.status_message = None
+        self.set_attributes(**(attributes or {}))
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value if isinstance(value, (str, bool, int, float)) else str(value)
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name, **attributes):
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes})
+
+    def set_error(self, error):
+        self.status = "ERROR"
+        self.status_message = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def traceparent(self):
+        """W3C traceparent header value of the span (for outgoing requests)."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self, end_time_ns=None):
+        if self.end_time_ns is None:
+            self.end_time_ns = end_time_ns or time.time_ns()
+            exporter.enqueue(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_span_id": self.parent_span_id, "name": self.name,
+            "start_time_ns": self.start_time_ns, "end_time_ns": self.end_time_ns,
+            "duration_ms": round((self.end_time_ns - self.start_time_ns) / 1e6, 3), "attributes": self.attributes,
+            "events": self.events, "status": self.status, "status_message": self.status_message,
+        }
+
+class _NoopSpan:
+    """Stands in for a span while tracing is off."""
+
+    trace_id = span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def set_error(self, error):
+        pass
+
+    def end(self, end_time_ns=None):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+def parse_traceparent(traceparent):
+    """
+    Returns:
+        The (trace_id, parent_span_id) of a W3C traceparent header, or None if it is absent or malformed.
+    """
+    match = TRACEPARENT_PATTERN.match((traceparent or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2)
+
+def start_span(name, traceparent=None, start_time_ns=None, **attributes):
+    """
+    Starts a span (not made current, see span()): a child of the current span, or of the remote span of an
+    incoming traceparent header, or the root of a new trace.
+    """
+    if not enabled():
+        return NOOP_SPAN
+    parent = _current_span.get()
+    remote_parent = parse_traceparent(traceparent) if traceparent else None
+    if remote_parent is not None:
+        trace_id, parent_span_id = remote_parent
+    elif parent is not None:
+        trace_id, parent_span_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_span_id = secrets.token_hex(16), None
+    return Span(name, trace_id, parent_span_id, attributes, start_time_ns)
+
+def attach(span):
+    """Makes span the current span. Returns the token to pass to detach."""
+    return _current_span.set(span if span is not NOOP_SPAN else None)
+
+def detach(token):
+    _current_span.reset(token)
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Runs the enclosed block in a new current span; an exception escaping the block marks the span as failed."""
+    if not enabled():
+        yield NOOP_SPAN
+        return
+    current = start_span(name, **attributes)
+    token = attach(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        detach(token)
+        current.end()
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+def current_trace_id():
+    """Trace id of the current span (returned to API clients), or None while tracing is off or outside a span."""
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
+
+def set_attributes(**attributes):
+    """Sets attributes on the current span."""
+    current_span().set_attributes(**attributes)
+
+def record_span(name, start_time_ns, end_time_ns=None, **attributes):
+    """Records an already finished operation (e.g. a wait measured around a with statement) as a child span."""
+    if enabled():
+        start_span(name, start_time_ns=start_time_ns, **attributes).end(end_time_ns)
+
+def sleep(seconds, reason):
+    """time.sleep recorded as a "sleep" span."""
+    with span("sleep", reason=reason, seconds=seconds):
+        time.sleep(seconds)
+
+def propagate(function):
+    """Wraps function so that, run in another thread, its spans are children of the current span."""
+    parent = _current_span.get()
+    if parent is None:
+        return function
+
+    def run_in_parent(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return run_in_parent
+
+# --- Export ---
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+def otlp_payload(spans):
+    """OTLP/HTTP JSON request body (ExportTraceServiceRequest) for a list of ended spans."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": TRACING_SERVICE_NAME})},
+        "scopeSpans": [{
+            "scope": {"name": "Agents.tracing"},
+            "spans": [{
+                "traceId": ended.trace_id, "spanId": ended.span_id, "parentSpanId": ended.parent_span_id or "",
+                "name": ended.name, "kind": 1, # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(ended.start_time_ns), "endTimeUnixNano": str(ended.end_time_ns),
+                "attributes": _otlp_attributes(ended.attributes),
+                "events": [{"timeUnixNano": str(event["time_ns"]), "name": event["name"], "attributes": _otlp_attributes(event["attributes"])}
+                           for event in ended.events],
+                "status": {"code": 2, "message": ended.status_message or ""} if ended.status == "ERROR" else {"code": 1},
+            } for ended in spans],
+        }],
+    }]}
+
+class SpanExporter:
+    """Queues ended spans and writes them in batches from a daemon thread (started with the first span)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = collections.deque(maxlen=TRACING_MAX_QUEUED_SPANS)
+        self._thread = None
+        self._http = None
+        self.dropped = 0
+
+    def enqueue(self, span):
+        with self._lock:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._export_periodically, name="tracing-export", daemon=True)
+                self._thread.start()
+
+    def _export_periodically(self):
+        while True:
+            time.sleep(TRACING_EXPORT_INTERVAL_SECONDS)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            spans, self._queue = list(self._queue), collections.deque(maxlen=TRACING_MAX_QUEUED_SPANS)
+        if not spans:
+            return
+        try:
+            if TRACING_EXPORTER == "jsonl":
+                with open(TRACING_JSONL_PATH, "a", encoding="utf-8") as traces_file:
+                    traces_file.writelines(json.dumps(ended.to_dict(), ensure_ascii=False) + "\n" for ended in spans)
+            elif TRACING_EXPORTER == "otlp":
+                if self._http is None:
+                    self._http = httpx.Client(timeout=10.0)
+                self._http.post(TRACING_OTLP_ENDPOINT, json=otlp_payload(spans)).raise_for_status()
+        except Exception as e:
+            # Traces are best effort: a failed export never affects grading.
+            print(f"Trace export failed ({len(spans)} spans dropped): {e}")
+
+exporter = SpanExporter()
+atexit.register(exporter.flush)
@@ -0,0 +1,313 @@
+# Agents/validation.py
+import copy
+
+import Agents.a_ans_understanding as answer_understanding_agent
+import Agents.a_qst_understanding as question_understanding_agent
+import Agents.a_rubric_extraction as rubric_extraction_agent
+import Agents.a_grammar_language as grammar_language_agent
+import Agents.a_eval as eval_agent
+import Agents.a_final_eval as final_eval_agent
+
+# Tool schemas by agent key (the same keys as llm.AGENT_KEYS).
+TOOL_SCHEMAS = {
+    "qst_understanding": question_understanding_agent.QST_UNDERSTANDING_TOOL_SCHEMA,
+    "rubric_extraction": rubric_extraction_agent.RUBRIC_EXTRACTION_TOOL_SCHEMA,
+    "ans_understanding": answer_understanding_agent.ANS_UNDERSTANDING_TOOL_SCHEMA,
+    "grammar": grammar_language_agent.GRAMMAR_TOOL_SCHEMA,
+    "eval": eval_agent.EVAL_TOOL_SCHEMA,
+    "final_eval": final_eval_agent.FINAL_EVAL_TOOL_SCHEMA,
+}
+
+_TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+}
+
+def compile_schema(schema):
+    """
+    Compiles the JSON-schema subset used by the tool schemas (type, properties, required, items,
+    enum, minimum, maximum) into a checker function.
+    Returns:
+        A function check(value, path="$") returning a list of error strings (empty when valid).
+    """
+    type_check = _TYPE_CHECKS.get(schema.get("type"))
+    enum = set(schema["enum"]) if "enum" in schema else None
+    minimum = schema.get("minimum")
+    maximum = schema.get("maximum")
+    required = schema.get("required", [])
+    properties = {name: compile_schema(sub_schema) for name, sub_schema in schema.get("properties", {}).items()}
+    items = compile_schema(schema["items"]) if "items" in schema else None
+
+    def check(value, path="$"):
+        if type_check and not type_check(value):
+            return [f"{path}: expected {schema['type']}, got {type(value).__name__}"]
+        errors = []
+        if enum is not None and value not in enum:
+            errors.append(f"{path}: {value!r} is not one of {sorted(enum)}")
+        if minimum is not None and value < minimum:
+            errors.append(f"{path}: {value} is below the minimum {minimum}")
+        if maximum is not None and value > maximum:
+            errors.append(f"{path}: {value} is above the maximum {maximum}")
+        if isinstance(value, dict):
+            for name in required:
+                if name not in value:
+                    errors.append(f"{path}: missing required field '{name}'")
+            for name, property_check in properties.items():
+                if name in value:
+                    errors.extend(property_check(value[name], f"{path}.{name}"))
+        if items is not None and isinstance(value, list):
+            for index, item in enumerate(value):
+                errors.extend(items(item, f"{path}[{index}]"))
+        return errors
+
+    return check
+
+# Precompiled once at import time, one per *_TOOL_SCHEMA.
+VALIDATORS = {
+    agent_key: compile_schema(tool_schema[0]["function"]["parameters"])
+    for agent_key, tool_schema in TOOL_SCHEMAS.items()
+}
+
+# --- Deterministic repairs ---
+# Each repair mutates the output in place and returns a list of human-readable descriptions.
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.strip().replace(",", ".").rstrip("%"))
+        except ValueError:
+            return None
+    return None
+
+def _clamp_field(container, field, low, high, repairs, label):
+    value = _to_number(container.get(field))
+    if value is None:
+        return
+    clamped = max(low, min(high, value))
+    if clamped != container.get(field):
+        repairs.append(f"{label}: {container.get(field)!r} -> {clamped}")
+        container[field] = clamped
+
+def _normalize_concept(name):
+    return " ".join(str(name).casefold().split())
+
+def _drop_unknown_properties(output, schema, repairs, path="$"):
+    if isinstance(output, dict) and "properties" in schema:
+        for name in [name for name in output if name not in schema["properties"]]:
+            del output[name]
+            repairs.append(f"{path}: removed unknown field '{name}'")
+        for name, sub_schema in schema["properties"].items():
+            if name in output:
+                _drop_unknown_properties(output[name], sub_schema, repairs, f"{path}.{name}")
+    elif isinstance(output, list) and "items" in schema:
+        for index, item in enumerate(output):
+            _drop_unknown_properties(item, schema["items"], repairs, f"{path}[{index}]")
+
+def repair_qst_understanding(output, context, repairs):
+    concepts = output.get("key_concepts_expected")
+    if isinstance(concepts, list):
+        cleaned = [str(concept).strip() for concept in concepts if str(concept).strip()]
+        if cleaned != concepts:
+            repairs.append("key_concepts_expected: removed empty entries")
+            output["key_concepts_expected"] = cleaned
+    if "teacher_expectations" not in output:
+        output["teacher_expectations"] = []
+        repairs.append("teacher_expectations: filled with []")
+
+def repair_rubric_extraction(output, context, repairs):
+    rubric = output.get("rubric")
+    if not isinstance(rubric, list):
+        return
+    entries = [entry for entry in rubric if isinstance(entry, dict) and str(entry.get("concept", "")).strip()]
+    if len(entries) != len(rubric):
+        repairs.append(f"rubric: removed {len(rubric) - len(entries)} entries without a concept")
+    for entry in entries:
+        if not isinstance(entry.get("keywords"), list):
+            entry["keywords"] = []
+            repairs.append(f"rubric '{entry['concept']}': keywords filled with []")
+        weight = _to_number(entry.get("weight"))
+        entry["weight"] = max(0, weight) if weight is not None else 0
+    output["rubric"] = entries
+    if not entries:
+        return
+
+    # Renormalize the weights so that they add up to 100.
+    total_weight = sum(entry["weight"] for entry in entries)
+    if abs(total_weight - 100) > 0.01:
+        if total_weight > 0:
+            for entry in entries:
+                entry["weight"] = round(entry["weight"] * 100.0 / total_weight, 2)
+        else:
+            for entry in entries:
+                entry["weight"] = round(100.0 / len(entries), 2)
+        # Put the rounding drift on the heaviest entry.
+        drift = round(100 - sum(entry["weight"] for entry in entries), 2)
+        if drift:
+            heaviest = max(entries, key=lambda entry: entry["weight"])
+            heaviest["weight"] = round(heaviest["weight"] + drift, 2)
+        repairs.append(f"rubric: weights renormalized from {total_weight} to 100")
+
+def repair_ans_understanding(output, context, repairs):
+    for field in ("named_entities", "dates"):
+        if not isinstance(output.get(field), list):
+            output[field] = []
+            repairs.append(f"{field}: filled with []")
+    concepts = output.get("concepts_found")
+    if isinstance(concepts, list):
+        for concept in concepts:
+            if isinstance(concept, dict):
+                _clamp_field(concept, "relevance_score", 0, 100, repairs, f"concepts_found '{concept.get('concept')}'.relevance_score")
+                _clamp_field(concept, "completeness_score", 0, 100, repairs, f"concepts_found '{concept.get('concept')}'.completeness_score")
+    _clamp_field(output, "overall_semantic_alignment", 0, 100, repairs, "overall_semantic_alignment")
+    structure = output.get("structure")
+    if isinstance(structure, dict):
+        for field, value in list(structure.items()):
+            if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+                structure[field] = value.strip().lower() == "true"
+                repairs.append(f"structure.{field}: {value!r} -> {structure[field]}")
+
+def repair_grammar(output, context, repairs):
+    _clamp_field(output, "penalty", 0, 10, repairs, "penalty")
+    errors = output.get("errors")
+    if not isinstance(errors, list):
+        return
+    allowed_types = {"grammar", "spelling", "accentuation", "style"}
+    valid_errors = []
+    for error in errors:
+        if not isinstance(error, dict):
+            continue
+        error_type = str(error.get("type", "")).strip().lower()
+        if error_type in allowed_types and error.get("text") and error.get("suggestion"):
+            error["type"] = error_type
+            valid_errors.append(error)
+    if len(valid_errors) != len(errors):
+        repairs.append(f"errors: dropped {len(errors) - len(valid_errors)} malformed entries")
+        output["errors"] = valid_errors
+    if not output["errors"] and output.get("penalty"):
+        repairs.append(f"penalty: {output['penalty']} -> 0 (no errors)")
+        output["penalty"] = 0
+
+def repair_eval(output, context, repairs):
+    scores = output.get("scores")
+    if not isinstance(scores, list):
+        return
+    rubric = (context or {}).get("rubric")
+    if rubric:
+        returned = {}
+        for entry in scores:
+            if isinstance(entry, dict) and "concept" in entry:
+                returned.setdefault(_normalize_concept(entry["concept"]), entry)
+        repaired_scores = []
+        for rubric_entry in rubric:
+            concept = rubric_entry.get("concept")
+            weight = _to_number(rubric_entry.get("weight"))
+            entry = returned.pop(_normalize_concept(concept), None)
+            score = _to_number(entry.get("score")) if entry else None
+            if score is None:
+                repairs.append(f"scores: missing concept '{concept}' filled with 0")
+                score = 0
+            clamped = max(0, min(weight, score)) if weight is not None else max(0, score)
+            if clamped != score:
+                repairs.append(f"scores '{concept}': {score} clamped to {clamped}")
+            repaired_scores.append({"concept": concept, "score": clamped})
+        for extra_concept in returned:
+            repairs.append(f"scores: removed concept '{extra_concept}' not in rubric")
+        output["scores"] = repaired_scores
+    else:
+        for entry in scores:
+            if isinstance(entry, dict):
+                score = _to_number(entry.get("score"))
+                entry["score"] = max(0, score) if score is not None else 0
+
+    total_score = round(sum(entry["score"] for entry in output["scores"] if isinstance(entry, dict)), 2)
+    if _to_number(output.get("total_score")) != total_score:
+        repairs.append(f"total_score: {output.get('total_score')!r} -> {total_score} (sum of scores)")
+        output["total_score"] = total_score
+
+def repair_final_eval(output, context, repairs):
+    expected_final_score = (context or {}).get("final_score")
+    if expected_final_score is not None:
+        if _to_number(output.get("final_score")) != expected_final_score:
+            repairs.append(f"final_score: {output.get('final_score')!r} -> {expected_final_score} (pre-calculated)")
+            output["final_score"] = expected_final_score
+    else:
+        _clamp_field(output, "final_score", 0, 100, repairs, "final_score")
+    if isinstance(output.get("feedback"), str):
+        output["feedback"] = output["feedback"].strip()
+
+REPAIRS = {
+    "qst_understanding": repair_qst_understanding,
+    "rubric_extraction": repair_rubric_extraction,
+    "ans_understanding": repair_ans_understanding,
+    "grammar": repair_grammar,
+    "eval": repair_eval,
+    "final_eval": repair_final_eval,
+}
+
+def validate_and_repair(agent_key, output, context=None):
+    """
+    Applies the deterministic repairs for an agent's output, then validates it against the
+    precompiled tool schema.
+    Returns:
+        A tuple (repaired_output, errors, repairs).
+        - repaired_output: a repaired copy of the output (the input is not modified).
+        - errors: remaining validation errors; non-empty means the output is unrepairable.
+        - repairs: descriptions of the repairs that were applied.
+    """
+    if not isinstance(output, dict):
+        return output, [f"$: expected object, got {type(output).__name__}"], []
+    repaired_output = copy.deepcopy(output)
+    repairs = []
+    _drop_unknown_properties(repaired_output, TOOL_SCHEMAS[agent_key][0]["function"]["parameters"], repairs)
+    REPAIRS[agent_key](repaired_output, context, repairs)
+    errors = VALIDATORS[agent_key](repaired_output)
+    return repaired_output, errors, repairs
+
+def make_validator(agent_key, context=None):
+    """Returns a validator(output) -> (repaired_output, errors, repairs) bound to an agent and its context."""
+    return lambda output: validate_and_repair(agent_key, output, context)
+
+def validate_and_repair_packed_eval(output, answer_count, context=None):
+    """
+    Validates a packed evaluation (see a_eval.eval_packed): each of the answer_count answer ids must have
+    exactly one evaluation, which is repaired and validated like a single "eval" output.
+    Returns:
+        A tuple (repaired_output, errors, repairs) where repaired_output is
+        {"evaluations": [...]} ordered by answer id, each entry without its answer_id.
+    """
+    evaluations = output.get("evaluations") if isinstance(output, dict) else None
+    if not isinstance(evaluations, list):
+        return output, ["$.evaluations: expected array"], []
+    by_id = {}
+    errors = []
+    for entry in evaluations:
+        answer_id = _to_number(entry.get("answer_id")) if isinstance(entry, dict) else None
+        if answer_id is None or answer_id != int(answer_id) or not 0 <= answer_id < answer_count:
+            errors.append(f"$.evaluations: unexpected answer_id {entry.get('answer_id') if isinstance(entry, dict) else entry!r}")
+        elif int(answer_id) in by_id:
+            errors.append(f"$.evaluations: duplicate answer_id {int(answer_id)}")
+        else:
+            by_id[int(answer_id)] = entry
+
+    repaired_evaluations, repairs = [], []
+    for answer_id in range(answer_count):
+        if answer_id not in by_id:
+            errors.append(f"$.evaluations: missing answer_id {answer_id}")
+            continue
+        entry = {key: value for key, value in by_id[answer_id].items() if key != "answer_id"}
+        repaired_entry, entry_errors, entry_repairs = validate_and_repair("eval", entry, context)
+        errors.extend(f"answer {answer_id}: {error}" for error in entry_errors)
+        repairs.extend(f"answer {answer_id}: {repair}" for repair in entry_repairs)
+        repaired_evaluations.append(repaired_entry)
+    return {"evaluations": repaired_evaluations}, errors, repairs
+
+def make_packed_eval_validator(answer_count, context=None):
+    return lambda output: validate_and_repair_packed_eval(output, answer_count, context)
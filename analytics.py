@@ -0,0 +1,161 @@
+# analytics.py
+# Per-question class analytics, updated incrementally each time an evaluation is stored.
+# One compact document per question (collection "question_analytics", _id = question id) holds counters
+# and append-only parallel arrays, so a dashboard read is a single find_one whatever the class size:
+#   count, score_sum, score_sq_sum, histogram[HISTOGRAM_BINS],
+#   concepts[i] / concept_score_sums[i] / concept_weight_sums[i] / concept_counts[i],
+#   grammar_error_counts[j] aligned with GRAMMAR_ERROR_TYPES.
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+HISTOGRAM_BINS = 10 # Bins of 10 points over 0-100; a score of 100 falls into the last bin.
+GRAMMAR_ERROR_TYPES = ["grammar", "spelling", "accentuation", "style", "other"]
+MAX_CONCEPT_PUSH_ATTEMPTS = 5
+
+def extract_evaluation_details(final_result, steps_data):
+    """
+    Pulls the per-concept breakdown and the grammar report out of a workflow run.
+    Returns:
+        A dict with "breakdown_scores", "rubric", "rubric_version" (registry version of a pinned rubric),
+        "grammar_penalty" and "grammar_errors" (None when absent).
+    """
+    # A compacted trace (e.g. verbosity "none") may have dropped the successful steps: use the details
+    # extracted from the full steps by the workflow.
+    if getattr(steps_data, "evaluation_details", None) is not None:
+        return dict(steps_data.evaluation_details)
+    details = {"breakdown_scores": None, "rubric": None, "rubric_version": None, "grammar_penalty": None, "grammar_errors": None}
+    for step in steps_data or []:
+        parsed_output = step.get("parsed_output")
+        if step.get("status") != "Success" or not isinstance(parsed_output, dict):
+            continue
+        if step["name"].endswith("Rubric Extraction") or step["name"].endswith("(reused)"):
+            details["rubric"] = parsed_output.get("rubric")
+            details["rubric_version"] = parsed_output.get("rubric_version")
+        elif step["name"].endswith("Grammar and Language"):
+            details["grammar_penalty"] = parsed_output.get("penalty")
+            details["grammar_errors"] = parsed_output.get("errors")
+        elif step["name"].endswith("Evaluation"):
+            details["breakdown_scores"] = parsed_output.get("scores")
+    if details["breakdown_scores"] is None and final_result:
+        details["breakdown_scores"] = final_result.get("breakdown_scores")
+    return details
+
+def empty_aggregate(question_id, question):
+    return {
+        "_id": question_id,
+        "question": question,
+        "count": 0,
+        "provisional_count": 0,
+        "score_sum": 0.0,
+        "score_sq_sum": 0.0,
+        "histogram": [0] * HISTOGRAM_BINS,
+        "concepts": [],
+        "concept_score_sums": [],
+        "concept_weight_sums": [],
+        "concept_counts": [],
+        "grammar_error_types": GRAMMAR_ERROR_TYPES,
+        "grammar_error_counts": [0] * len(GRAMMAR_ERROR_TYPES),
+        "updated_at": datetime.utcnow(),
+    }
+
+def _histogram_bin(score):
+    return max(0, min(HISTOGRAM_BINS - 1, int(score // (100 / HISTOGRAM_BINS))))
+
+def _ensure_concepts(collection, question_id, concepts):
+    """
+    Appends unseen concepts to the aggregate's concept arrays and returns their positions.
+    Arrays are append-only, so a position never changes once assigned; concurrent writers are
+    serialized by only pushing when none of the new concepts is present yet.
+    """
+    for _ in range(MAX_CONCEPT_PUSH_ATTEMPTS):
+        aggregate = collection.find_one({"_id": question_id}, {"concepts": 1}) or {"concepts": []}
+        known = aggregate.get("concepts", [])
+        missing = [concept for concept in dict.fromkeys(concepts) if concept not in known]
+        if not missing:
+            return {concept: index for index, concept in enumerate(known)}
+        zeros = [0] * len(missing)
+        collection.update_one(
+            {"_id": question_id, "concepts": {"$nin": missing}},
+            {"$push": {
+                "concepts": {"$each": missing},
+                "concept_score_sums": {"$each": zeros},
+                "concept_weight_sums": {"$each": zeros},
+                "concept_counts": {"$each": zeros},
+            }},
+        )
+    raise RuntimeError(f"Could not register concepts for question {question_id} after {MAX_CONCEPT_PUSH_ATTEMPTS} attempts.")
+
+def record_evaluation(collection, evaluation):
+    """
+    Folds one stored evaluation document (see flask-app.py) into its question's aggregate.
+    Provisional (degraded-mode) results are only counted, not included in the score statistics.
+    """
+    question_id = evaluation["question_id"]
+    try:
+        collection.insert_one(empty_aggregate(question_id, evaluation.get("question")))
+    except DuplicateKeyError:
+        pass
+
+    increments = {}
+    final_score = evaluation.get("final_score")
+    if evaluation.get("provisional") or final_score is None:
+        increments["provisional_count"] = 1
+    else:
+        increments.update({
+            "count": 1,
+            "score_sum": final_score,
+            "score_sq_sum": final_score * final_score,
+            f"histogram.{_histogram_bin(final_score)}": 1,
+        })
+
+        breakdown_scores = [entry for entry in evaluation.get("breakdown_scores") or [] if entry.get("concept")]
+        if breakdown_scores:
+            weights = {entry.get("concept"): entry.get("weight", 0) for entry in evaluation.get("rubric") or []}
+            positions = _ensure_concepts(collection, question_id, [entry["concept"] for entry in breakdown_scores])
+            for entry in breakdown_scores:
+                position = positions[entry["concept"]]
+                increments[f"concept_score_sums.{position}"] = increments.get(f"concept_score_sums.{position}", 0) + (entry.get("score") or 0)
+                increments[f"concept_weight_sums.{position}"] = increments.get(f"concept_weight_sums.{position}", 0) + (weights.get(entry["concept"]) or 0)
+                increments[f"concept_counts.{position}"] = increments.get(f"concept_counts.{position}", 0) + 1
+
+        for error in evaluation.get("grammar_errors") or []:
+            error_type = error.get("type") if error.get("type") in GRAMMAR_ERROR_TYPES else "other"
+            key = f"grammar_error_counts.{GRAMMAR_ERROR_TYPES.index(error_type)}"
+            increments[key] = increments.get(key, 0) + 1
+
+    collection.update_one({"_id": question_id}, {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}})
+
+def read_aggregate(collection, question_id):
+    """
+    Returns the dashboard view of a question's aggregate (means derived from the stored sums), or None.
+    """
+    aggregate = collection.find_one({"_id": question_id})
+    if aggregate is None:
+        return None
+    count = aggregate["count"]
+    mean_score = aggregate["score_sum"] / count if count else None
+    variance = (aggregate["score_sq_sum"] / count - mean_score ** 2) if count else None
+    concepts = []
+    for index, concept in enumerate(aggregate["concepts"]):
+        concept_count = aggregate["concept_counts"][index]
+        weight_sum = aggregate["concept_weight_sums"][index]
+        concepts.append({
+            "concept": concept,
+            "count": concept_count,
+            "mean_score": aggregate["concept_score_sums"][index] / concept_count if concept_count else None,
+            # Share of the concept's weight obtained on average (0-1), when weights are known.
+            "coverage": aggregate["concept_score_sums"][index] / weight_sum if weight_sum else None,
+        })
+    return {
+        "question_id": aggregate["_id"],
+        "question": aggregate.get("question"),
+        "count": count,
+        "provisional_count": aggregate.get("provisional_count", 0),
+        "mean_score": mean_score,
+        "score_stddev": max(0.0, variance) ** 0.5 if variance is not None else None,
+        "histogram": {"bin_width": 100 / HISTOGRAM_BINS, "counts": aggregate["histogram"]},
+        "concepts": concepts,
+        "grammar_errors": dict(zip(aggregate["grammar_error_types"], aggregate["grammar_error_counts"])),
+        "updated_at": aggregate["updated_at"].isoformat() if aggregate.get("updated_at") else None,
+    }
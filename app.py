@@ -2,11 +2,14 @@
 import streamlit as st
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd # Pour st.dataframe
 
 # Importer la fonction de workflow modifiée
 try:
-    from workflow import run_evaluation_workflow
+    from workflow import run_evaluation_workflow, run_question_stages, run_batch_evaluation_workflow
+    from workflow import get_pinned_question_artifacts
+    from Agents.dispatcher import set_thread_priority, priority
 except ImportError:
     st.error("Échec de l'importation de workflow.py. Assurez-vous qu'il se trouve dans le même répertoire ou accessible dans PYTHONPATH.")
     st.stop()
@@ -30,6 +33,12 @@ if not os.environ.get("GROQ_API_KEY"):
 else:
     st.sidebar.success("GROQ_API_KEY trouvée !")
 
+# --- Détail de la trace conservée en session ---
+TRACE_VERBOSITY_LABELS = {"full": "Complète", "summary": "Résumé", "none": "Erreurs seulement"}
+trace_verbosity = st.sidebar.selectbox(
+    "Détail de la trace des étapes", list(TRACE_VERBOSITY_LABELS), format_func=TRACE_VERBOSITY_LABELS.get
+)
+
 # --- Textes par Défaut (déjà en français) ---
 DEFAULT_TEXT = """
 Dans la cour de l'école, les élèves sont joyeux. Ils jouent en groupes. Certains font de la
@@ -44,15 +53,6 @@ fort en maths.
 DEFAULT_QUESTION = "Que fait la maîtresse ?"
 DEFAULT_STUDENT_ANSWER = "La maitresse explique la lecon de mathematiques et elle ecrit au tableau"
 
-# --- Champs de Saisie ---
-st.header("📋 Entrées")
-col1, col2 = st.columns(2)
-with col1:
-    text_input = st.text_area("📚 Texte de Contexte", value=DEFAULT_TEXT, height=250)
-with col2:
-    question_input = st.text_area("❓ Question", value=DEFAULT_QUESTION, height=100)
-student_answer_input = st.text_area("✍️ Réponse de l'Élève", value=DEFAULT_STUDENT_ANSWER, height=100)
-
 # --- État de Session ---
 if 'workflow_steps' not in st.session_state:
     st.session_state.workflow_steps = None
@@ -60,6 +60,8 @@ if 'final_evaluation_result' not in st.session_state:
     st.session_state.final_evaluation_result = None
 if 'evaluation_triggered' not in st.session_state:
     st.session_state.evaluation_triggered = False
+if 'bulk_results' not in st.session_state:
+    st.session_state.bulk_results = None
 
 # --- Fonction d'aide pour afficher joliment le JSON analysé ---
 def display_parsed_output(data, step_name):
@@ -178,71 +180,240 @@ def display_parsed_output(data, step_name):
     else: # Solution de repli pour toute autre étape ou donnée inattendue
         st.json(data)
 
-# --- Bouton d'Évaluation ---
-if st.button("🚀 Évaluer la Réponse", type="primary"):
-    if not text_input or not question_input or not student_answer_input:
-        st.warning("Veuillez remplir tous les champs de saisie.")
-    else:
-        st.session_state.evaluation_triggered = True
-        st.session_state.workflow_steps = None 
-        st.session_state.final_evaluation_result = None
-
-        with st.spinner("🧠 Évaluation en cours... Cela peut prendre un moment car les LLMs sont appelés..."):
-            final_result, steps_data = run_evaluation_workflow(
-                text_input, question_input, student_answer_input
-            )
-            st.session_state.workflow_steps = steps_data
-            st.session_state.final_evaluation_result = final_result
-
-# --- Affichage des Résultats ---
-if st.session_state.evaluation_triggered:
-    st.header("🔍 Supervision du Workflow & Résultats")
-
-    if st.session_state.workflow_steps:
-        for i, step in enumerate(st.session_state.workflow_steps):
-            # Traduire les noms d'étapes s'ils viennent de workflow.py en anglais
-            step_name_display = step['name']
-            if "Question Understanding" in step_name_display: step_name_display = step_name_display.replace("Question Understanding", "Compréhension des Questions")
-            if "Rubric Extraction" in step_name_display: step_name_display = step_name_display.replace("Rubric Extraction", "Extraction de Rubriques")
-            if "Answer Understanding" in step_name_display: step_name_display = step_name_display.replace("Answer Understanding", "Compréhension des Réponses")
-            if "Grammar and Language" in step_name_display: step_name_display = step_name_display.replace("Grammar and Language", "Grammaire et Langue")
-            if "Evaluation Agent" in step_name_display: step_name_display = step_name_display.replace("Evaluation Agent", "Agent d'Évaluation")
-            if "Final Scoring" in step_name_display: step_name_display = step_name_display.replace("Final Scoring", "Notation Finale")
-            if "Logic Check" in step_name_display: step_name_display = step_name_display.replace("Logic Check", "Vérification Logique")
-
-            status_display = "Succès" if step['status'] == "Success" else "Échec"
-            expander_title = f"Étape {i+1}: {step_name_display} - Statut: {status_display}"
+# --- Correction en lot ---
+# Noms de colonnes reconnus automatiquement pour les réponses dans le fichier importé
+BULK_ANSWER_COLUMNS = ["student_answer", "student_answer_input", "answer", "reponse", "réponse"]
+
+def load_answers_file(uploaded_file):
+    """Lit un fichier CSV ou XLSX de réponses d'élèves (XLSX nécessite openpyxl)."""
+    if uploaded_file.name.lower().endswith(".xlsx"):
+        return pd.read_excel(uploaded_file)
+    return pd.read_csv(uploaded_file, sep=None, engine="python") # Détection automatique du séparateur
+
+def grade_answer(text_input, question_input, student_answer, question_artifacts):
+    """Évalue une réponse en réutilisant la grille déjà calculée. Retourne (résultat final, message d'erreur)."""
+    # Seules les étapes en échec sont utiles ici : trace minimale
+    final_result, steps_data = run_evaluation_workflow(text_input, question_input, student_answer, question_artifacts,
+                                                       trace_verbosity="none")
+    return grading_outcome(final_result, steps_data)
+
+def grade_answers_packed(text_input, question_input, student_answers, question_artifacts, on_outcome, max_workers):
+    """
+    Évalue plusieurs réponses, l'étape d'évaluation notant plusieurs réponses par appel. on_outcome(position,
+    résultat, erreur) est appelé dans le thread appelant dès que chaque réponse est corrigée.
+    """
+    run_batch_evaluation_workflow(
+        text_input, question_input, student_answers, question_artifacts, trace_verbosity="none", max_workers=max_workers,
+        on_result=lambda position, final_result, steps_data: on_outcome(position, *grading_outcome(final_result, steps_data))
+    )
+
+def grading_outcome(final_result, steps_data):
+    if final_result:
+        return final_result, None
+    failed_steps = [step for step in steps_data if step.get('status') == "Failure"]
+    return None, failed_steps[-1].get('error_message_detail') if failed_steps else "Échec inconnu"
+
+def render_bulk_tab(default_text, default_question):
+    """Onglet de correction en lot : import CSV/XLSX, correction concurrente et tableau de progression en direct."""
+    st.header("📚 Correction en Lot")
+    st.markdown("Importez un fichier CSV ou XLSX contenant une réponse d'élève par ligne pour le même texte et la même question. "
+                "La question et la grille d'évaluation sont analysées une seule fois, puis les réponses sont corrigées en parallèle.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        bulk_text = st.text_area("📚 Texte de Contexte", value=default_text, height=250, key="bulk_text_input")
+    with col2:
+        bulk_question = st.text_area("❓ Question", value=default_question, height=100, key="bulk_question_input")
+
+    uploaded_file = st.file_uploader("📄 Fichier des réponses (CSV ou XLSX)", type=["csv", "xlsx"])
+    if uploaded_file is None:
+        return
+    try:
+        answers_df = load_answers_file(uploaded_file)
+    except Exception as e:
+        st.error(f"Impossible de lire le fichier : {e}")
+        return
+    if answers_df.empty:
+        st.warning("Le fichier ne contient aucune ligne.")
+        return
+
+    columns = list(answers_df.columns)
+    default_index = next((i for i, column in enumerate(columns) if str(column).strip().lower() in BULK_ANSWER_COLUMNS), 0)
+    answer_column = st.selectbox("Colonne contenant les réponses", columns, index=default_index)
+    max_workers = st.slider("Nombre de corrections en parallèle", min_value=1, max_value=8, value=4)
+    packed = st.checkbox("Évaluation groupée (plusieurs réponses notées par appel, texte et grille envoyés une seule fois)")
+    st.caption(f"{len(answers_df)} réponses détectées.")
+
+    if st.button("🚀 Corriger le Lot", type="primary"):
+        if not bulk_text or not bulk_question:
+            st.warning("Veuillez remplir le texte et la question.")
+            return
+
+        # Grille épinglée par l'enseignant si elle existe, sinon générée une seule fois pour tout le lot
+        question_artifacts, question_steps = get_pinned_question_artifacts(bulk_text, bulk_question), []
+        if question_artifacts is None:
+            with st.spinner("🧠 Analyse de la question et génération de la grille..."):
+                question_artifacts, question_steps = run_question_stages(bulk_text, bulk_question)
+        if question_artifacts is None:
+            st.error(f"❌ Échec de l'analyse de la question : {question_steps[-1].get('error_message_detail') if question_steps else 'erreur inconnue'}")
+            return
+
+        answers = answers_df[answer_column].fillna("").astype(str)
+        progress_df = pd.DataFrame({
+            "Réponse": answers,
+            "Statut": "En attente",
+            "Note Finale": [None] * len(answers),
+            "Feedback": [""] * len(answers),
+            "Groupe": [""] * len(answers),
+        })
+        progress_bar = st.progress(0.0, text=f"0/{len(answers)} réponses corrigées")
+        table_placeholder = st.empty()
+        table_placeholder.dataframe(progress_df, use_container_width=True)
+
+        pending_indices = []
+        for index, answer in answers.items():
+            if answer.strip():
+                pending_indices.append(index)
+                progress_df.at[index, "Statut"] = "En cours"
+            else:
+                progress_df.at[index, "Statut"] = "Réponse vide"
+        table_placeholder.dataframe(progress_df, use_container_width=True)
+        completed = 0
+
+        def record_outcome(index, final_result, error_detail):
+            nonlocal completed
+            if final_result:
+                progress_df.at[index, "Statut"] = "Provisoire" if final_result.get('provisional') else "Succès"
+                progress_df.at[index, "Note Finale"] = final_result.get('final_score')
+                progress_df.at[index, "Feedback"] = final_result.get('feedback', "")
+                progress_df.at[index, "Groupe"] = final_result.get('cluster_id', "")
+            else:
+                progress_df.at[index, "Statut"] = "Échec"
+                progress_df.at[index, "Feedback"] = error_detail or ""
+            completed += 1
+            progress_bar.progress(completed / len(pending_indices), text=f"{completed}/{len(pending_indices)} réponses corrigées")
+            table_placeholder.dataframe(progress_df, use_container_width=True)
+
+        if packed:
+            # Un seul lot pour le workflow : les quasi-doublons sont regroupés sur tout le lot et les paquets
+            # d'évaluation formés par le workflow ; chaque réponse est affichée dès que son paquet est noté
+            if pending_indices:
+                try:
+                    with priority("bulk"):
+                        grade_answers_packed(bulk_text, bulk_question, [answers[i] for i in pending_indices], question_artifacts,
+                                             lambda position, final_result, error_detail: record_outcome(pending_indices[position], final_result, error_detail),
+                                             max_workers)
+                except Exception as e:
+                    for index in pending_indices:
+                        if progress_df.at[index, "Statut"] == "En cours":
+                            record_outcome(index, None, str(e))
+        else:
+            # Priorité "bulk" : les appels LLM du lot passent après les réponses du jeu en direct
+            with ThreadPoolExecutor(max_workers=max_workers, initializer=set_thread_priority, initargs=("bulk",)) as executor:
+                futures = {executor.submit(grade_answer, bulk_text, bulk_question, answers[index], question_artifacts): index
+                           for index in pending_indices}
+                for future in as_completed(futures):
+                    try:
+                        final_result, error_detail = future.result()
+                    except Exception as e:
+                        final_result, error_detail = None, str(e)
+                    record_outcome(futures[future], final_result, error_detail)
+
+        st.session_state.bulk_results = answers_df.assign(
+            statut=progress_df["Statut"], note_finale=progress_df["Note Finale"], feedback=progress_df["Feedback"],
+            groupe=progress_df["Groupe"]
+        )
+        st.success("🎉 Correction du lot terminée !")
+
+    if st.session_state.get('bulk_results') is not None:
+        st.download_button(
+            "💾 Télécharger les résultats (CSV)",
+            data=st.session_state.bulk_results.to_csv(index=False).encode("utf-8-sig"),
+            file_name="resultats_correction.csv",
+            mime="text/csv",
+        )
+
+# --- Onglets ---
+tab_single, tab_bulk = st.tabs(["📝 Réponse Unique", "📚 Correction en Lot"])
+
+with tab_single:
+    # --- Champs de Saisie ---
+    st.header("📋 Entrées")
+    col1, col2 = st.columns(2)
+    with col1:
+        text_input = st.text_area("📚 Texte de Contexte", value=DEFAULT_TEXT, height=250)
+    with col2:
+        question_input = st.text_area("❓ Question", value=DEFAULT_QUESTION, height=100)
+    student_answer_input = st.text_area("✍️ Réponse de l'Élève", value=DEFAULT_STUDENT_ANSWER, height=100)
+
+    # --- Bouton d'Évaluation ---
+    if st.button("🚀 Évaluer la Réponse", type="primary"):
+        if not text_input or not question_input or not student_answer_input:
+            st.warning("Veuillez remplir tous les champs de saisie.")
+        else:
+            st.session_state.evaluation_triggered = True
+            st.session_state.workflow_steps = None 
+            st.session_state.final_evaluation_result = None
+
+            with st.spinner("🧠 Évaluation en cours... Cela peut prendre un moment car les LLMs sont appelés..."):
+                final_result, steps_data = run_evaluation_workflow(
+                    text_input, question_input, student_answer_input, trace_verbosity=trace_verbosity
+                )
+                st.session_state.workflow_steps = steps_data
+                st.session_state.final_evaluation_result = final_result
+
+    # --- Affichage des Résultats ---
+    if st.session_state.evaluation_triggered:
+        st.header("🔍 Supervision du Workflow & Résultats")
+
+        if st.session_state.workflow_steps:
+            for i, step in enumerate(st.session_state.workflow_steps):
+                # Traduire les noms d'étapes s'ils viennent de workflow.py en anglais
+                step_name_display = step['name']
+                if "Question Understanding" in step_name_display: step_name_display = step_name_display.replace("Question Understanding", "Compréhension des Questions")
+                if "Rubric Extraction" in step_name_display: step_name_display = step_name_display.replace("Rubric Extraction", "Extraction de Rubriques")
+                if "Answer Understanding" in step_name_display: step_name_display = step_name_display.replace("Answer Understanding", "Compréhension des Réponses")
+                if "Grammar and Language" in step_name_display: step_name_display = step_name_display.replace("Grammar and Language", "Grammaire et Langue")
+                if "Evaluation Agent" in step_name_display: step_name_display = step_name_display.replace("Evaluation Agent", "Agent d'Évaluation")
+                if "Final Scoring" in step_name_display: step_name_display = step_name_display.replace("Final Scoring", "Notation Finale")
+                if "Logic Check" in step_name_display: step_name_display = step_name_display.replace("Logic Check", "Vérification Logique")
+
+                status_display = "Succès" if step['status'] == "Success" else "Échec"
+                expander_title = f"Étape {i+1}: {step_name_display} - Statut: {status_display}"
             
-            is_last_successful_step = (i == len(st.session_state.workflow_steps) - 1) and step['status'] == "Success"
-            expanded_default = (step['status'] == "Failure") or is_last_successful_step
-
-            with st.expander(expander_title, expanded=expanded_default):
-                st.subheader("Logs des Tentatives :")
-                if step.get('attempts_logs'):
-                    for log_entry in step['attempts_logs']:
-                        st.text(log_entry)
-                else:
-                    st.write("Aucun log de tentative.")
+                is_last_successful_step = (i == len(st.session_state.workflow_steps) - 1) and step['status'] == "Success"
+                expanded_default = (step['status'] == "Failure") or is_last_successful_step
+
+                with st.expander(expander_title, expanded=expanded_default):
+                    st.subheader("Logs des Tentatives :")
+                    if step.get('attempts_logs'):
+                        for log_entry in step['attempts_logs']:
+                            st.text(log_entry)
+                    else:
+                        st.write("Aucun log de tentative.")
                 
-                if step.get('parsed_output'):
-                    st.subheader("Sortie Analysée :")
-                    display_parsed_output(step['parsed_output'], step['name']) # step['name'] original pour la logique interne
+                    if step.get('parsed_output'):
+                        st.subheader("Sortie Analysée :")
+                        display_parsed_output(step['parsed_output'], step['name']) # step['name'] original pour la logique interne
                 
-                if step['status'] == "Failure" and step.get('error_message_detail'):
-                    st.error(f"Détail de l'Erreur : {step['error_message_detail']}")
+                    if step['status'] == "Failure" and step.get('error_message_detail'):
+                        st.error(f"Détail de l'Erreur : {step['error_message_detail']}")
         
-        st.divider()
+            st.divider()
 
-    if st.session_state.final_evaluation_result:
-        st.subheader("🏆 Résultat Final de l'Évaluation")
-        # Utiliser display_parsed_output pour le résultat final également
-        if st.session_state.workflow_steps and ("Final Scoring" in st.session_state.workflow_steps[-1]['name'] or "Notation Finale" in st.session_state.workflow_steps[-1]['name']):
-             display_parsed_output(st.session_state.final_evaluation_result, "Notation Finale") # Utiliser un nom cohérent
-        else:
-            st.json(st.session_state.final_evaluation_result) 
+        if st.session_state.final_evaluation_result:
+            st.subheader("🏆 Résultat Final de l'Évaluation")
+            # Utiliser display_parsed_output pour le résultat final également
+            if st.session_state.workflow_steps and ("Final Scoring" in st.session_state.workflow_steps[-1]['name'] or "Notation Finale" in st.session_state.workflow_steps[-1]['name']):
+                 display_parsed_output(st.session_state.final_evaluation_result, "Notation Finale") # Utiliser un nom cohérent
+            else:
+                st.json(st.session_state.final_evaluation_result) 
+
+            st.success("🎉 Workflow terminé avec succès !")
+            # st.balloons() # Effet de succès supprimé
 
-        st.success("🎉 Workflow terminé avec succès !")
-        # st.balloons() # Effet de succès supprimé
+        elif st.session_state.workflow_steps: 
+            st.error("❌ L'exécution du workflow a échoué. Veuillez examiner les étapes ci-dessus pour plus de détails.")
 
-    elif st.session_state.workflow_steps: 
-        st.error("❌ L'exécution du workflow a échoué. Veuillez examiner les étapes ci-dessus pour plus de détails.")
\ No newline at end of file
+with tab_bulk:
+    render_bulk_tab(DEFAULT_TEXT, DEFAULT_QUESTION)
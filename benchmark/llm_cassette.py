@@ -0,0 +1,104 @@
+# benchmark/llm_cassette.py
+# Recorded LLM responses for the benchmark. A cassette is a JSONL file of
+#   {"key", "model", "tool_arguments", "content", "usage", "latency_seconds"}
+# keyed by a hash of the request (model, messages, tools, tool_choice), so it can be replayed whatever the
+# backend that recorded it. CassetteBackend is registered in place of the real backends (backends.register_backend).
+import hashlib
+import json
+import os
+import threading
+import time
+
+from Agents.backends import LLMBackend, LLMResponse
+from stub_llm_server import sample_from_schema
+
+def request_key(messages, model, tools=None, tool_choice=None):
+    payload = json.dumps([model, messages, tools, tool_choice], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class Cassette:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as cassette_file:
+                for line in cassette_file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def add(self, entry):
+        with self._lock:
+            if entry["key"] in self.entries:
+                return
+            self.entries[entry["key"]] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as cassette_file:
+                cassette_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+_stats_lock = threading.Lock()
+
+def new_stats():
+    return {"calls": 0, "misses": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+def _stub_response(tools, tool_choice):
+    """Smallest schema-valid answer for the forced tool (as the stub server would give)."""
+    function_name = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+    for tool in tools or []:
+        if function_name in (None, tool["function"]["name"]):
+            return LLMResponse(sample_from_schema(tool["function"].get("parameters", {})), None, None)
+    return LLMResponse(None, "stub", None)
+
+class CassetteBackend(LLMBackend):
+    """
+    mode "record": calls inner_backend and records every response.
+    mode "replay": answers from the cassette, sleeping for the recorded latency if replay_latency is True.
+    Requests missing from the cassette get a stubbed schema-valid answer (counted in stats["misses"]),
+    or raise KeyError when strict is True. mode "stub" stubs every request.
+    stats counts calls and tokens (usage reported by the backend, or recorded with the response); pass the
+    same dict to several backends to count them together.
+    """
+    name = "cassette"
+
+    def __init__(self, cassette, mode="replay", inner_backend=None, replay_latency=True, strict=False, stats=None):
+        self.cassette = cassette
+        self.mode = mode
+        self.inner_backend = inner_backend
+        self.replay_latency = replay_latency
+        self.strict = strict
+        self.stats = stats if stats is not None else new_stats()
+
+    def chat(self, messages, model, tools=None, tool_choice=None):
+        key = request_key(messages, model, tools, tool_choice)
+        missed = False
+        if self.mode == "record":
+            start_time = time.monotonic()
+            response = self.inner_backend.chat(messages, model, tools=tools, tool_choice=tool_choice)
+            self.cassette.add({
+                "key": key, "model": model, "tool_arguments": response.tool_arguments, "content": response.content,
+                "usage": response.usage, "latency_seconds": round(time.monotonic() - start_time, 4),
+            })
+        else:
+            entry = self.cassette.get(key) if self.mode == "replay" else None
+            if entry is not None:
+                if self.replay_latency:
+                    time.sleep(entry.get("latency_seconds") or 0)
+                response = LLMResponse(entry["tool_arguments"], entry["content"], entry.get("usage"))
+            elif self.strict:
+                raise KeyError(f"No recorded response for request {key[:12]} ({model}).")
+            else:
+                missed = self.mode == "replay"
+                response = _stub_response(tools, tool_choice)
+
+        usage = response.usage or {}
+        with _stats_lock:
+            self.stats["calls"] += 1
+            self.stats["misses"] += int(missed)
+            # Without reported usage (stubbed answers), tokens are estimated at 4 characters per token.
+            self.stats["prompt_tokens"] += usage.get("prompt_tokens") or sum(len(message["content"]) for message in messages) // 4
+            self.stats["completion_tokens"] += usage.get("completion_tokens") or len(json.dumps(response.tool_arguments or response.content or "")) // 4
+        return response
@@ -0,0 +1,234 @@
+# benchmark/prompt_budget.py
+# Prompt budget profiler. Runs the workflow on the golden dataset without a real LLM (recorded responses from
+# the benchmark cassette when available, stubbed schema-valid answers otherwise) and measures, per stage, the
+# tokens of the three parts of every agent call:
+#   system (the agent's INSTRUCTIONS), schema (the tool schema sent with the call), dynamic (the user prompt:
+#   text, question, answer, rubric and previous stage outputs).
+# The static part (system + schema) is paid on every call, whatever the answer. Each prompt variant
+# (Agents/prompts.py) runs in its own process, since the variant is read from the environment at import.
+#
+#   python -m benchmark.prompt_budget                       # report for every variant
+#   python -m benchmark.prompt_budget --check               # fail (exit 1) if a stage's prompt grew past the baseline
+#   python -m benchmark.prompt_budget --update-baseline     # accept the current sizes as the new baseline
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmark.run_benchmark import BENCHMARK_DIR, DEFAULT_CASSETTE_DIR, DEFAULT_DATASET, REPO_DIR, load_dataset
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "prompt_budget_baseline.json")
+DEFAULT_TOLERANCE = 0.02 # Relative growth of a stage's static or mean dynamic tokens tolerated by --check
+STAGE_ORDER = ["qst_understanding", "rubric_extraction", "ans_understanding", "grammar", "eval", "final_eval"]
+# Every stage's call is profiled (no pre-screen, no template feedback, no caches short-circuiting a call).
+PROFILE_ENV = {
+    "PRESCREEN": "0", "FEEDBACK_MODE": "llm", "LLM_CASCADE": "0", "LLM_SHARED_CACHE": "0", "SHARED_QUESTION_CACHE": "0",
+    "GRAMMAR_SENTENCE_CACHE": "0", "WORKFLOW_CHECKPOINT_DIR": "", "GRAMMAR_SENTENCE_CACHE_PATH": "",
+}
+
+def tokenizer():
+    """
+    Returns:
+        A tuple (name, count_tokens). tiktoken's cl100k_base when installed (optional dependency), otherwise an
+        estimate of 4 characters per token (the estimate used by llm.py for rate limiting).
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return "estimate-4-chars", lambda text: (len(text) + 3) // 4
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return "tiktoken-cl100k_base", lambda text: len(encoding.encode(text))
+
+def tool_agents():
+    """Forced tool function name -> agent key, for every tool schema of the agents."""
+    import Agents.a_ans_understanding as answer_understanding_agent
+    import Agents.a_eval as eval_agent
+    import Agents.a_final_eval as final_eval_agent
+    import Agents.a_grammar_language as grammar_language_agent
+    import Agents.a_qst_understanding as question_understanding_agent
+    import Agents.a_rubric_extraction as rubric_extraction_agent
+    schemas = [
+        ("qst_understanding", question_understanding_agent.QST_UNDERSTANDING_TOOL_SCHEMA),
+        ("rubric_extraction", rubric_extraction_agent.RUBRIC_EXTRACTION_TOOL_SCHEMA),
+        ("ans_understanding", answer_understanding_agent.ANS_UNDERSTANDING_TOOL_SCHEMA),
+        ("grammar", grammar_language_agent.GRAMMAR_TOOL_SCHEMA),
+        ("grammar", grammar_language_agent.GRAMMAR_SENTENCES_TOOL_SCHEMA),
+        ("eval", eval_agent.EVAL_TOOL_SCHEMA),
+        ("eval", eval_agent.EVAL_PACKED_TOOL_SCHEMA),
+        ("final_eval", final_eval_agent.FINAL_EVAL_TOOL_SCHEMA),
+    ]
+    return {tool_schema[0]["function"]["name"]: agent_key for agent_key, tool_schema in schemas}
+
+def summarize_calls(calls):
+    """Per-stage sizes: calls, system/schema tokens (mean), dynamic tokens (mean, max) and static share."""
+    stages = {}
+    for stage in STAGE_ORDER + sorted({call["stage"] for call in calls} - set(STAGE_ORDER)):
+        stage_calls = [call for call in calls if call["stage"] == stage]
+        if not stage_calls:
+            continue
+        count = len(stage_calls)
+        summary = {"calls": count}
+        for part in ("system", "schema", "dynamic"):
+            summary[f"{part}_tokens"] = round(sum(call[f"{part}_tokens"] for call in stage_calls) / count, 1)
+            summary[f"{part}_chars"] = round(sum(call[f"{part}_chars"] for call in stage_calls) / count, 1)
+        summary["dynamic_tokens_max"] = max(call["dynamic_tokens"] for call in stage_calls)
+        summary["static_tokens"] = round(summary["system_tokens"] + summary["schema_tokens"], 1)
+        summary["static_chars"] = round(summary["system_chars"] + summary["schema_chars"], 1)
+        total = summary["static_tokens"] + summary["dynamic_tokens"]
+        summary["static_share"] = round(summary["static_tokens"] / total, 3) if total else None
+        stages[stage] = summary
+    return stages
+
+def run_worker(variant, dataset_path, cassette_path, output_path):
+    """Profiles the calls of one prompt variant in this process and writes the per-stage sizes to output_path."""
+    sys.path.insert(0, REPO_DIR)
+    import Agents.backends as backends
+    import Agents.llm as llm
+    import workflow
+    from benchmark.llm_cassette import Cassette, CassetteBackend, new_stats
+
+    tokenizer_name, count_tokens = tokenizer()
+    agents_by_tool = tool_agents()
+    calls = []
+    stats = new_stats()
+
+    class ProfilingBackend(backends.LLMBackend):
+        name = "profiling"
+
+        def __init__(self, inner_backend):
+            self.inner_backend = inner_backend
+
+        def chat(self, messages, model, tools=None, tool_choice=None):
+            function_name = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+            system = "".join(message["content"] for message in messages if message["role"] == "system")
+            dynamic = "".join(message["content"] for message in messages if message["role"] != "system")
+            schema = json.dumps(tools, ensure_ascii=False) if tools else ""
+            calls.append({
+                "stage": agents_by_tool.get(function_name, function_name or "unknown"),
+                "system_tokens": count_tokens(system), "schema_tokens": count_tokens(schema), "dynamic_tokens": count_tokens(dynamic),
+                "system_chars": len(system), "schema_chars": len(schema), "dynamic_chars": len(dynamic),
+            })
+            return self.inner_backend.chat(messages, model, tools=tools, tool_choice=tool_choice)
+
+    cassette = Cassette(cassette_path if os.path.exists(cassette_path) else None)
+    inner_backend = CassetteBackend(cassette, "replay" if cassette.entries else "stub", replay_latency=False, stats=stats)
+    for backend_name in set(llm.AGENT_BACKENDS.values()) | {backends.DEFAULT_BACKEND}:
+        backends.register_backend(backend_name, ProfilingBackend(inner_backend))
+
+    for item in load_dataset(dataset_path):
+        workflow.run_evaluation_workflow(item["text"], item["question"], item["answer"], trace_verbosity="summary")
+
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump({
+            "variant": variant, "tokenizer": tokenizer_name, "stages": summarize_calls(calls),
+            "recorded_responses": stats["calls"] - stats["misses"] if cassette.entries else 0, "calls": stats["calls"],
+        }, output_file, ensure_ascii=False)
+
+def run_variant(variant, args, cassette_path):
+    """Profiles a prompt variant in a fresh interpreter. Returns its results, or None if the run crashed."""
+    environment = dict(os.environ, PROMPT_VARIANT=variant, **PROFILE_ENV)
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        output_path = os.path.join(temporary_dir, "result.json")
+        command = [
+            sys.executable, "-m", "benchmark.prompt_budget", "--worker", variant, "--worker-output", output_path,
+            "--dataset", args.dataset, "--cassette", cassette_path,
+        ]
+        completed = subprocess.run(command, cwd=REPO_DIR, env=environment, capture_output=True, text=True)
+        if completed.returncode != 0 or not os.path.exists(output_path):
+            print(f"  {variant} failed (exit code {completed.returncode}):\n{completed.stderr[-2000:]}")
+            return None
+        with open(output_path, encoding="utf-8") as output_file:
+            return json.load(output_file)
+
+def print_report(results):
+    print(f"{'variant':<9} {'stage':<18} {'calls':>5} {'system':>8} {'schema':>8} {'static':>8} {'dynamic':>8} {'dyn max':>8} {'static %':>9}")
+    for result in results:
+        for stage, summary in result["stages"].items():
+            print(f"{result['variant']:<9} {stage:<18} {summary['calls']:>5} {summary['system_tokens']:>8} {summary['schema_tokens']:>8} "
+                  f"{summary['static_tokens']:>8} {summary['dynamic_tokens']:>8} {summary['dynamic_tokens_max']:>8} "
+                  f"{summary['static_share'] * 100 if summary['static_share'] is not None else 0:>8.1f}%")
+        stages = result["stages"].values()
+        per_evaluation = sum(summary["static_tokens"] for summary in stages)
+        print(f"{result['variant']:<9} static tokens per evaluation (one call per stage): {per_evaluation:.0f} ({result['tokenizer']})\n")
+
+def check_regressions(results, baseline, tolerance):
+    """
+    Compares each variant's per-stage static tokens and mean dynamic tokens with the baseline.
+    Sizes are compared in tokens when both were counted with the same tokenizer, in characters otherwise.
+    Returns:
+        A list of regression messages (empty if every stage is within tolerance).
+    """
+    regressions = []
+    for result in results:
+        baseline_stages = baseline.get("variants", {}).get(result["variant"], {}).get("stages")
+        if baseline_stages is None:
+            print(f"No baseline for variant {result['variant']}: not checked.")
+            continue
+        unit = "tokens" if baseline.get("tokenizer") == result["tokenizer"] else "chars"
+        for stage, summary in result["stages"].items():
+            if stage not in baseline_stages:
+                print(f"New stage {stage} ({result['variant']}): not in the baseline.")
+                continue
+            for measure in (f"static_{unit}", f"dynamic_{unit}"):
+                reference, current = baseline_stages[stage][measure], summary[measure]
+                if current > reference * (1 + tolerance):
+                    regressions.append(f"{result['variant']}/{stage}: {measure} {reference} -> {current} (+{(current / reference - 1) * 100:.1f}%)")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage prompt size profiler of the agent calls, with a regression check.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Golden dataset (.jsonl)")
+    parser.add_argument("--variants", nargs="+", choices=["full", "compact"], default=["full", "compact"], help="Prompt variants to profile")
+    parser.add_argument("--cassette", help="Recorded responses (default: the benchmark cassette of the dataset); stubbed when missing")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline sizes (JSON)")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if a stage's prompt grew past the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Relative growth tolerated by --check (default: 0.02)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the current sizes to the baseline file")
+    parser.add_argument("--report", help="Write the full results to this JSON file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    dataset_name = os.path.splitext(os.path.basename(args.dataset))[0]
+    cassette_path = args.cassette or os.path.join(DEFAULT_CASSETTE_DIR, f"{dataset_name}.jsonl")
+    if args.worker:
+        run_worker(args.worker, args.dataset, cassette_path, args.worker_output)
+        return
+
+    results = []
+    for variant in args.variants:
+        print(f"Profiling prompt variant {variant}...")
+        result = run_variant(variant, args, cassette_path)
+        if result is None:
+            sys.exit(1)
+        results.append(result)
+    print()
+    print_report(results)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            json.dump({"dataset": dataset_name, "results": results}, report_file, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.report}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump({
+                "dataset": dataset_name, "tokenizer": results[0]["tokenizer"],
+                "variants": {result["variant"]: {"stages": result["stages"]} for result in results},
+            }, baseline_file, ensure_ascii=False, indent=2)
+            baseline_file.write("\n")
+        print(f"Baseline written to {args.baseline}")
+    elif args.check:
+        if not os.path.exists(args.baseline):
+            sys.exit(f"ERROR: no baseline at {args.baseline} (create it with --update-baseline).")
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = check_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("Prompt size regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"No prompt size regression (tolerance {args.tolerance * 100:.0f}%).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# benchmark/run_benchmark.py
+# Accuracy-vs-latency benchmark of workflow.py configurations on a versioned golden dataset
+# (benchmark/golden/golden_v<N>.jsonl: text, question, answer, rubric, reference_final_score, reference_scores).
+# Each configuration runs in its own process (modules read their settings from the environment at import)
+# against recorded LLM responses, and is reported with latency, LLM calls, tokens and score deviation from
+# the references (MAE, agreement within tolerance).
+#
+#   python -m benchmark.run_benchmark --llm record                      # record responses (needs GROQ_API_KEY)
+#   python -m benchmark.run_benchmark                                   # replay them, every configuration
+#   python -m benchmark.run_benchmark --configs baseline cascade --report report.json
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_DATASET = os.path.join(BENCHMARK_DIR, "golden", "golden_v1.jsonl")
+DEFAULT_CASSETTE_DIR = os.path.join(BENCHMARK_DIR, "cassettes")
+DEFAULT_TOLERANCE = 10.0 # Points (out of 100) within which a final score agrees with the reference
+
+# Configurations: environment overrides, "mode" ("single": run_evaluation_workflow per answer, "batch":
+# run_batch_evaluation_workflow per question) and "pin_rubric" (grade with the golden rubric, skipping stages 1-2).
+CONFIGURATIONS = {
+    "baseline": {"env": {}, "description": "Six-stage pipeline, default settings"},
+    "pinned_rubric": {"env": {}, "pin_rubric": True, "description": "Golden rubric pinned (stages 1-2 skipped)"},
+    "cascade": {"env": {"LLM_CASCADE": "1"}, "description": "Fast model first, escalation on invalid/uncertain output"},
+    "grammar_cache": {"env": {"GRAMMAR_SENTENCE_CACHE": "1"}, "description": "Grammar agent memoized per sentence"},
+    "semantic_replace": {"env": {"SEMANTIC_ALIGNMENT_MODE": "replace"}, "description": "Local semantic alignment replaces the LLM's"},
+    "shared_cache": {"env": {"LLM_SHARED_CACHE": "1"}, "description": "LLM response cache"},
+    "packed_eval": {"env": {}, "mode": "batch", "description": "Packed evaluation of the answers to a question"},
+    "packed_eval_no_dedup": {"env": {"BATCH_DEDUP": "0"}, "mode": "batch", "description": "Packed evaluation without near-duplicate clustering"},
+    "compact_prompts": {"env": {"PROMPT_VARIANT": "compact"}, "description": "Compact instructions and tool schemas"},
+    "llm_feedback": {"env": {"FEEDBACK_MODE": "llm"}, "description": "Final feedback always written by the LLM (no templates)"},
+    "no_prescreen": {"env": {"PRESCREEN": "0"}, "description": "Every answer goes through the LLM stages (no local pre-screen)"},
+}
+
+def load_dataset(dataset_path):
+    with open(dataset_path, encoding="utf-8") as dataset_file:
+        return [json.loads(line) for line in dataset_file if line.strip()]
+
+def dataset_fingerprint(dataset_path):
+    with open(dataset_path, "rb") as dataset_file:
+        return hashlib.sha256(dataset_file.read()).hexdigest()[:16]
+
+def _normalize_concept(concept):
+    return " ".join(str(concept).lower().split())
+
+def _quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+def score_item(item, final_result, breakdown_scores, tolerance):
+    """Deviation of one graded item from its reference scores."""
+    row = {"id": item["id"], "graded": bool(final_result) and not final_result.get("provisional"),
+           "final_score": final_result.get("final_score") if final_result else None,
+           "reference_final_score": item["reference_final_score"]}
+    if not row["graded"] or not isinstance(row["final_score"], (int, float)):
+        row["graded"] = False
+        return row
+    row["final_score_error"] = abs(row["final_score"] - item["reference_final_score"])
+    row["agrees"] = row["final_score_error"] <= tolerance
+    predicted = {_normalize_concept(entry.get("concept")): entry.get("score") for entry in breakdown_scores or [] if isinstance(entry, dict)}
+    concept_errors = []
+    for reference in item.get("reference_scores", []):
+        score = predicted.get(_normalize_concept(reference["concept"]))
+        if isinstance(score, (int, float)):
+            concept_errors.append(abs(score - reference["score"]))
+    row["concept_errors"] = concept_errors
+    row["concepts_matched"] = len(concept_errors)
+    row["concepts_expected"] = len(item.get("reference_scores", []))
+    return row
+
+def summarize(rows, latencies, stats, wall_seconds):
+    graded = [row for row in rows if row["graded"]]
+    concept_errors = [error for row in graded for error in row["concept_errors"]]
+    concepts_expected = sum(row["concepts_expected"] for row in graded)
+    count = len(rows) or 1
+    return {
+        "items": len(rows),
+        "graded": len(graded),
+        "failed": len(rows) - len(graded),
+        "latency_mean_seconds": round(sum(latencies) / len(latencies), 4) if latencies else None,
+        "latency_p50_seconds": round(_quantile(latencies, 0.5), 4) if latencies else None,
+        "latency_p95_seconds": round(_quantile(latencies, 0.95), 4) if latencies else None,
+        "wall_seconds": round(wall_seconds, 3),
+        "llm_calls": stats["calls"],
+        "llm_calls_per_item": round(stats["calls"] / count, 2),
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": stats["completion_tokens"],
+        "tokens_per_item": round((stats["prompt_tokens"] + stats["completion_tokens"]) / count, 1),
+        "replay_misses": stats["misses"],
+        "final_score_mae": round(sum(row["final_score_error"] for row in graded) / len(graded), 2) if graded else None,
+        "agreement_rate": round(sum(row["agrees"] for row in graded) / len(graded), 3) if graded else None,
+        "concept_score_mae": round(sum(concept_errors) / len(concept_errors), 2) if concept_errors else None,
+        "concept_coverage": round(len(concept_errors) / concepts_expected, 3) if concepts_expected else None,
+    }
+
+def run_worker(configuration_name, dataset_path, llm_mode, cassette_path, replay_latency, strict, tolerance, output_path):
+    """Runs one configuration in this process and writes its results to output_path."""
+    sys.path.insert(0, REPO_DIR)
+    import Agents.backends as backends
+    import Agents.llm as llm
+    import Agents.validation as validation
+    import analytics
+    import workflow
+    from benchmark.llm_cassette import Cassette, CassetteBackend, new_stats
+
+    configuration = CONFIGURATIONS[configuration_name]
+    cassette = Cassette(cassette_path)
+    stats = new_stats()
+    # Every backend in use is wrapped (recording wraps the real backend; replay and stub replace it).
+    for backend_name in set(llm.AGENT_BACKENDS.values()) | {backends.DEFAULT_BACKEND}:
+        inner_backend = backends.get_backend(backend_name) if llm_mode == "record" else None
+        backends.register_backend(backend_name, CassetteBackend(cassette, llm_mode, inner_backend, replay_latency, strict, stats))
+
+    items = load_dataset(dataset_path)
+    if configuration.get("pin_rubric"):
+        for item in items:
+            repaired, errors, _ = validation.validate_and_repair("rubric_extraction", {"rubric": item["rubric"]})
+            workflow.pin_question_artifacts(workflow.question_key(item["text"], item["question"]), {
+                "question_analysis": {"key_concepts_expected": [entry["concept"] for entry in repaired["rubric"]]},
+                "rubric": repaired["rubric"], "source": "benchmark",
+            })
+
+    rows, latencies = [], []
+    start_time = time.monotonic()
+    if configuration.get("mode") == "batch":
+        groups = {}
+        for item in items:
+            groups.setdefault((item["text"], item["question"]), []).append(item)
+        for (text, question), group in groups.items():
+            group_start = time.monotonic()
+            results = workflow.run_batch_evaluation_workflow(text, question, [item["answer"] for item in group], trace_verbosity="summary")
+            # Per-answer latency of a batch: its share of the batch's wall time.
+            latencies.extend([(time.monotonic() - group_start) / len(group)] * len(group))
+            for item, (final_result, steps) in zip(group, results):
+                details = analytics.extract_evaluation_details(final_result, steps)
+                rows.append(score_item(item, final_result, details["breakdown_scores"], tolerance))
+    else:
+        for item in items:
+            item_start = time.monotonic()
+            final_result, steps = workflow.run_evaluation_workflow(item["text"], item["question"], item["answer"], trace_verbosity="summary")
+            latencies.append(time.monotonic() - item_start)
+            details = analytics.extract_evaluation_details(final_result, steps)
+            rows.append(score_item(item, final_result, details["breakdown_scores"], tolerance))
+
+    summary = summarize(rows, latencies, stats, time.monotonic() - start_time)
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump({"configuration": configuration_name, "summary": summary, "items": rows}, output_file, ensure_ascii=False)
+
+def run_configuration(configuration_name, args, cassette_path):
+    """Runs a configuration in a fresh interpreter. Returns its results, or None if the run crashed."""
+    configuration = CONFIGURATIONS[configuration_name]
+    environment = dict(os.environ, **configuration["env"])
+    # No side effects outside the benchmark: no checkpoint files, no persistent grammar cache.
+    environment.update(WORKFLOW_CHECKPOINT_DIR="", GRAMMAR_SENTENCE_CACHE_PATH="")
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        output_path = os.path.join(temporary_dir, "result.json")
+        command = [
+            sys.executable, "-m", "benchmark.run_benchmark", "--worker", configuration_name,
+            "--dataset", args.dataset, "--llm", args.llm, "--cassette", cassette_path,
+            "--tolerance", str(args.tolerance), "--worker-output", output_path,
+        ]
+        if not args.replay_latency:
+            command.append("--no-replay-latency")
+        if args.strict:
+            command.append("--strict")
+        completed = subprocess.run(command, cwd=REPO_DIR, env=environment, capture_output=True, text=True)
+        if completed.returncode != 0 or not os.path.exists(output_path):
+            print(f"[{configuration_name}] failed:\n{completed.stderr[-2000:] or completed.stdout[-2000:]}", file=sys.stderr)
+            return None
+        with open(output_path, encoding="utf-8") as output_file:
+            return json.load(output_file)
+
+def _format(value, suffix=""):
+    return "-" if value is None else f"{value}{suffix}"
+
+def print_report(results, baseline_name):
+    columns = ["configuration", "graded", "p50 s", "p95 s", "calls/item", "tokens/item", "misses", "MAE", "agree", "concept MAE", "Δ p50", "Δ MAE"]
+    baseline = next((result["summary"] for result in results if result["configuration"] == baseline_name), None)
+    lines = []
+    for result in results:
+        summary = result["summary"]
+        latency_delta = mae_delta = None
+        if baseline and baseline["latency_p50_seconds"] and summary["latency_p50_seconds"] is not None:
+            latency_delta = f"{100 * (summary['latency_p50_seconds'] / baseline['latency_p50_seconds'] - 1):+.0f}%"
+        if baseline and baseline["final_score_mae"] is not None and summary["final_score_mae"] is not None:
+            mae_delta = f"{summary['final_score_mae'] - baseline['final_score_mae']:+.2f}"
+        lines.append([
+            result["configuration"], f"{summary['graded']}/{summary['items']}",
+            _format(summary["latency_p50_seconds"]), _format(summary["latency_p95_seconds"]),
+            _format(summary["llm_calls_per_item"]), _format(summary["tokens_per_item"]), _format(summary["replay_misses"]),
+            _format(summary["final_score_mae"]), _format(summary["agreement_rate"]), _format(summary["concept_score_mae"]),
+            _format(latency_delta), _format(mae_delta),
+        ])
+    widths = [max(len(str(row[index])) for row in [columns] + lines) for index in range(len(columns))]
+    for row in [columns] + lines:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
+    if any(result["summary"]["replay_misses"] for result in results):
+        print("\nNote: requests missing from the cassette were stubbed; record them (--llm record) before comparing accuracy.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Golden-set accuracy vs. latency benchmark of workflow configurations.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Golden dataset (.jsonl)")
+    parser.add_argument("--configs", nargs="+", choices=sorted(CONFIGURATIONS), help="Configurations to run (default: all)")
+    parser.add_argument("--llm", choices=["replay", "record", "stub"], default="replay",
+                        help="replay recorded responses (default), record them from the real backends, or stub every call")
+    parser.add_argument("--cassette", help="Recorded responses (default: benchmark/cassettes/<dataset name>.jsonl)")
+    parser.add_argument("--no-replay-latency", dest="replay_latency", action="store_false",
+                        help="Replay instantly instead of with the recorded latencies")
+    parser.add_argument("--strict", action="store_true", help="Fail on requests missing from the cassette instead of stubbing them")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Agreement tolerance in points (default: 10)")
+    parser.add_argument("--report", help="Write the full results (per item) to this JSON file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    dataset_name = os.path.splitext(os.path.basename(args.dataset))[0]
+    cassette_path = args.cassette or os.path.join(DEFAULT_CASSETTE_DIR, f"{dataset_name}.jsonl")
+    if args.worker:
+        run_worker(args.worker, args.dataset, args.llm, cassette_path, args.replay_latency, args.strict, args.tolerance, args.worker_output)
+        return
+
+    configuration_names = args.configs or list(CONFIGURATIONS)
+    print(f"Dataset {dataset_name} ({dataset_fingerprint(args.dataset)}), LLM responses: {args.llm} ({cassette_path})\n")
+    results = []
+    for configuration_name in configuration_names:
+        print(f"Running {configuration_name}: {CONFIGURATIONS[configuration_name]['description']}...")
+        result = run_configuration(configuration_name, args, cassette_path)
+        if result is not None:
+            results.append(result)
+    print()
+    print_report(results, configuration_names[0])
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            json.dump({
+                "dataset": dataset_name, "dataset_sha256": dataset_fingerprint(args.dataset), "llm": args.llm,
+                "tolerance": args.tolerance, "results": results,
+            }, report_file, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.report}")
+
+if __name__ == "__main__":
+    main()
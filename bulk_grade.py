@@ -0,0 +1,237 @@
+# bulk_grade.py
+# Offline bulk grading of (text, question, answer) records from a JSONL or CSV file.
+# Records are streamed (the input is never loaded in memory), graded with bounded parallelism, written
+# incrementally to JSONL or Parquet, and checkpointed so that an interrupted run resumes where it stopped.
+#
+#   python bulk_grade.py answers.jsonl --output results.jsonl --workers 4
+#   python bulk_grade.py answers.csv --output results_parquet/ --format parquet
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+import analytics
+import workflow
+import Agents.dispatcher as dispatcher
+import Agents.llm as llm
+import Agents.tenants as tenants
+
+# Accepted column/field names for each input value.
+FIELD_ALIASES = {
+    "text": ["text", "text_input", "texte"],
+    "question": ["question", "question_input"],
+    "answer": ["answer", "student_answer", "student_answer_input", "reponse", "réponse"],
+}
+UNAVAILABLE_POLL_SECONDS = 5 # Wait between checks while the LLM backend is unavailable
+
+def _field(record, name):
+    for alias in FIELD_ALIASES[name]:
+        if record.get(alias) not in (None, ""):
+            return str(record[alias])
+    return ""
+
+def iter_records(input_path, id_field):
+    """Yields (record_id, record) one at a time from a JSONL or CSV file."""
+    with open(input_path, encoding="utf-8", newline="") as input_file:
+        if input_path.lower().endswith(".csv"):
+            rows = csv.DictReader(input_file)
+        else:
+            rows = (json.loads(line) for line in input_file if line.strip())
+        for line_number, record in enumerate(rows, start=1):
+            record_id = str(record.get(id_field) or line_number)
+            yield record_id, record
+
+def load_checkpoint(checkpoint_path):
+    """Returns the set of record ids already graded in previous runs."""
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, encoding="utf-8") as checkpoint_file:
+        return {line.rstrip("\n") for line in checkpoint_file if line.strip()}
+
+class JsonlResultWriter:
+    def __init__(self, output_path):
+        self._file = open(output_path, "a", encoding="utf-8")
+
+    def write(self, row):
+        self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+def _result_schema():
+    """Fixed schema of the result rows, so that every part file of a run (and of later runs) reads back as one table."""
+    import pyarrow as pa
+    return pa.schema([
+        ("record_id", pa.string()), ("question_id", pa.string()), ("student_answer", pa.string()),
+        ("final_score", pa.float64()), ("feedback", pa.string()), ("breakdown_scores", pa.string()), # JSON
+        ("grammar_penalty", pa.float64()), ("graded_at", pa.string()),
+    ])
+
+class ParquetResultWriter:
+    """Writes buffered rows as Parquet part files in a directory (one new part per flush)."""
+
+    def __init__(self, output_dir):
+        try:
+            import pyarrow  # noqa: F401 - optional dependency, only needed for Parquet output
+        except ImportError:
+            sys.exit("ERROR: Parquet output requires pyarrow (pip install pyarrow).")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self._run_prefix = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        self._part_number = 0
+        self._rows = []
+        self._schema = _result_schema()
+
+    def write(self, row):
+        self._rows.append(row)
+
+    def flush(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # Whole-number scores would otherwise be inferred as int64 in one part and float64 in another.
+        rows = [dict(row, breakdown_scores=json.dumps(row["breakdown_scores"], ensure_ascii=False)) for row in self._rows]
+        part_path = os.path.join(self.output_dir, f"part-{self._run_prefix}-{self._part_number:05d}.parquet")
+        pq.write_table(pa.Table.from_pylist(rows, schema=self._schema), part_path)
+        self._part_number += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+class QuestionArtifacts:
+    """Computes the question-level stages once per distinct (text, question), even across worker threads."""
+
+    def __init__(self):
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def get(self, text, question):
+        with self._locks_guard:
+            lock = self._locks.setdefault(workflow.question_key(text, question), threading.Lock())
+        with lock:
+            artifacts = workflow.get_pinned_question_artifacts(text, question) or workflow.get_cached_question_artifacts(text, question)
+            if artifacts is None:
+                artifacts, _ = workflow.run_question_stages(text, question)
+            return artifacts
+
+def grade_record(record_id, record, question_artifacts):
+    """
+    Grades one record.
+    Returns:
+        A result row (dict) if the record was graded, or None if it should be retried on a later run.
+    """
+    text, question, answer = _field(record, "text"), _field(record, "question"), _field(record, "answer")
+    if not (text and question and answer):
+        print(f"Record {record_id}: missing text, question or answer; skipped.", file=sys.stderr)
+        return None
+    artifacts = question_artifacts.get(text, question)
+    if artifacts is None:
+        return None
+    # The summary trace keeps the parsed outputs needed for the breakdown and grammar details.
+    final_result, steps_data = workflow.run_evaluation_workflow(text, question, answer, artifacts, trace_verbosity="summary")
+    if not final_result or final_result.get("provisional"):
+        # Failed or graded in degraded mode: leave it unchecked so that the next run regrades it.
+        return None
+    details = analytics.extract_evaluation_details(final_result, steps_data)
+    return {
+        "record_id": record_id,
+        "question_id": workflow.question_key(text, question),
+        "student_answer": answer,
+        "final_score": final_result.get("final_score"),
+        "feedback": final_result.get("feedback"),
+        "breakdown_scores": details["breakdown_scores"],
+        "grammar_penalty": details["grammar_penalty"],
+        "graded_at": datetime.utcnow().isoformat(),
+    }
+
+def run(input_path, output_path, output_format, checkpoint_path, id_field, workers, max_in_flight, flush_every, priority_class="bulk",
+        tenant_id=tenants.DEFAULT_TENANT):
+    done_ids = load_checkpoint(checkpoint_path)
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} records already graded.")
+    writer = ParquetResultWriter(output_path) if output_format == "parquet" else JsonlResultWriter(output_path)
+    question_artifacts = QuestionArtifacts()
+    graded, failed, unflushed_ids = 0, 0, []
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint_file, ThreadPoolExecutor(
+            max_workers=workers, initializer=workflow.set_thread_context, initargs=(priority_class, tenant_id)) as executor:
+        def checkpoint():
+            # Results are made durable before their ids are checkpointed (at-least-once output).
+            writer.flush()
+            checkpoint_file.writelines(f"{record_id}\n" for record_id in unflushed_ids)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+            unflushed_ids.clear()
+
+        def collect(futures):
+            nonlocal graded, failed
+            for future in futures:
+                record_id = in_flight.pop(future)
+                try:
+                    row = future.result()
+                except Exception as e:
+                    print(f"Record {record_id}: unexpected error {e}", file=sys.stderr)
+                    row = None
+                if row is None:
+                    failed += 1
+                    continue
+                writer.write(row)
+                unflushed_ids.append(record_id)
+                graded += 1
+            if len(unflushed_ids) >= flush_every:
+                checkpoint()
+                print(f"{graded} graded, {failed} to retry.")
+
+        in_flight = {}
+        for record_id, record in iter_records(input_path, id_field):
+            if record_id in done_ids:
+                continue
+            # Rate-limit stall or provider incident: pause instead of grading everything provisionally.
+            while llm.is_unavailable():
+                time.sleep(UNAVAILABLE_POLL_SECONDS)
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(grade_record, record_id, record, question_artifacts)] = record_id
+        collect(list(wait(list(in_flight)).done))
+        checkpoint()
+
+    writer.close()
+    print(f"Done: {graded} graded in this run, {failed} left for a later run.")
+    return graded, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade a JSONL/CSV file of (text, question, answer) records, resumably.")
+    parser.add_argument("input", help="Input .jsonl or .csv file")
+    parser.add_argument("--output", required=True, help="Output .jsonl file, or output directory for --format parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], help="Output format (default: from the output extension)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--id-field", default="id", help="Field holding a unique record id (default: id, else the line number)")
+    parser.add_argument("--workers", type=int, default=4, help="Records graded in parallel")
+    parser.add_argument("--max-in-flight", type=int, help="Records read ahead of the writer (default: 4 x workers)")
+    parser.add_argument("--flush-every", type=int, default=100, help="Write and checkpoint every N graded records")
+    parser.add_argument("--priority", choices=dispatcher.PRIORITY_CLASSES, default="bulk", help="LLM call priority class (default: bulk)")
+    parser.add_argument("--tenant", default=tenants.DEFAULT_TENANT, help="Tenant (school) the LLM usage is attributed to")
+    args = parser.parse_args(argv)
+    if not tenants.is_valid_tenant_id(args.tenant):
+        parser.error("--tenant: letters, digits, '.', '-' and '_' only (at most 64 characters)")
+
+    output_format = args.format or ("parquet" if args.output.endswith((".parquet", "/", os.sep)) else "jsonl")
+    checkpoint_path = args.checkpoint or args.output.rstrip("/") + ".checkpoint"
+    run(args.input, args.output, output_format, checkpoint_path, args.id_field,
+        args.workers, args.max_in_flight or 4 * args.workers, args.flush_every, args.priority, args.tenant)
+
+if __name__ == "__main__":
+    main()
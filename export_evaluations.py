@@ -0,0 +1,211 @@
+# export_evaluations.py
+# Streaming export of the evaluations collection for analytics, as Parquet, Arrow (IPC file) or gzip CSV.
+# Documents are read through a batched cursor with a projection and written one batch at a time (one
+# Parquet row group / Arrow record batch / compressed CSV chunk per batch), so memory stays bounded by
+# EXPORT_BATCH_SIZE whatever the size of the export. Each row is flattened:
+#   evaluation_id, question_id, question, timestamp, final_score, provisional, rubric_version, grammar_penalty,
+#   grammar_errors_<type> (count per analytics.GRAMMAR_ERROR_TYPES), score__<concept> (one column per concept)
+# and student_answer with --include-answers. Also served by flask-app.py as GET /export/evaluations.
+#
+#   python export_evaluations.py --output evaluations.parquet --since 2026-09-01
+#   python export_evaluations.py --output q.csv.gz --question-id <question_id>
+import argparse
+import csv
+import io
+import os
+import sys
+import zlib
+from datetime import datetime
+
+import analytics
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_FORMATS = ("parquet", "arrow", "csv")
+CONTENT_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+    "csv": "application/gzip",
+}
+FILE_EXTENSIONS = {"parquet": "parquet", "arrow": "arrow", "csv": "csv.gz"}
+CONCEPT_COLUMN_PREFIX = "score__"
+
+BASE_COLUMNS = ["evaluation_id", "question_id", "question", "timestamp", "final_score", "provisional", "rubric_version", "grammar_penalty"]
+GRAMMAR_COLUMNS = [f"grammar_errors_{error_type}" for error_type in analytics.GRAMMAR_ERROR_TYPES]
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401 - optional dependency, only needed for Parquet/Arrow output
+    except ImportError:
+        return False
+    return True
+
+def parse_date(value):
+    """Parses an ISO date or datetime (e.g. "2026-09-01"); None stays None. Raises ValueError if invalid."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+def build_query(question_id=None, since=None, until=None):
+    """Mongo filter on question id and on the evaluation timestamp (since inclusive, until exclusive)."""
+    query = {}
+    if question_id:
+        query["question_id"] = question_id
+    if since or until:
+        query["timestamp"] = {}
+        if since:
+            query["timestamp"]["$gte"] = since
+        if until:
+            query["timestamp"]["$lt"] = until
+    return query
+
+def _projection(include_answers):
+    projection = {field: 1 for field in ["question_id", "question", "timestamp", "final_score", "provisional", "rubric_version", "grammar_penalty"]}
+    projection.update({"breakdown_scores.concept": 1, "breakdown_scores.score": 1, "grammar_errors.type": 1})
+    if include_answers:
+        projection["student_answer"] = 1
+    return projection
+
+def export_columns(concepts, include_answers=False):
+    columns = BASE_COLUMNS + GRAMMAR_COLUMNS + [CONCEPT_COLUMN_PREFIX + concept for concept in concepts]
+    return columns + ["student_answer"] if include_answers else columns
+
+def flatten_evaluation(document, concepts, include_answers=False):
+    """One export row for a stored evaluation document (see flask-app.py)."""
+    row = {
+        "evaluation_id": str(document["_id"]),
+        "question_id": document.get("question_id"),
+        "question": document.get("question"),
+        "timestamp": document.get("timestamp"),
+        "final_score": document.get("final_score"),
+        "provisional": bool(document.get("provisional", False)),
+        "rubric_version": document.get("rubric_version"),
+        "grammar_penalty": document.get("grammar_penalty"),
+    }
+    error_counts = dict.fromkeys(analytics.GRAMMAR_ERROR_TYPES, 0)
+    for error in document.get("grammar_errors") or []:
+        error_type = error.get("type") if isinstance(error, dict) else None
+        error_counts[error_type if error_type in error_counts else "other"] += 1
+    row.update({f"grammar_errors_{error_type}": count for error_type, count in error_counts.items()})
+    scores = {entry.get("concept"): entry.get("score") for entry in document.get("breakdown_scores") or [] if isinstance(entry, dict)}
+    row.update({CONCEPT_COLUMN_PREFIX + concept: scores.get(concept) for concept in concepts})
+    if include_answers:
+        row["student_answer"] = document.get("student_answer")
+    return row
+
+def _iter_row_batches(collection, query, concepts, include_answers, batch_size):
+    cursor = collection.find(query, _projection(include_answers), batch_size=batch_size).sort("_id", 1)
+    rows = []
+    for document in cursor:
+        rows.append(flatten_evaluation(document, concepts, include_answers))
+        if len(rows) >= batch_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object collecting what a Parquet/Arrow writer produces, drained after each batch."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def _arrow_schema(concepts, include_answers):
+    import pyarrow as pa
+    fields = [
+        ("evaluation_id", pa.string()), ("question_id", pa.string()), ("question", pa.string()),
+        ("timestamp", pa.timestamp("ms")), ("final_score", pa.float64()), ("provisional", pa.bool_()),
+        ("rubric_version", pa.int64()), ("grammar_penalty", pa.float64()),
+    ]
+    fields += [(column, pa.int32()) for column in GRAMMAR_COLUMNS]
+    fields += [(CONCEPT_COLUMN_PREFIX + concept, pa.float64()) for concept in concepts]
+    if include_answers:
+        fields.append(("student_answer", pa.string()))
+    return pa.schema(fields)
+
+def _arrow_chunks(row_batches, schema, output_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd") if output_format == "parquet" else pa.ipc.new_file(sink, schema)
+    for rows in row_batches:
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def _csv_chunks(row_batches, columns):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) # gzip container
+    text_buffer = io.StringIO()
+    writer = csv.DictWriter(text_buffer, fieldnames=columns)
+    writer.writeheader()
+    for rows in row_batches:
+        writer.writerows(rows)
+        yield compressor.compress(text_buffer.getvalue().encode("utf-8"))
+        text_buffer.seek(0)
+        text_buffer.truncate()
+    yield compressor.compress(text_buffer.getvalue().encode("utf-8")) + compressor.flush()
+
+def iter_export_chunks(collection, query, output_format="parquet", include_answers=False, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Streams the evaluations matching query in the given format ("parquet", "arrow" or "csv" for gzip CSV).
+    Yields:
+        Chunks of bytes which, concatenated, form the exported file.
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {output_format} (expected one of {', '.join(EXPORT_FORMATS)})")
+    # The concept columns must be known before the first batch is written: distinct is computed by the server.
+    concepts = sorted(concept for concept in collection.distinct("breakdown_scores.concept", query) if concept)
+    row_batches = _iter_row_batches(collection, query, concepts, include_answers, batch_size)
+    if output_format == "csv":
+        return _csv_chunks(row_batches, export_columns(concepts, include_answers))
+    return _arrow_chunks(row_batches, _arrow_schema(concepts, include_answers), output_format)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the evaluations collection as Parquet, Arrow or gzip CSV.")
+    parser.add_argument("--output", required=True, help="Output file (.parquet, .arrow or .csv.gz)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Output format (default: from the output extension)")
+    parser.add_argument("--question-id", help="Only export the evaluations of this question id")
+    parser.add_argument("--since", help="Only evaluations from this date on (ISO format, e.g. 2026-09-01)")
+    parser.add_argument("--until", help="Only evaluations before this date (ISO format)")
+    parser.add_argument("--include-answers", action="store_true", help="Also export the student answers")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="Documents per cursor batch and per written chunk")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ("csv" if args.output.endswith((".csv", ".csv.gz")) else "arrow" if args.output.endswith(".arrow") else "parquet")
+    if output_format != "csv" and not pyarrow_available():
+        sys.exit("ERROR: Parquet/Arrow output requires pyarrow (pip install pyarrow); use --format csv otherwise.")
+    try:
+        query = build_query(args.question_id, parse_date(args.since), parse_date(args.until))
+    except ValueError as e:
+        sys.exit(f"ERROR: invalid date: {e}")
+
+    from pymongo import MongoClient
+    client = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/"))
+    collection = client[os.environ.get("MONGO_DB_NAME", "evaluation_results_db")][os.environ.get("MONGO_COLLECTION_NAME", "evaluations")]
+    written = 0
+    with open(args.output, "wb") as output_file:
+        for chunk in iter_export_chunks(collection, query, output_format, args.include_answers, args.batch_size):
+            output_file.write(chunk)
+            written += len(chunk)
+    print(f"Exported to {args.output} ({written} bytes).")
+
+if __name__ == "__main__":
+    main()
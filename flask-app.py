@@ -1,4 +1,4 @@
-from flask import Flask, request, render_template, redirect, url_for, jsonify
+from flask import Flask, request, render_template, redirect, url_for, jsonify, Response, stream_with_context, g
 import json
 import os
 import traceback
@@ -8,6 +8,11 @@ from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure, PyMongoError
 from flask_cors import CORS
 
+import analytics
+import export_evaluations
+import rubric_registry
+import Agents.tracing as tracing
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -15,15 +20,21 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("MONGO_DB_NAME", "evaluation_results_db")
 COLLECTION_NAME = os.getenv("MONGO_COLLECTION_NAME", "evaluations")
+ANALYTICS_COLLECTION_NAME = os.getenv("MONGO_ANALYTICS_COLLECTION_NAME", "question_analytics")
+RUBRIC_COLLECTION_NAME = os.getenv("MONGO_RUBRIC_COLLECTION_NAME", "rubric_registry")
 
 client = None
 try:
     client = MongoClient(MONGO_URI)
     db = client[DB_NAME]
     evaluations_collection = db[COLLECTION_NAME]
+    analytics_collection = db[ANALYTICS_COLLECTION_NAME]
+    rubric_collection = db[RUBRIC_COLLECTION_NAME]
     # The ismaster command is cheap and does not require auth.
     client.admin.command('ismaster')
     print("Connecté à MongoDB avec succès !")
+    # Grilles d'enseignants épinglées : compilées une fois au démarrage
+    print(f"{rubric_registry.load_pinned_rubrics(rubric_collection)} grille(s) épinglée(s) chargée(s).")
 except ConnectionFailure as e:
     print(f"Impossible de se connecter à MongoDB : {e}")
     client = None # S'assurer que le client est None si la connexion échoue
@@ -34,15 +45,52 @@ except Exception as e:
 # Importer votre fonction de flux de travail
 # Assurez-vous que workflow.py et le dossier Agents/ sont dans le même répertoire que app.py ou dans le chemin Python
 try:
-    from workflow import run_evaluation_workflow
+    from workflow import run_evaluation_workflow, question_key, prepare_question
+    import workflow_checkpoints
+    import step_trace
+    import Agents.dispatcher as dispatcher
+    import Agents.tenants as tenants
 except ImportError as e:
     print(f"Erreur lors de l'importation du flux de travail : {e}")
     print("Assurez-vous que workflow.py et le dossier Agents sont correctement placés et que __init__.py existe dans Agents.")
     run_evaluation_workflow = None # Pour que l'application puisse toujours démarrer et afficher une erreur
 
+# Usage par établissement (tenant), écrite périodiquement dans MongoDB
+if client and run_evaluation_workflow is not None:
+    tenants.usage.start_flusher(db[tenants.TENANT_USAGE_COLLECTION_NAME])
+
 app = Flask(__name__)
 app.secret_key = os.urandom(24) # For session management, flash messages etc.
 
+TRACE_ID_HEADER = "X-Trace-ID"
+
+# Traces (Agents/tracing.py) : un span racine par requête, qui poursuit la trace de l'appelant (en-tête traceparent)
+@app.before_request
+def start_request_span():
+    if request.endpoint in (None, 'static'):
+        return
+    g.trace_span = tracing.start_span(f"{request.method} {request.url_rule.rule}", traceparent=request.headers.get('traceparent'),
+                                      http_method=request.method, http_route=request.url_rule.rule)
+    g.trace_token = tracing.attach(g.trace_span)
+
+@app.after_request
+def add_trace_header(response):
+    span = g.get('trace_span')
+    if span is not None and span.trace_id:
+        span.set_attribute("http_status_code", response.status_code)
+        response.headers[TRACE_ID_HEADER] = span.trace_id
+    return response
+
+@app.teardown_request
+def end_request_span(error=None):
+    span = g.pop('trace_span', None)
+    if span is None:
+        return
+    if error is not None:
+        span.set_error(error)
+    tracing.detach(g.pop('trace_token'))
+    span.end()
+
 # Example default texts
 DEFAULT_TEXT = """
 Dans la cour de l'école, les élèves sont joyeux. Ils jouent en groupes. Certains font de la
@@ -57,6 +105,13 @@ fort en maths.
 DEFAULT_QUESTION = "Que fait la maîtresse ?"
 DEFAULT_ANSWER = "La maîtresse explique la leçon de mathématiques, écrit des chiffres au tableau, montre comment faire des additions et résoudre des problèmes, et aide les élèves quand ils ont du mal."
 
+TENANT_HEADER = "X-Tenant-ID"
+INVALID_TENANT_MESSAGE = "Identifiant d'établissement invalide (lettres, chiffres, '.', '-' et '_', 64 caractères au plus)."
+
+def tenant_from_request(data=None):
+    """Établissement appelant : en-tête X-Tenant-ID, sinon champ tenant_id, sinon le tenant par défaut."""
+    return request.headers.get(TENANT_HEADER) or (data or {}).get('tenant_id') or tenants.DEFAULT_TENANT
+
 
 @app.route('/evaluate_answer', methods=['GET', 'POST'])
 def index():
@@ -83,11 +138,48 @@ def index():
             text_input = data.get('text_input')
             question_input = data.get('question_input')
             student_answer_input = data.get('student_answer_input')
+            # workflow_id (optionnel) : active les points de reprise ; renvoyer celui d'une tentative échouée
+            # reprend à l'étape qui a échoué
+            workflow_id = data.get('workflow_id')
+            # Détail de la trace des étapes renvoyée : "none", "summary" ou "full" (absente par défaut)
+            trace_verbosity = data.get('trace_verbosity')
+            # Classe de priorité des appels LLM : "interactive" (jeu en direct, par défaut), "normal" ou "bulk"
+            priority_class = data.get('priority', 'interactive')
+            tenant_id = tenant_from_request(data)
         else:
             # Fallback for form data if not JSON
             text_input = request.form.get('text_input')
             question_input = request.form.get('question_input')
             student_answer_input = request.form.get('student_answer_input')
+            workflow_id = request.form.get('workflow_id')
+            trace_verbosity = request.form.get('trace_verbosity')
+            priority_class = request.form.get('priority', 'interactive')
+            tenant_id = tenant_from_request(request.form)
+
+        # Sans workflow_id, pas de point de reprise : les réponses des élèves ne sont pas écrites sur le disque local
+        if workflow_id is not None and not workflow_checkpoints.is_valid_workflow_id(workflow_id):
+            error_message = "workflow_id invalide (caractères autorisés : lettres, chiffres, '-' et '_')."
+            if request.is_json:
+                return jsonify({"error": error_message}), 400
+            return render_template('index.html', error_message=error_message)
+
+        if trace_verbosity is not None and trace_verbosity not in step_trace.VERBOSITY_LEVELS:
+            error_message = f"trace_verbosity invalide (valeurs possibles : {', '.join(step_trace.VERBOSITY_LEVELS)})."
+            if request.is_json:
+                return jsonify({"error": error_message}), 400
+            return render_template('index.html', error_message=error_message)
+
+        if priority_class not in dispatcher.PRIORITY_CLASSES:
+            error_message = f"priority invalide (valeurs possibles : {', '.join(dispatcher.PRIORITY_CLASSES)})."
+            if request.is_json:
+                return jsonify({"error": error_message}), 400
+            return render_template('index.html', error_message=error_message)
+
+        if not tenants.is_valid_tenant_id(tenant_id):
+            error_message = INVALID_TENANT_MESSAGE
+            if request.is_json:
+                return jsonify({"error": error_message}), 400
+            return render_template('index.html', error_message=error_message)
 
         if not all([text_input, question_input, student_answer_input]):
             error_message = "Tous les champs de saisie sont obligatoires."
@@ -98,10 +190,15 @@ def index():
                                    question_input=question_input,
                                    student_answer_input=student_answer_input)
         try:
+            if client:
+                rubric_registry.refresh_if_stale(rubric_collection)
             print("Démarrage du flux de travail d'évaluation...")
-            final_result, steps_data = run_evaluation_workflow(
-                text_input, question_input, student_answer_input
-            )
+            with dispatcher.priority(priority_class), tenants.tenant(tenant_id):
+                final_result, steps_data = run_evaluation_workflow(
+                    text_input, question_input, student_answer_input, workflow_id=workflow_id,
+                    trace_verbosity=trace_verbosity
+                )
+            tenants.record_evaluation(tenant_id)
             print("Flux de travail terminé.")
             if final_result:
                 print("Résultat final :", json.dumps(final_result, indent=2, ensure_ascii=False))
@@ -109,6 +206,8 @@ def index():
                 # Extraire le score final et le feedback
                 final_score = final_result.get('final_score')
                 feedback = final_result.get('feedback')
+                # Détails par concept et erreurs de grammaire, pour les statistiques de classe
+                evaluation_details = analytics.extract_evaluation_details(final_result, steps_data)
 
                 # Préparer les données pour MongoDB
                 data_to_save = {
@@ -117,15 +216,36 @@ def index():
                     "student_answer": student_answer_input,
                     "final_score": final_score,
                     "feedback": feedback,
+                    # Note provisoire (mode dégradé, LLM indisponible) : à recorriger plus tard
+                    "provisional": bool(final_result.get('provisional', False)),
+                    "question_id": question_key(text_input, question_input),
+                    "tenant_id": tenant_id,
+                    "breakdown_scores": evaluation_details["breakdown_scores"],
+                    "rubric": evaluation_details["rubric"],
+                    "rubric_version": evaluation_details["rubric_version"],
+                    "grammar_penalty": evaluation_details["grammar_penalty"],
+                    "grammar_errors": evaluation_details["grammar_errors"],
+                    "trace_id": tracing.current_trace_id(),
                     "timestamp": datetime.utcnow() # Ajouter un horodatage
                 }
 
                 inserted_id = None
-                if client:
+                # Requête rejouée pour un workflow déjà terminé : l'évaluation est déjà enregistrée
+                saved_id = workflow_checkpoints.saved_evaluation_id(workflow_id) if workflow_id else None
+                if saved_id:
+                    inserted_id = saved_id
+                    print("Workflow déjà terminé et enregistré : évaluation existante renvoyée.")
+                elif client:
                     try:
-                        result = evaluations_collection.insert_one(data_to_save)
+                        with tracing.span("mongodb.insert_one", collection=COLLECTION_NAME):
+                            result = evaluations_collection.insert_one(data_to_save)
                         inserted_id = str(result.inserted_id) # Convert ObjectId to string
+                        if workflow_id:
+                            workflow_checkpoints.record_saved_evaluation(workflow_id, inserted_id)
                         print("Données sauvegardées avec succès dans MongoDB.")
+                        # Mise à jour incrémentale des statistiques de la question
+                        with tracing.span("mongodb.update_analytics", collection=ANALYTICS_COLLECTION_NAME):
+                            analytics.record_evaluation(analytics_collection, data_to_save)
                     except PyMongoError as mongo_e:
                         print(f"Erreur lors de la sauvegarde des données dans MongoDB : {mongo_e}")
                         error_message = f"Erreur lors de la sauvegarde des résultats : {str(mongo_e)}"
@@ -145,6 +265,7 @@ def index():
                     "feedback": feedback,
                     "timestamp": datetime.utcnow()
                 }
+                inserted_id = None # Rien n'est sauvegardé ; le workflow_id permet de reprendre
             # print("Steps Data:", json.dumps(steps_data, indent=2, ensure_ascii=False))
 
 
@@ -175,13 +296,23 @@ def index():
                 "student_answer": data_to_save.get("student_answer"),
                 "final_score": data_to_save.get("final_score"),
                 "feedback": data_to_save.get("feedback"),
+                "provisional": data_to_save.get("provisional", False),
+                "question_id": data_to_save.get("question_id"),
+                "workflow_id": workflow_id,
+                "tenant_id": tenant_id,
+                # Identifiant de la trace de la requête (null si TRACING_EXPORTER=off)
+                "trace_id": tracing.current_trace_id(),
                 "timestamp": data_to_save.get("timestamp").isoformat() if data_to_save.get("timestamp") else None
             }
-            return jsonify(response_data)
+            if trace_verbosity is not None and isinstance(steps_data, step_trace.StepTrace):
+                response_data["trace"] = steps_data.to_dict()
+            # Sérialisation rapide (orjson si disponible) : la trace peut être volumineuse
+            return app.response_class(step_trace.dumps(response_data), mimetype="application/json")
         else:
             return render_template('index.html',
                                    final_result=final_result,
                                    steps_data=steps_data,
+                                   trace_inputs=getattr(steps_data, "shared_inputs", None),
                                    error_message=error_message,
                                    # Pass back the inputs to repopulate the form
                                    text_input=text_input,
@@ -196,6 +327,161 @@ def index():
                                error_message=error_message # Show GROQ key warning if applicable
                                )
 
+@app.route('/prepare_question', methods=['POST'])
+def prepare_question_route():
+    """
+    Appelé par le jeu à l'affichage d'une question : l'analyse de la question et la grille (étapes 1-2) sont
+    calculées en arrière-plan, pour que la première réponse soit corrigée aussi vite que les suivantes.
+    Corps JSON : text_input, question_input. Renvoie 202 (préparation lancée) ou 200 (déjà prête).
+    """
+    if run_evaluation_workflow is None:
+        return jsonify({"error": "Le module de flux de travail n'a pas pu être chargé."}), 500
+    data = request.get_json(silent=True) or {}
+    text_input, question_input = data.get('text_input'), data.get('question_input')
+    if not text_input or not question_input:
+        return jsonify({"error": "text_input et question_input sont obligatoires."}), 400
+    tenant_id = tenant_from_request(data)
+    if not tenants.is_valid_tenant_id(tenant_id):
+        return jsonify({"error": INVALID_TENANT_MESSAGE}), 400
+    if client:
+        # Une grille épinglée par l'enseignant rend la préparation inutile.
+        rubric_registry.refresh_if_stale(rubric_collection)
+    with tenants.tenant(tenant_id):
+        question_id, status = prepare_question(text_input, question_input)
+    return jsonify({"question_id": question_id, "status": status, "trace_id": tracing.current_trace_id()}), 200 if status == "ready" else 202
+
+@app.route('/metrics/dispatcher', methods=['GET'])
+def dispatcher_metrics():
+    """Attente en file par classe de priorité (p50/p95/max), appels en file et en cours."""
+    if run_evaluation_workflow is None:
+        return jsonify({"error": "Le module de flux de travail n'a pas pu être chargé."}), 500
+    return jsonify(dispatcher.metrics())
+
+@app.route('/metrics/tenants', methods=['GET'])
+def tenant_metrics():
+    """
+    Usage par établissement : quotas, appels en file et en cours et attente (p50/p95), consommation depuis le
+    démarrage du processus, et consommation journalière enregistrée (paramètres : tenant_id, days=7).
+    """
+    if run_evaluation_workflow is None:
+        return jsonify({"error": "Le module de flux de travail n'a pas pu être chargé."}), 500
+    tenant_id = request.args.get('tenant_id')
+    if tenant_id is not None and not tenants.is_valid_tenant_id(tenant_id):
+        return jsonify({"error": INVALID_TENANT_MESSAGE}), 400
+    try:
+        days = int(request.args.get('days', 7))
+    except ValueError:
+        return jsonify({"error": "days doit être un entier."}), 400
+    live = dispatcher.metrics()["tenants"]
+    totals = tenants.usage.totals()
+    tenant_ids = [tenant_id] if tenant_id else sorted(set(live) | set(totals) | set(tenants.TENANT_QUOTAS))
+    response_data = {
+        "tenants": {
+            tenant: {"quota": tenants.quota(tenant), "dispatch": live.get(tenant), "usage_since_start": totals.get(tenant)}
+            for tenant in tenant_ids
+        }
+    }
+    if client:
+        try:
+            response_data["daily_usage"] = tenants.read_daily_usage(db[tenants.TENANT_USAGE_COLLECTION_NAME], tenant_id, days)
+        except PyMongoError as mongo_e:
+            return jsonify({"error": f"Erreur lors de la lecture de l'usage : {str(mongo_e)}"}), 500
+    return jsonify(response_data)
+
+@app.route('/analytics/<question_id>', methods=['GET'])
+def question_analytics(question_id):
+    """Statistiques agrégées d'une question (lecture O(1), mises à jour à chaque évaluation)."""
+    if not client:
+        return jsonify({"error": "Base de données non connectée."}), 503
+    try:
+        aggregate = analytics.read_aggregate(analytics_collection, question_id)
+    except PyMongoError as mongo_e:
+        return jsonify({"error": f"Erreur lors de la lecture des statistiques : {str(mongo_e)}"}), 500
+    if aggregate is None:
+        return jsonify({"error": "Aucune évaluation enregistrée pour cette question."}), 404
+    return jsonify(aggregate)
+
+@app.route('/export/evaluations', methods=['GET'])
+def export_evaluations_route():
+    """
+    Export en flux des évaluations (Parquet par défaut, Arrow ou CSV gzip), avec scores par concept et
+    nombres d'erreurs de grammaire aplatis en colonnes.
+    Paramètres : format, question_id, since / until (dates ISO), include_answers=1.
+    """
+    if not client:
+        return jsonify({"error": "Base de données non connectée."}), 503
+    output_format = request.args.get('format', 'parquet')
+    if output_format not in export_evaluations.EXPORT_FORMATS:
+        return jsonify({"error": f"format invalide (valeurs possibles : {', '.join(export_evaluations.EXPORT_FORMATS)})."}), 400
+    if output_format != 'csv' and not export_evaluations.pyarrow_available():
+        return jsonify({"error": "Les formats Parquet et Arrow nécessitent pyarrow ; utilisez format=csv."}), 400
+    try:
+        query = export_evaluations.build_query(
+            request.args.get('question_id'),
+            export_evaluations.parse_date(request.args.get('since')),
+            export_evaluations.parse_date(request.args.get('until')),
+        )
+    except ValueError:
+        return jsonify({"error": "Date invalide (format ISO attendu, par exemple 2026-09-01)."}), 400
+    chunks = export_evaluations.iter_export_chunks(
+        evaluations_collection, query, output_format, request.args.get('include_answers') == '1'
+    )
+    filename = f"evaluations.{export_evaluations.FILE_EXTENSIONS[output_format]}"
+    return Response(stream_with_context(chunks), mimetype=export_evaluations.CONTENT_TYPES[output_format],
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route('/rubrics', methods=['POST'])
+def import_rubric():
+    """
+    Importe la grille d'un enseignant pour une question, comme nouvelle version (épinglée par défaut).
+    Corps JSON : text_input, question_input, rubric ([{concept, keywords, weight}]),
+    key_concepts_expected (optionnel), author (optionnel), pin (optionnel, true par défaut).
+    """
+    if not client:
+        return jsonify({"error": "Base de données non connectée."}), 503
+    data = request.get_json(silent=True) or {}
+    if not all([data.get('text_input'), data.get('question_input'), data.get('rubric')]):
+        return jsonify({"error": "text_input, question_input et rubric sont obligatoires."}), 400
+    try:
+        question_id, version, repairs = rubric_registry.import_rubric(
+            rubric_collection, data['text_input'], data['question_input'], data['rubric'],
+            key_concepts_expected=data.get('key_concepts_expected'), author=data.get('author'), pin=data.get('pin', True)
+        )
+    except rubric_registry.RubricError as e:
+        return jsonify({"error": f"Grille invalide : {e}"}), 400
+    except PyMongoError as mongo_e:
+        return jsonify({"error": f"Erreur lors de l'enregistrement de la grille : {str(mongo_e)}"}), 500
+    return jsonify({"question_id": question_id, "version": version, "pinned": bool(data.get('pin', True)), "repairs": repairs}), 201
+
+@app.route('/rubrics/<question_id>', methods=['GET'])
+def get_rubric(question_id):
+    """Versions enregistrées de la grille d'une question et version épinglée."""
+    if not client:
+        return jsonify({"error": "Base de données non connectée."}), 503
+    try:
+        entry = rubric_registry.read_entry(rubric_collection, question_id)
+    except PyMongoError as mongo_e:
+        return jsonify({"error": f"Erreur lors de la lecture de la grille : {str(mongo_e)}"}), 500
+    if entry is None:
+        return jsonify({"error": "Aucune grille enregistrée pour cette question."}), 404
+    return jsonify(entry)
+
+@app.route('/rubrics/<question_id>/pin', methods=['POST'])
+def pin_rubric(question_id):
+    """Épingle une version de la grille (corps JSON : {"version": n}), ou désépingle la question avec {"version": null}."""
+    if not client:
+        return jsonify({"error": "Base de données non connectée."}), 503
+    data = request.get_json(silent=True) or {}
+    if 'version' not in data or not (data['version'] is None or isinstance(data['version'], int)):
+        return jsonify({"error": "Le champ version (entier ou null) est obligatoire."}), 400
+    try:
+        rubric_registry.pin_version(rubric_collection, question_id, data['version'])
+    except KeyError as e:
+        return jsonify({"error": str(e.args[0])}), 404
+    except PyMongoError as mongo_e:
+        return jsonify({"error": f"Erreur lors de l'épinglage de la grille : {str(mongo_e)}"}), 500
+    return jsonify({"question_id": question_id, "pinned_version": data['version']})
+
 if __name__ == '__main__':
     if not os.getenv("GROQ_API_KEY"):
         print("AVERTISSEMENT : La variable d'environnement GROQ_API_KEY n'est pas définie. Les stubs pourraient fonctionner, mais les agents réels pourraient échouer.")
@@ -0,0 +1,148 @@
+# rubric_registry.py
+# Teacher-supplied rubrics, versioned per question, stored in MongoDB (collection "rubric_registry").
+# One document per question (_id = question id, see workflow.question_key):
+#   {"_id", "question", "latest_version", "pinned_version",
+#    "versions": [{"version", "rubric": [{concept, keywords, weight}], "key_concepts_expected", "author", "created_at"}]}
+# The pinned version of each question is compiled once into workflow question artifacts and pinned in the
+# workflow, which then skips the question understanding and rubric extraction stages for that question.
+import os
+import threading
+import time
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+import Agents.validation as validation
+import workflow
+
+# Pinned rubrics are reloaded from the registry at most this often, so that pins made through another
+# process are picked up.
+RUBRIC_REGISTRY_REFRESH_SECONDS = float(os.environ.get("RUBRIC_REGISTRY_REFRESH_SECONDS", "60"))
+
+REGISTRY_SOURCE = "rubric_registry" # "source" of the artifacts pinned by this module
+
+_last_load = None
+_load_lock = threading.Lock()
+
+class RubricError(ValueError):
+    """Raised when a supplied rubric cannot be used, even after local repairs."""
+
+def normalize_rubric(rubric):
+    """
+    Checks a rubric against the rubric extraction schema and applies the same repairs as for generated
+    rubrics (keywords default to [], weights renormalized to 100).
+    Returns:
+        A tuple (rubric, repairs).
+    Raises:
+        RubricError: if the rubric is empty or invalid.
+    """
+    repaired, errors, repairs = validation.validate_and_repair("rubric_extraction", {"rubric": rubric})
+    if errors:
+        raise RubricError("; ".join(errors))
+    if not repaired["rubric"]:
+        raise RubricError("The rubric has no concept.")
+    return repaired["rubric"], repairs
+
+def compile_version(version_entry):
+    """Workflow question artifacts for a registry version (what run_question_stages would have produced)."""
+    return {
+        "question_analysis": {"key_concepts_expected": version_entry["key_concepts_expected"]},
+        "rubric": version_entry["rubric"],
+        "rubric_version": version_entry["version"],
+        "source": REGISTRY_SOURCE,
+    }
+
+def _version_entry(registry_document, version):
+    for version_entry in registry_document.get("versions", []):
+        if version_entry["version"] == version:
+            return version_entry
+    return None
+
+def import_rubric(collection, text_input, question_input, rubric, key_concepts_expected=None, author=None, pin=True):
+    """
+    Stores a rubric as the next version for its question and, if pin is True, pins it.
+    Returns:
+        A tuple (question_id, version, repairs).
+    """
+    rubric, repairs = normalize_rubric(rubric)
+    if key_concepts_expected is not None and (
+        not isinstance(key_concepts_expected, list) or not all(isinstance(concept, str) for concept in key_concepts_expected)
+    ):
+        raise RubricError("key_concepts_expected must be a list of strings.")
+    question_id = workflow.question_key(text_input, question_input)
+    registry_document = collection.find_one_and_update(
+        {"_id": question_id},
+        {"$inc": {"latest_version": 1}, "$setOnInsert": {"question": question_input, "pinned_version": None, "versions": []}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    version = registry_document["latest_version"]
+    version_entry = {
+        "version": version,
+        "rubric": rubric,
+        "key_concepts_expected": key_concepts_expected or [entry["concept"] for entry in rubric],
+        "author": author,
+        "created_at": datetime.utcnow(),
+    }
+    collection.update_one({"_id": question_id}, {"$push": {"versions": version_entry}})
+    if pin:
+        collection.update_one({"_id": question_id}, {"$set": {"pinned_version": version}})
+        workflow.pin_question_artifacts(question_id, compile_version(version_entry))
+    return question_id, version, repairs
+
+def pin_version(collection, question_id, version):
+    """
+    Pins a stored version of a question's rubric, or unpins the question when version is None.
+    Raises:
+        KeyError: if the question or the version does not exist.
+    """
+    registry_document = collection.find_one({"_id": question_id})
+    if registry_document is None:
+        raise KeyError(f"No rubric registered for question {question_id}.")
+    if version is None:
+        collection.update_one({"_id": question_id}, {"$set": {"pinned_version": None}})
+        workflow.unpin_question_artifacts(question_id)
+        return
+    version_entry = _version_entry(registry_document, version)
+    if version_entry is None:
+        raise KeyError(f"No version {version} for question {question_id}.")
+    collection.update_one({"_id": question_id}, {"$set": {"pinned_version": version}})
+    workflow.pin_question_artifacts(question_id, compile_version(version_entry))
+
+def read_entry(collection, question_id):
+    """Returns the registry view of a question (versions and pinned version), or None."""
+    registry_document = collection.find_one({"_id": question_id})
+    if registry_document is None:
+        return None
+    return {
+        "question_id": registry_document["_id"],
+        "question": registry_document.get("question"),
+        "pinned_version": registry_document.get("pinned_version"),
+        "versions": [
+            dict(version_entry, created_at=version_entry["created_at"].isoformat() if version_entry.get("created_at") else None)
+            for version_entry in registry_document.get("versions", [])
+        ],
+    }
+
+def load_pinned_rubrics(collection):
+    """
+    Compiles the pinned version of every question in the registry and pins them in the workflow
+    (replacing previously pinned entries). Returns the number of pinned questions.
+    """
+    global _last_load
+    pinned = {}
+    for registry_document in collection.find({"pinned_version": {"$ne": None}}, {"versions": 1, "pinned_version": 1}):
+        version_entry = _version_entry(registry_document, registry_document["pinned_version"])
+        if version_entry is not None:
+            pinned[registry_document["_id"]] = compile_version(version_entry)
+    workflow.replace_pinned_question_artifacts(pinned, REGISTRY_SOURCE)
+    _last_load = time.monotonic()
+    return len(pinned)
+
+def refresh_if_stale(collection):
+    """Reloads the pinned rubrics if they were loaded more than RUBRIC_REGISTRY_REFRESH_SECONDS ago."""
+    if _last_load is not None and time.monotonic() - _last_load < RUBRIC_REGISTRY_REFRESH_SECONDS:
+        return
+    with _load_lock:
+        if _last_load is None or time.monotonic() - _last_load >= RUBRIC_REGISTRY_REFRESH_SECONDS:
+            load_pinned_rubrics(collection)
@@ -0,0 +1,107 @@
+# step_trace.py
+# Compact representation of workflow_steps_details, with selectable verbosity (TRACE_VERBOSITY):
+# - "full": every step, but each step input is stored once in trace.shared_inputs and referenced from the
+#   steps as {"$ref": name}; raw_output is only kept for steps whose output could not be parsed.
+# - "summary": name, status, model, parsed output and error of each step (no inputs, raw output or logs).
+# - "none": only the failed steps, in summary form.
+import json
+import os
+
+VERBOSITY_LEVELS = ("none", "summary", "full")
+TRACE_VERBOSITY = os.environ.get("TRACE_VERBOSITY", "full")
+
+try:
+    import orjson # Optional: much faster serialization of large traces
+except ImportError:
+    orjson = None
+
+class StepTrace(list):
+    """
+    The list of steps (usable wherever workflow_steps_details was), plus the inputs shared by its steps.
+    Use resolve_inputs(step) to get a step's inputs back, or to_dict() / dumps() to serialize it.
+    evaluation_details holds the details extracted from the full steps before compaction (see
+    analytics.extract_evaluation_details), so what gets stored does not depend on the verbosity.
+    """
+
+    def __init__(self, steps=(), shared_inputs=None, verbosity="full", evaluation_details=None):
+        super().__init__(steps)
+        self.shared_inputs = shared_inputs if shared_inputs is not None else {}
+        self.verbosity = verbosity
+        self.evaluation_details = evaluation_details
+
+    def resolve_inputs(self, step):
+        inputs = step.get("inputs")
+        if not inputs:
+            return inputs
+        return {
+            name: self.shared_inputs.get(value["$ref"]) if isinstance(value, dict) and set(value) == {"$ref"} else value
+            for name, value in inputs.items()
+        }
+
+    def to_dict(self):
+        return {"verbosity": self.verbosity, "inputs": self.shared_inputs, "steps": list(self)}
+
+def _reference_inputs(inputs, shared_inputs):
+    """Moves each input value into shared_inputs (once per name) and returns the step's inputs as references."""
+    if not inputs:
+        return inputs
+    referenced = {}
+    for name, value in inputs.items():
+        if name not in shared_inputs:
+            shared_inputs[name] = value
+        if shared_inputs[name] is value or shared_inputs[name] == value:
+            referenced[name] = {"$ref": name}
+        else:
+            referenced[name] = value # Same name, different value: kept inline.
+    return referenced
+
+def _summary_step(step):
+    return {
+        "name": step["name"],
+        "status": step["status"],
+        "error_message_detail": step.get("error_message_detail"),
+        "inputs": None,
+        "attempts_logs": [],
+        "attempts": len(step.get("attempts_logs") or []),
+        "raw_output": None,
+        "parsed_output": step.get("parsed_output"),
+        "model": step.get("model"),
+        "model_tier": step.get("model_tier"),
+    }
+
+def compact_trace(workflow_steps_details, verbosity=None):
+    """
+    Returns the steps of a workflow run as a StepTrace at the given verbosity (default TRACE_VERBOSITY).
+    """
+    verbosity = verbosity or TRACE_VERBOSITY
+    if verbosity not in VERBOSITY_LEVELS:
+        raise ValueError(f"Unknown trace verbosity: {verbosity} (expected one of {', '.join(VERBOSITY_LEVELS)})")
+    if verbosity == "none":
+        return StepTrace([_summary_step(step) for step in workflow_steps_details if step["status"] != "Success"], verbosity=verbosity)
+    if verbosity == "summary":
+        return StepTrace([_summary_step(step) for step in workflow_steps_details], verbosity=verbosity)
+
+    trace = StepTrace(verbosity=verbosity)
+    for step in workflow_steps_details:
+        compacted = dict(step, inputs=_reference_inputs(step.get("inputs"), trace.shared_inputs))
+        if step["status"] == "Success" or step.get("parsed_output") is not None:
+            compacted["raw_output"] = None # Duplicates parsed_output once parsing succeeded.
+        trace.append(compacted)
+    return trace
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value):
+    """
+    Serializes a trace (or any response) to a compact UTF-8 JSON string, with orjson when it is installed.
+    A StepTrace passed directly is written as {"verbosity", "inputs", "steps"}; one nested in a response must be
+    converted with to_dict() first (JSON encoders write list subclasses as plain lists, without shared_inputs).
+    """
+    if isinstance(value, StepTrace):
+        value = value.to_dict()
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,93 @@
+# stub_llm_server.py
+# Minimal OpenAI-compatible /v1/chat/completions server for offline runs of the local backend.
+# It answers every request with the smallest JSON object that satisfies the requested schema
+# (response_format json_schema, or the forced tool's parameters).
+#
+#   python stub_llm_server.py --port 8080
+#   LLM_BACKEND=local LLM_LOCAL_BASE_URL=http://127.0.0.1:8080/v1 python workflow.py
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def sample_from_schema(schema):
+    """Builds a minimal value valid for the JSON-schema subset used by the tool schemas."""
+    schema_type = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        return {name: sample_from_schema(properties[name]) for name in schema.get("required", properties.keys())}
+    if schema_type == "array":
+        return [sample_from_schema(schema["items"])] if "items" in schema else []
+    if schema_type in ("number", "integer"):
+        return schema.get("minimum", 0)
+    if schema_type == "boolean":
+        return False
+    if schema_type == "string":
+        return "stub"
+    return None
+
+def _requested_schema(payload):
+    response_format = payload.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return response_format["json_schema"].get("name", "response"), response_format["json_schema"]["schema"], False
+    tools = payload.get("tools") or []
+    tool_choice = payload.get("tool_choice")
+    if tools:
+        function_name = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+        for tool in tools:
+            if function_name in (None, tool["function"]["name"]):
+                return tool["function"]["name"], tool["function"].get("parameters", {}), True
+    return None, None, False
+
+class StubHandler(BaseHTTPRequestHandler):
+    # responder(payload) -> dict may be set on the server to return custom arguments.
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        function_name, schema, as_tool_call = _requested_schema(payload)
+        responder = getattr(self.server, "responder", None)
+        arguments = responder(payload) if responder else (sample_from_schema(schema) if schema else None)
+
+        if arguments is None:
+            message = {"role": "assistant", "content": "stub"}
+        elif as_tool_call:
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": "call_stub", "type": "function",
+                "function": {"name": function_name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+            }]}
+        else:
+            message = {"role": "assistant", "content": json.dumps(arguments, ensure_ascii=False)}
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+        body = json.dumps({
+            "id": "stub", "object": "chat.completion", "model": payload.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": 1, "total_tokens": prompt_chars // 4 + 1},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(host="127.0.0.1", port=0, responder=None):
+    """Starts the stub server in a daemon thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.responder = responder
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible LLM server for offline testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub LLM server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,6 @@
+# tests/conftest.py
+# Offline unit tests: run with `python -m pytest` from the repository root. No LLM backend or MongoDB is needed.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
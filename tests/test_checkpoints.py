@@ -0,0 +1,124 @@
+# tests/test_checkpoints.py
+import collections
+
+import pytest
+
+import Agents.a_ans_understanding as answer_understanding_agent
+import Agents.a_eval as eval_agent
+import Agents.a_final_eval as final_eval_agent
+import Agents.a_grammar_language as grammar_language_agent
+import Agents.a_qst_understanding as question_understanding_agent
+import Agents.a_rubric_extraction as rubric_extraction_agent
+import Agents.llm as llm
+import Agents.validation as validation
+import stub_llm_server
+import workflow
+import workflow_checkpoints
+
+TEXT = "La photosynthèse permet aux plantes de produire du glucose à partir de la lumière, de l'eau et du dioxyde de carbone."
+QUESTION = "Expliquez le rôle de la lumière dans la photosynthèse."
+ANSWER = "La lumière fournit l'énergie qui permet aux plantes de produire du glucose avec l'eau et le dioxyde de carbone."
+RUBRIC = [{"concept": "Rôle de la lumière", "weight": 100, "keywords": ["lumière", "énergie"]}]
+# Agent function name -> agent key.
+AGENT_FUNCTIONS = {"qst_understanding": "qst_understanding", "rubric_extract": "rubric_extraction", "ans_understanding": "ans_understanding",
+                   "grammar": "grammar", "eval": "eval", "final_eval": "final_eval"}
+
+@pytest.fixture
+def checkpoint_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(workflow_checkpoints.checkpoint_store, "directory", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def agents(monkeypatch, checkpoint_dir):
+    """Offline agents: counts the calls per agent; an agent listed in `failing` returns None (a failed stage)."""
+    monkeypatch.setattr(llm, "breakers", collections.defaultdict(llm.CircuitBreaker))
+    calls = collections.Counter()
+    failing = set()
+    # Schema-valid outputs, keyed like the agent functions.
+    outputs = {function_name: stub_llm_server.sample_from_schema(validation.TOOL_SCHEMAS[agent_key][0]["function"]["parameters"])
+               for function_name, agent_key in AGENT_FUNCTIONS.items()}
+    outputs["qst_understanding"]["key_concepts_expected"] = ["lumière", "énergie"]
+    outputs["rubric_extract"]["rubric"] = RUBRIC
+    outputs["eval"] = {"scores": [{"concept": "Rôle de la lumière", "score": 80}], "total_score": 80}
+
+    def fake(name):
+        def agent(*args, **kwargs):
+            calls[name] += 1
+            return None if name in failing else dict(outputs[name])
+        return agent
+
+    for module, name in ((question_understanding_agent, "qst_understanding"), (rubric_extraction_agent, "rubric_extract"),
+                         (answer_understanding_agent, "ans_understanding"), (grammar_language_agent, "grammar"),
+                         (eval_agent, "eval"), (final_eval_agent, "final_eval")):
+        monkeypatch.setattr(module, name, fake(name))
+    return calls, failing
+
+def test_workflow_ids_are_restricted_to_safe_file_names():
+    assert workflow_checkpoints.is_valid_workflow_id(workflow_checkpoints.new_workflow_id())
+    for workflow_id in ("../etc/passwd", "", "a" * 65, None, "id.json"):
+        assert not workflow_checkpoints.is_valid_workflow_id(workflow_id)
+    with pytest.raises(ValueError):
+        workflow_checkpoints.checkpoint_store.load("../escape")
+
+def test_first_missing_stage_follows_the_workflow_order():
+    checkpoint = workflow_checkpoints.new_checkpoint("w1", TEXT, QUESTION, ANSWER)
+    assert workflow_checkpoints.first_missing_stage(checkpoint) == "question_stages"
+    checkpoint["stages"] = {"question_stages": {}, "ans_understanding": {}, "eval": {}}
+    assert workflow_checkpoints.first_missing_stage(checkpoint) == "grammar"
+    checkpoint["stages"] = dict.fromkeys(workflow_checkpoints.STAGES, {})
+    assert workflow_checkpoints.first_missing_stage(checkpoint) is None
+
+def test_saved_evaluation_id_is_only_returned_for_finished_workflows(checkpoint_dir):
+    checkpoint = workflow_checkpoints.new_checkpoint("w1", TEXT, QUESTION, ANSWER)
+    workflow_checkpoints.checkpoint_store.save(checkpoint)
+    workflow_checkpoints.record_saved_evaluation("w1", "doc-1")
+    assert workflow_checkpoints.saved_evaluation_id("w1") is None # Still running.
+    for status in ("completed", "degraded"):
+        checkpoint = workflow_checkpoints.checkpoint_store.load("w1")
+        checkpoint["status"] = status
+        workflow_checkpoints.checkpoint_store.save(checkpoint)
+        assert workflow_checkpoints.saved_evaluation_id("w1") == "doc-1"
+    assert workflow_checkpoints.saved_evaluation_id("unknown") is None
+
+def test_failed_workflow_resumes_from_its_failed_stage(agents):
+    calls, failing = agents
+    failing.add("eval")
+    final_result, _ = workflow.run_evaluation_workflow(TEXT, QUESTION, ANSWER, workflow_id="w1")
+    assert final_result is None
+    checkpoint = workflow_checkpoints.checkpoint_store.load("w1")
+    assert checkpoint["status"] == "failed" and checkpoint["failed_stage"] == "eval"
+
+    failing.clear()
+    calls_before_resume = calls.copy()
+    final_result, steps = workflow.resume_evaluation_workflow("w1")
+    assert final_result is not None
+    resumed_calls = calls - calls_before_resume
+    assert resumed_calls["eval"] == 1 and set(resumed_calls) <= {"eval", "final_eval"}
+    assert any(step["name"] == "4. Grammar and Language" for step in steps)
+    assert workflow_checkpoints.checkpoint_store.load("w1")["status"] == "completed"
+
+    # A completed workflow is replayed without any agent call.
+    calls_before_replay = calls.copy()
+    replayed_result, _ = workflow.resume_evaluation_workflow("w1")
+    assert replayed_result == final_result and calls == calls_before_replay
+
+def test_changed_inputs_start_a_new_checkpoint(agents):
+    calls, failing = agents
+    failing.add("grammar")
+    workflow.run_evaluation_workflow(TEXT, QUESTION, ANSWER, workflow_id="w1")
+    failing.clear()
+    answer_calls = calls["ans_understanding"]
+    workflow.run_evaluation_workflow(TEXT, QUESTION, ANSWER + " Elle est captée par la chlorophylle.", workflow_id="w1")
+    assert calls["ans_understanding"] == answer_calls + 1 # The other answer's analysis is not reused.
+
+def test_degraded_result_is_replayed(agents, monkeypatch):
+    calls, _ = agents
+    monkeypatch.setattr(llm, "is_unavailable", lambda agents=None: True)
+    degraded_result, _ = workflow.run_evaluation_workflow(TEXT, QUESTION, ANSWER, workflow_id="w1")
+    assert degraded_result is not None and workflow_checkpoints.checkpoint_store.load("w1")["status"] == "degraded"
+
+    monkeypatch.setattr(llm, "is_unavailable", lambda agents=None: False)
+    replayed_result, steps = workflow.resume_evaluation_workflow("w1")
+    assert replayed_result == degraded_result
+    assert [step["name"] for step in steps] == ["Degraded Grading"]
+    assert sum(calls.values()) == 0
@@ -0,0 +1,104 @@
+# tests/test_dispatcher.py
+import threading
+import time
+
+import Agents.dispatcher as dispatcher
+import Agents.shared_state as shared_state
+import Agents.tenants as tenants
+
+def _queued(priority_dispatcher):
+    return sum(len(queue) for queue in priority_dispatcher._queues.values())
+
+def grant_order(priority_dispatcher, waiters):
+    """
+    Holds the dispatcher's only slot while the (name, priority_class, tenant_id, cost) waiters queue up in
+    order, then releases it. Returns the names in the order their calls were started.
+    """
+    order = []
+
+    def call(name, priority_class, tenant_id, cost):
+        priority_dispatcher.acquire(priority_class, tenant_id, cost)
+        order.append(name)
+        priority_dispatcher.release(priority_class, tenant_id)
+
+    priority_dispatcher.acquire("normal")
+    threads = []
+    for waiter in waiters:
+        queued = _queued(priority_dispatcher)
+        thread = threading.Thread(target=call, args=waiter)
+        thread.start()
+        threads.append(thread)
+        while _queued(priority_dispatcher) == queued:
+            time.sleep(0.001)
+    priority_dispatcher.release("normal")
+    for thread in threads:
+        thread.join(timeout=5)
+    return order
+
+def test_interactive_calls_start_before_queued_bulk_calls():
+    priority_dispatcher = dispatcher.PriorityDispatcher(concurrency=1, interactive_reserved=0)
+    waiters = [(f"bulk{index}", "bulk", "default", 1) for index in range(3)] + [("interactive", "interactive", "default", 1)]
+    assert grant_order(priority_dispatcher, waiters) == ["interactive", "bulk0", "bulk1", "bulk2"]
+
+def test_weighted_fair_queuing_still_serves_bulk_calls():
+    priority_dispatcher = dispatcher.PriorityDispatcher(concurrency=1, interactive_reserved=0,
+                                                        weights={"interactive": 2, "normal": 1, "bulk": 1})
+    waiters = [("bulk", "bulk", "default", 1)] + [(f"interactive{index}", "interactive", "default", 1) for index in range(4)]
+    order = grant_order(priority_dispatcher, waiters)
+    # Finish tags: bulk 1.0, interactive 0.5, 1.0, 1.5, 2.0 -> the bulk call is not starved by the later ones.
+    assert order.index("bulk") < order.index("interactive3")
+
+def test_reserved_slots_are_only_used_by_interactive_calls():
+    priority_dispatcher = dispatcher.PriorityDispatcher(concurrency=2, interactive_reserved=1)
+    priority_dispatcher.acquire("bulk")
+    started = threading.Event()
+
+    def bulk_call():
+        priority_dispatcher.acquire("bulk")
+        started.set()
+        priority_dispatcher.release("bulk")
+
+    thread = threading.Thread(target=bulk_call)
+    thread.start()
+    assert not started.wait(0.1) # The second slot is reserved.
+    priority_dispatcher.acquire("interactive") # ... but an interactive call gets it at once.
+    priority_dispatcher.release("interactive")
+    priority_dispatcher.release("bulk")
+    assert started.wait(5)
+    thread.join(timeout=5)
+
+def test_rate_limit_waiters_are_served_by_priority(monkeypatch):
+    monkeypatch.setattr(shared_state, "RATE_WINDOW_SECONDS", 1.0)
+    bucket = f"test-priority-{time.time()}"
+    requests_per_minute = 120 # 2 requests per 1 second window
+    # Start just after a window boundary, so that the window filled below stays full while the waiters queue up.
+    time.sleep(1.0 - time.time() % 1.0 + 0.05)
+    for _ in range(2):
+        shared_state.acquire_rate_limit(bucket, 1, requests_per_minute=requests_per_minute)
+    order = []
+
+    def call(name, priority_rank):
+        shared_state.acquire_rate_limit(bucket, 1, requests_per_minute=requests_per_minute, priority_rank=priority_rank)
+        order.append(name)
+
+    threads = [threading.Thread(target=call, args=(f"bulk{index}", 2)) for index in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    threads.append(threading.Thread(target=call, args=("interactive", 0)))
+    threads[-1].start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert order[0] == "interactive"
+    assert sorted(order) == ["bulk0", "bulk1", "bulk2", "interactive"]
+
+def test_tenants_share_a_class_by_deficit_round_robin():
+    priority_dispatcher = dispatcher.PriorityDispatcher(concurrency=1, interactive_reserved=0, quantum_tokens=1000)
+    waiters = [(f"a{index}", "normal", "tenant-a", 1000) for index in range(3)] + [("b0", "normal", "tenant-b", 1000)]
+    assert grant_order(priority_dispatcher, waiters) == ["a0", "b0", "a1", "a2"]
+
+def test_tenant_weights_scale_their_share(monkeypatch):
+    monkeypatch.setattr(tenants, "TENANT_QUOTAS", {"tenant-b": {"weight": 2}})
+    priority_dispatcher = dispatcher.PriorityDispatcher(concurrency=1, interactive_reserved=0, quantum_tokens=1000)
+    waiters = [(f"{tenant_id[-1]}{index}", "normal", tenant_id, 1000) for tenant_id in ("tenant-a", "tenant-b") for index in range(3)]
+    assert grant_order(priority_dispatcher, waiters) == ["a0", "b0", "b1", "a1", "b2", "a2"]
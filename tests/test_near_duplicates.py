@@ -0,0 +1,46 @@
+# tests/test_near_duplicates.py
+import Agents.near_duplicates as near_duplicates
+
+SENTENCE = ("La lumière du soleil fournit aux plantes l'énergie dont elles ont besoin pour transformer l'eau et le dioxyde "
+            "de carbone en glucose et en oxygène au cours de la photosynthèse")
+
+def representatives(answers, **kwargs):
+    return [assignment["representative"] for assignment in near_duplicates.cluster_answers(answers, **kwargs)]
+
+def test_punctuation_case_and_accent_variants_are_clustered():
+    answers = [SENTENCE, SENTENCE.upper() + " !", SENTENCE.replace("é", "e").replace(" ", "  "), "Une tout autre réponse."]
+    assignments = near_duplicates.cluster_answers(answers)
+    assert [assignment["representative"] for assignment in assignments] == [0, 0, 0, 3]
+    assert assignments[1]["similarity"] == 1.0
+    assert assignments[0]["cluster_id"] == assignments[2]["cluster_id"] != assignments[3]["cluster_id"]
+
+def test_small_wording_differences_are_clustered():
+    assert representatives([SENTENCE, SENTENCE.replace("fournit", "fournit bien")]) == [0, 0]
+
+def test_negations_and_numbers_are_never_merged():
+    assert representatives([SENTENCE, SENTENCE.replace("fournit", "ne fournit jamais")]) == [0, 1]
+    assert representatives([SENTENCE + " depuis 1779", SENTENCE + " depuis 1780"]) == [0, 1]
+
+def test_different_rubric_keyword_matches_are_never_merged():
+    rubric = [{"concept": "Produits", "weight": 100, "keywords": ["oxygène"]}]
+    without_keyword = SENTENCE.replace(" et en oxygène", "")
+    assert representatives([SENTENCE, without_keyword]) == [0, 0]
+    assert representatives([SENTENCE, without_keyword], rubric=rubric) == [0, 1]
+
+def test_members_always_join_a_representative():
+    # Each step drifts a little further from the first answer: later answers must not chain through members.
+    words = SENTENCE.split()
+    answers = [" ".join(words[:len(words) - cut]) for cut in range(0, 24, 4)]
+    assignments = near_duplicates.cluster_answers(answers)
+    assert [assignment["representative"] for assignment in assignments] == [0, 0, 0, 3, 3, 5]
+    for assignment in assignments:
+        assert assignments[assignment["representative"]]["representative"] == assignment["representative"]
+        assert assignment["similarity"] >= near_duplicates.DEDUP_SIMILARITY_THRESHOLD
+
+def test_cluster_ids_are_stable_across_batches():
+    first_batch = near_duplicates.cluster_answers(["Autre chose.", SENTENCE, SENTENCE + "."])
+    second_batch = near_duplicates.cluster_answers([SENTENCE.lower()])
+    assert first_batch[2]["cluster_id"] == second_batch[0]["cluster_id"] == near_duplicates.cluster_id_for(SENTENCE)
+
+def test_empty_answers_are_their_own_representatives():
+    assert representatives(["", "  ", SENTENCE]) == [0, 1, 2]
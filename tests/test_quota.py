@@ -0,0 +1,80 @@
+# tests/test_quota.py
+import collections
+
+import pytest
+
+import Agents.backends as backends
+import Agents.llm as llm
+import Agents.shared_state as shared_state
+import Agents.tenants as tenants
+
+@pytest.fixture
+def store(monkeypatch):
+    """A fresh in-memory store, with 1000 tokens per 10 second window for the LLM and for tenant "acme"."""
+    memory_store = shared_state.MemoryStore()
+    monkeypatch.setattr(shared_state, "_store", memory_store)
+    monkeypatch.setattr(shared_state, "RATE_WINDOW_SECONDS", 10.0)
+    monkeypatch.setattr(shared_state, "RATE_LIMIT_TPM", 6000)
+    monkeypatch.setattr(tenants, "TENANT_QUOTAS", {"acme": {"tokens_per_minute": 6000}})
+    return memory_store
+
+def used_tokens(memory_store, bucket):
+    return sum(tokens for (window_bucket, _), (_, tokens) in memory_store._windows.items() if window_bucket == bucket)
+
+class FakeBackend:
+    def __init__(self, usage=None, error=None):
+        self.usage, self.error = usage, error
+
+    def chat(self, messages, model, tools=None, tool_choice=None):
+        if self.error is not None:
+            raise self.error
+        return backends.LLMResponse(None, "ok", self.usage)
+
+@pytest.fixture
+def fake_backend(monkeypatch, store):
+    monkeypatch.setattr(llm, "breakers", collections.defaultdict(llm.CircuitBreaker))
+    monkeypatch.setattr(llm, "HEDGE_ENABLED", False)
+    monkeypatch.setattr(llm, "SHARED_CACHE_ENABLED", False)
+    backend = FakeBackend()
+    monkeypatch.setitem(backends._backends, llm.backend_name_for(None), backend)
+    return backend
+
+def test_settle_corrects_the_estimate_with_the_actual_usage(store):
+    reservation = shared_state.acquire_rate_limit("bucket", 300)
+    assert reservation[1] == 300
+    shared_state.settle_rate_limit("bucket", reservation, 120)
+    assert used_tokens(store, "bucket") == 120
+    shared_state.settle_rate_limit("bucket", shared_state.acquire_rate_limit("bucket", 50), None) # No usage reported.
+    assert used_tokens(store, "bucket") == 170
+
+def test_oversized_requests_are_charged_the_window_limit(store):
+    reservation = shared_state.acquire_rate_limit("bucket", 5000)
+    assert reservation[1] == 1000
+    shared_state.settle_rate_limit("bucket", reservation, 1500)
+    assert used_tokens(store, "bucket") == 1500
+
+def test_full_window_without_waiting_raises(store):
+    shared_state.acquire_rate_limit("bucket", 900)
+    with pytest.raises(shared_state.RateLimitWaitTimeout):
+        shared_state.acquire_rate_limit("bucket", 200, wait=False)
+    assert used_tokens(store, "bucket") == 900
+
+def test_tenant_quota_is_charged_and_settled(store):
+    assert tenants.acquire_token_quota("no-quota", 500) is None
+    reservation = tenants.acquire_token_quota("acme", 500)
+    tenants.settle_token_quota("acme", reservation, 200)
+    assert used_tokens(store, "tenant:acme") == 200
+
+def test_completion_settles_with_the_reported_usage(fake_backend, store):
+    fake_backend.usage = {"prompt_tokens": 30, "completion_tokens": 12, "total_tokens": 42}
+    with tenants.tenant("acme"):
+        assert llm.completion("prompt", "instructions", model="model") == "ok"
+    assert used_tokens(store, "tenant:acme") == 42
+    assert used_tokens(store, f"{llm.backend_name_for(None)}:model") == 42
+
+def test_failed_completion_refunds_its_reservations(fake_backend, store):
+    fake_backend.error = RuntimeError("backend down")
+    with tenants.tenant("acme"), pytest.raises(RuntimeError):
+        llm.completion("prompt", "instructions", model="model")
+    assert used_tokens(store, "tenant:acme") == 0
+    assert used_tokens(store, f"{llm.backend_name_for(None)}:model") == 0
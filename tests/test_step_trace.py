@@ -0,0 +1,64 @@
+# tests/test_step_trace.py
+import json
+
+import pytest
+
+import analytics
+import step_trace
+import workflow
+
+TEXT = "Un long texte de référence partagé par toutes les étapes."
+RUBRIC = [{"concept": "Idée principale", "weight": 100, "keywords": []}]
+
+def step(name, status="Success", inputs=None, parsed_output=None, raw_output=None):
+    return {"name": name, "status": status, "error_message_detail": None if status == "Success" else "Échec",
+            "inputs": inputs, "attempts_logs": ["Attempt 1/3...", "Attempt 1/3: Success"], "raw_output": raw_output,
+            "parsed_output": parsed_output, "model": "model", "model_tier": 0}
+
+STEPS = [
+    step("2. Rubric Extraction", inputs={"text_input": TEXT}, parsed_output={"rubric": RUBRIC}, raw_output='{"rubric": []}'),
+    step("4. Grammar and Language", inputs={"student_answer_input": "Réponse"}, parsed_output={"penalty": 5, "errors": []}),
+    step("5. Evaluation", status="Failure", inputs={"text_input": TEXT, "student_answer_input": "Autre"}, raw_output="not json"),
+]
+
+def test_full_trace_stores_each_input_once():
+    trace = step_trace.compact_trace(STEPS, "full")
+    assert [compacted["name"] for compacted in trace] == [original["name"] for original in STEPS]
+    assert trace.shared_inputs == {"text_input": TEXT, "student_answer_input": "Réponse"}
+    assert trace[0]["inputs"] == {"text_input": {"$ref": "text_input"}}
+    assert trace[2]["inputs"]["student_answer_input"] == "Autre" # Same name, different value: kept inline.
+    assert trace.resolve_inputs(trace[2]) == STEPS[2]["inputs"]
+    assert trace[0]["raw_output"] is None and trace[2]["raw_output"] == "not json"
+    assert STEPS[0]["raw_output"] is not None # The steps themselves are not modified.
+
+def test_summary_trace_drops_inputs_and_logs():
+    trace = step_trace.compact_trace(STEPS, "summary")
+    assert len(trace) == 3
+    assert all(compacted["inputs"] is None and compacted["attempts_logs"] == [] for compacted in trace)
+    assert trace[0]["attempts"] == 2 and trace[0]["parsed_output"] == {"rubric": RUBRIC}
+
+def test_none_trace_keeps_only_failed_steps():
+    trace = step_trace.compact_trace(STEPS, "none")
+    assert [compacted["name"] for compacted in trace] == ["5. Evaluation"]
+    assert trace.to_dict() == {"verbosity": "none", "inputs": {}, "steps": list(trace)}
+
+def test_default_and_unknown_verbosity(monkeypatch):
+    monkeypatch.setattr(step_trace, "TRACE_VERBOSITY", "summary")
+    assert step_trace.compact_trace(STEPS).verbosity == "summary"
+    with pytest.raises(ValueError):
+        step_trace.compact_trace(STEPS, "verbose")
+
+def test_dumps_keeps_the_shared_inputs():
+    trace = step_trace.compact_trace(STEPS, "full")
+    assert json.loads(step_trace.dumps(trace)) == json.loads(json.dumps(trace.to_dict()))
+    response = json.loads(step_trace.dumps({"trace": trace.to_dict()}))
+    assert response["trace"]["inputs"]["text_input"] == TEXT
+    assert response["trace"]["steps"][0]["inputs"] == {"text_input": {"$ref": "text_input"}}
+
+@pytest.mark.parametrize("verbosity", step_trace.VERBOSITY_LEVELS)
+def test_evaluation_details_do_not_depend_on_the_verbosity(verbosity):
+    final_result = {"final_score": 50, "breakdown_scores": [{"concept": "Idée principale", "score": 50}]}
+    trace = workflow.compact_steps(final_result, STEPS, verbosity)
+    details = analytics.extract_evaluation_details(final_result, trace)
+    assert details == analytics.extract_evaluation_details(final_result, STEPS)
+    assert details["rubric"] == RUBRIC and details["grammar_penalty"] == 5
@@ -0,0 +1,51 @@
+# tests/test_validation.py
+import Agents.validation as validation
+
+RUBRIC = [{"concept": "Explique la leçon", "weight": 60}, {"concept": "Écrit au tableau", "weight": 40}]
+
+def test_eval_scores_are_aligned_on_the_rubric_and_clamped():
+    output = {"scores": [{"concept": "  explique la LEÇON ", "score": "75"}, {"concept": "Hors grille", "score": 10}],
+              "total_score": 3}
+    repaired, errors, repairs = validation.validate_and_repair("eval", output, {"rubric": RUBRIC})
+    assert errors == []
+    assert repaired["scores"] == [{"concept": "Explique la leçon", "score": 60}, {"concept": "Écrit au tableau", "score": 0}]
+    assert repaired["total_score"] == 60
+    assert any("not in rubric" in repair for repair in repairs)
+    assert output["total_score"] == 3 # The input is not modified.
+
+def test_rubric_weights_are_renormalized_to_100():
+    output = {"rubric": [{"concept": "A", "weight": 1, "keywords": []}, {"concept": "B", "weight": 2}, {"concept": " ", "weight": 5}]}
+    repaired, errors, repairs = validation.validate_and_repair("rubric_extraction", output)
+    assert errors == []
+    assert [entry["concept"] for entry in repaired["rubric"]] == ["A", "B"]
+    assert sum(entry["weight"] for entry in repaired["rubric"]) == 100
+    assert repaired["rubric"][1]["keywords"] == []
+
+def test_grammar_penalty_is_dropped_without_valid_errors():
+    output = {"errors": [{"type": "Spelling", "text": "", "suggestion": "x"}], "penalty": 40}
+    repaired, errors, _ = validation.validate_and_repair("grammar", output)
+    assert errors == []
+    assert repaired["errors"] == [] and repaired["penalty"] == 0
+
+def test_final_score_is_pinned_to_the_precalculated_value():
+    repaired, errors, _ = validation.validate_and_repair("final_eval", {"final_score": 91, "feedback": " Bien. "}, {"final_score": 72.5})
+    assert errors == []
+    assert repaired == {"final_score": 72.5, "feedback": "Bien."}
+
+def test_unrepairable_outputs_report_errors():
+    _, errors, _ = validation.validate_and_repair("eval", {"scores": "none"})
+    assert errors
+    _, errors, _ = validation.validate_and_repair("eval", ["not", "an", "object"])
+    assert errors == ["$: expected object, got list"]
+
+def test_packed_eval_requires_one_evaluation_per_answer():
+    entry = {"scores": [{"concept": "Explique la leçon", "score": 30}], "total_score": 30}
+    repaired, errors, _ = validation.validate_and_repair_packed_eval(
+        {"evaluations": [dict(entry, answer_id=1), dict(entry, answer_id=0)]}, 2, {"rubric": RUBRIC}
+    )
+    assert errors == []
+    assert len(repaired["evaluations"]) == 2 and "answer_id" not in repaired["evaluations"][0]
+
+    _, errors, _ = validation.validate_and_repair_packed_eval({"evaluations": [dict(entry, answer_id=0), dict(entry, answer_id=0)]}, 2)
+    assert "$.evaluations: duplicate answer_id 0" in errors
+    assert "$.evaluations: missing answer_id 1" in errors
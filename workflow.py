@@ -1,8 +1,13 @@
 # workflow.py
+import collections
+import functools
+import hashlib
 import json
 import os
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Agent imports (ensure these paths are correct relative to where workflow.py is run)
 import Agents.a_ans_understanding as answer_understanding_agent
@@ -11,10 +16,156 @@ import Agents.a_rubric_extraction as rubric_extraction_agent
 import Agents.a_grammar_language as grammar_language_agent
 import Agents.a_eval as eval_agent
 import Agents.a_final_eval as final_eval_agent
+import Agents.llm as llm
+import Agents.validation as validation
+import Agents.local_grading as local_grading
+import Agents.similarity as similarity
+import Agents.shared_state as shared_state
+import Agents.dispatcher as dispatcher
+import Agents.tenants as tenants
+import Agents.prescreen as prescreen
+import Agents.local_feedback as local_feedback
+import Agents.prompts as prompts
+import Agents.near_duplicates as near_duplicates
+import Agents.tracing as tracing
+import analytics
+import step_trace
+import workflow_checkpoints
 
-def call_agent_with_retry(agent_function, agent_args: tuple, agent_name: str, max_retries: int = 2, retry_delay_seconds: int = 1):
+# --- Model cascade configuration ---
+# When enabled (LLM_CASCADE=1), each stage runs on the fastest model tier first and is re-run on the
+# next tier only if its output fails schema validation or falls into an uncertain band.
+CASCADE_ENABLED = os.environ.get("LLM_CASCADE", "0") == "1"
+# overall_semantic_alignment values in this band are considered ambiguous.
+ALIGNMENT_UNCERTAIN_BAND = (35, 65)
+# total_score values within GRADE_BOUNDARY_MARGIN points of a boundary are considered ambiguous.
+GRADE_BOUNDARIES = (25, 50, 75)
+GRADE_BOUNDARY_MARGIN = 3
+
+# --- Local semantic alignment (Agents/similarity.py) ---
+# "off": not computed; "prompt": added to the answer analysis as local_semantic_alignment and passed to the
+# evaluation prompt; "replace": also overrides the LLM's overall_semantic_alignment.
+SEMANTIC_ALIGNMENT_MODE = os.environ.get("SEMANTIC_ALIGNMENT_MODE", "off")
+
+# --- Packed evaluation (run_batch_evaluation_workflow) ---
+# Answers to the same question are graded K at a time by a_eval.eval_packed, K being the largest number of
+# answers whose estimated prompt + output tokens fit in EVAL_PACK_TOKEN_BUDGET (and at most EVAL_PACK_MAX_ANSWERS).
+EVAL_PACK_TOKEN_BUDGET = int(os.environ.get("EVAL_PACK_TOKEN_BUDGET", "6000"))
+EVAL_PACK_MAX_ANSWERS = int(os.environ.get("EVAL_PACK_MAX_ANSWERS", "10"))
+EVAL_PACK_OUTPUT_TOKENS_PER_CONCEPT = 15
+# Answers whose per-answer stages (3, 4 and 6) run in parallel in a batch.
+BATCH_WORKERS = int(os.environ.get("EVAL_BATCH_WORKERS", "4"))
+
+# --- Question-level cache ---
+# Question analysis and rubric of recently graded questions, keyed by question_key(). Used as the rubric source
+# for degraded grading when the LLM backend is unavailable.
+QUESTION_CACHE_MAX_ENTRIES = 256
+# When enabled (SHARED_QUESTION_CACHE=1), artifacts are also stored in the shared state store
+# (Agents/shared_state.py), and cached artifacts (this node's or another node's) are reused instead of running
+# stages 1-2 again (see reusable_question_artifacts). Pinning or unpinning a question drops its cached artifacts.
+SHARED_QUESTION_CACHE_ENABLED = os.environ.get("SHARED_QUESTION_CACHE", "0") == "1"
+SHARED_QUESTION_CACHE_TTL_SECONDS = float(os.environ.get("SHARED_QUESTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+_question_cache = collections.OrderedDict()
+_question_cache_lock = threading.Lock()
+
+def question_key(text_input, question_input):
+    """Stable identifier of a (text, question) pair, insensitive to surrounding/repeated whitespace."""
+    normalized = " ".join((text_input or "").split()) + "\n" + " ".join((question_input or "").split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def _cache_locally(key, artifacts):
+    with _question_cache_lock:
+        _question_cache[key] = artifacts
+        _question_cache.move_to_end(key)
+        while len(_question_cache) > QUESTION_CACHE_MAX_ENTRIES:
+            _question_cache.popitem(last=False)
+
+def cache_question_artifacts(text_input, question_input, question_analysis, rubric):
+    key = question_key(text_input, question_input)
+    artifacts = {"question_analysis": question_analysis, "rubric": rubric}
+    _cache_locally(key, artifacts)
+    if SHARED_QUESTION_CACHE_ENABLED:
+        shared_state.cache_set("question", key, artifacts, SHARED_QUESTION_CACHE_TTL_SECONDS)
+
+def get_cached_question_artifacts(text_input, question_input):
+    key = question_key(text_input, question_input)
+    with _question_cache_lock:
+        artifacts = _question_cache.get(key)
+        if artifacts is not None:
+            _question_cache.move_to_end(key)
+            return artifacts
+    if SHARED_QUESTION_CACHE_ENABLED:
+        artifacts = shared_state.cache_get("question", key)
+        if artifacts is not None:
+            _cache_locally(key, artifacts)
+    return artifacts
+
+def reusable_question_artifacts(text_input, question_input):
+    """Cached artifacts that may replace stages 1-2 (only with SHARED_QUESTION_CACHE=1), or None."""
+    return get_cached_question_artifacts(text_input, question_input) if SHARED_QUESTION_CACHE_ENABLED else None
+
+def invalidate_question_artifacts(question_id):
+    """Drops the cached artifacts of a question (e.g. when its pinned rubric changes)."""
+    with _question_cache_lock:
+        _question_cache.pop(question_id, None)
+    if SHARED_QUESTION_CACHE_ENABLED:
+        shared_state.cache_delete("question", question_id)
+
+# --- Pinned question artifacts ---
+# Question analysis and rubric pinned for a question id (e.g. a teacher rubric from rubric_registry.py).
+# When a question has pinned artifacts, stages 1-2 are not run and the pinned rubric is always used.
+_pinned_question_artifacts = {}
+_pinned_question_artifacts_lock = threading.Lock()
+
+def pin_question_artifacts(question_id, question_artifacts):
+    with _pinned_question_artifacts_lock:
+        _pinned_question_artifacts[question_id] = question_artifacts
+    invalidate_question_artifacts(question_id)
+
+def unpin_question_artifacts(question_id):
+    with _pinned_question_artifacts_lock:
+        _pinned_question_artifacts.pop(question_id, None)
+    invalidate_question_artifacts(question_id)
+
+def replace_pinned_question_artifacts(pinned_by_question_id, source):
+    """
+    Replaces at once every pinned entry whose artifacts have the given "source" (used when reloading a
+    registry); entries pinned by other sources are kept.
+    """
+    global _pinned_question_artifacts
+    with _pinned_question_artifacts_lock:
+        kept = {question_id: artifacts for question_id, artifacts in _pinned_question_artifacts.items() if artifacts.get("source") != source}
+        previous, _pinned_question_artifacts = _pinned_question_artifacts, dict(kept, **pinned_by_question_id)
+    for question_id in set(previous) | set(_pinned_question_artifacts):
+        if previous.get(question_id) != _pinned_question_artifacts.get(question_id):
+            invalidate_question_artifacts(question_id)
+
+def get_pinned_question_artifacts(text_input, question_input):
+    return _pinned_question_artifacts.get(question_key(text_input, question_input))
+
+# --- Question preparation (prepare_question) ---
+# The game calls prepare_question when a question is displayed: stages 1-2 run in the background and their
+# artifacts are pinned with source "prepared", so that the first answer is graded as fast as the others.
+# A teacher rubric pinned for the question always takes precedence over prepared artifacts.
+PREPARED_SOURCE = "prepared"
+PREPARE_WORKERS = int(os.environ.get("PREPARE_QUESTION_WORKERS", "2"))
+PREPARED_QUESTIONS_MAX_ENTRIES = int(os.environ.get("PREPARED_QUESTIONS_MAX_ENTRIES", "1000"))
+# An answer arriving while its question is still being prepared waits for the preparation (at most this
+# long) instead of running stages 1-2 a second time.
+PREPARE_WAIT_SECONDS = float(os.environ.get("PREPARE_QUESTION_WAIT_SECONDS", "60"))
+_prepare_executor = ThreadPoolExecutor(max_workers=PREPARE_WORKERS, thread_name_prefix="prepare-question")
+_preparations = {} # question id -> Future of the running preparation
+_prepared_question_ids = collections.OrderedDict() # Prepared pins, oldest first (bounded)
+_preparations_lock = threading.Lock()
+
+class SchemaValidationError(ValueError):
+    """Raised when an agent output still violates its tool schema after local repairs."""
+
+def call_agent_with_retry(agent_function, agent_args: tuple, agent_name: str, max_retries: int = 2, retry_delay_seconds: int = 1, validator=None):
     """
     Calls an agent function, attempts to parse its string output as JSON, and logs attempts.
+    If a validator is given (see Agents/validation.py), the parsed output is repaired and validated;
+    only output that cannot be repaired triggers a retry.
     Returns:
         A tuple (parsed_output, raw_output_str, attempt_logs, success_flag).
         - parsed_output: dict/list if successful, else None.
@@ -22,15 +173,33 @@ def call_agent_with_retry(agent_function, agent_args: tuple, agent_name: str, ma
         - attempt_logs: A list of strings logging each attempt and its outcome.
         - success_flag: Boolean indicating if a valid JSON was parsed.
     """
+    with tracing.span("agent", stage=agent_name, max_retries=max_retries) as agent_span:
+        parsed_output, raw_output, attempt_logs, success_flag = _call_agent_with_retry(
+            agent_function, agent_args, agent_name, max_retries, retry_delay_seconds, validator
+        )
+        agent_span.set_attribute("success", success_flag)
+        if not success_flag:
+            agent_span.set_error(attempt_logs[-1][:500] if attempt_logs else "no output")
+    return parsed_output, raw_output, attempt_logs, success_flag
+
+def _call_agent_with_retry(agent_function, agent_args, agent_name, max_retries, retry_delay_seconds, validator):
     last_raw_output_for_error_reporting = None
     attempt_logs = []
     success_flag = False
 
+    # Stage boundary: bulk work yields to pending interactive calls before starting the next agent call.
+    pause_start_ns = time.time_ns()
+    paused_seconds = dispatcher.stage_boundary()
+    if paused_seconds:
+        tracing.record_span("dispatch.bulk_pause", pause_start_ns)
+        attempt_logs.append(f"Bulk priority: paused {paused_seconds:.1f}s for interactive requests before {agent_name}.")
+
     for attempt in range(max_retries + 1):
         log_message_prefix = f"Attempt {attempt + 1}/{max_retries + 1} for {agent_name}"
         attempt_logs.append(f"{log_message_prefix}...")
         try:
-            raw_output = agent_function(*agent_args) # Renamed to raw_output as it might not be a string
+            with tracing.span("attempt", stage=agent_name, attempt=attempt + 1):
+                raw_output = agent_function(*agent_args) # Renamed to raw_output as it might not be a string
             last_raw_output_for_error_reporting = raw_output
 
             parsed_output = None
@@ -44,15 +213,13 @@ def call_agent_with_retry(agent_function, agent_args: tuple, agent_name: str, ma
             elif isinstance(raw_output, dict) or isinstance(raw_output, list):
                 # If the agent already returned a parsed JSON object (dict or list)
                 parsed_output = raw_output
-                success_flag = True
-                attempt_logs.append(f"{log_message_prefix}: Success - Agent returned pre-parsed JSON.")
-                return parsed_output, json.dumps(raw_output, ensure_ascii=False), attempt_logs, True # Return string representation for raw_output_str
+                raw_output_str = json.dumps(raw_output, ensure_ascii=False) # Return string representation for raw_output_str
+                success_message = f"{log_message_prefix}: Success - Agent returned pre-parsed JSON."
             elif isinstance(raw_output, str):
                 # If the agent returned a string, try to parse it as JSON
                 parsed_output = json.loads(raw_output)
-                success_flag = True
-                attempt_logs.append(f"{log_message_prefix}: Success - Parsed JSON from string output.")
-                return parsed_output, raw_output, attempt_logs, True
+                raw_output_str = raw_output
+                success_message = f"{log_message_prefix}: Success - Parsed JSON from string output."
             else:
                 # Unexpected return type from agent function
                 msg = f"{log_message_prefix}: Agent function returned unexpected type {type(raw_output)}. Expected str, dict, or list."
@@ -61,9 +228,34 @@ def call_agent_with_retry(agent_function, agent_args: tuple, agent_name: str, ma
                     attempt_logs.append(f"ERROR: {agent_name} failed due to unexpected return type after {max_retries + 1} attempts.")
                     return None, str(raw_output), attempt_logs, False # Convert to string for error reporting
                 attempt_logs.append(f"Retrying in {retry_delay_seconds}s...")
-                time.sleep(retry_delay_seconds)
+                tracing.sleep(retry_delay_seconds, "retry")
                 continue # Continue to next attempt
 
+            if validator:
+                # Repair what can be repaired locally; only unrepairable output costs a retry.
+                parsed_output, validation_errors, repairs = validator(parsed_output)
+                for repair in repairs:
+                    attempt_logs.append(f"{log_message_prefix}: Repaired - {repair}")
+                if validation_errors:
+                    raise SchemaValidationError("; ".join(validation_errors))
+            success_flag = True
+            attempt_logs.append(success_message)
+            return parsed_output, raw_output_str, attempt_logs, True
+
+        except SchemaValidationError as e:
+            attempt_logs.append(f"{log_message_prefix}: Schema validation failed - {e}")
+            if attempt == max_retries:
+                attempt_logs.append(f"ERROR: {agent_name} failed to produce schema-valid output after {max_retries + 1} attempts.")
+                return None, raw_output_str, attempt_logs, False
+            attempt_logs.append(f"Retrying in {retry_delay_seconds}s...")
+            tracing.sleep(retry_delay_seconds, "retry")
+
+        except llm.CircuitOpenError as e:
+            # Fail fast: retrying while the breaker is open would only burn time.
+            attempt_logs.append(f"{log_message_prefix}: {e}")
+            attempt_logs.append(f"ERROR: {agent_name} aborted because the LLM backend is unavailable.")
+            return None, last_raw_output_for_error_reporting, attempt_logs, False
+
         except json.JSONDecodeError as e:
             msg = f"{log_message_prefix}: JSONDecodeError - {e}"
             attempt_logs.append(msg)
@@ -74,7 +266,7 @@ def call_agent_with_retry(agent_function, agent_args: tuple, agent_name: str, ma
                 attempt_logs.append(f"ERROR: {agent_name} failed to produce valid JSON after {max_retries + 1} attempts.")
                 return None, last_raw_output_for_error_reporting, attempt_logs, False
             attempt_logs.append(f"Retrying in {retry_delay_seconds}s...")
-            time.sleep(retry_delay_seconds)
+            tracing.sleep(retry_delay_seconds, "retry")
 
         except Exception as e:
             tb_str = traceback.format_exc()
@@ -84,51 +276,124 @@ def call_agent_with_retry(agent_function, agent_args: tuple, agent_name: str, ma
                 attempt_logs.append(f"ERROR: {agent_name} failed due to unexpected error after {max_retries + 1} attempts.")
                 return None, last_raw_output_for_error_reporting, attempt_logs, False
             attempt_logs.append(f"Retrying in {retry_delay_seconds}s...")
-            time.sleep(retry_delay_seconds)
+            tracing.sleep(retry_delay_seconds, "retry")
             
     return None, last_raw_output_for_error_reporting, attempt_logs, False
 
 
-def run_evaluation_workflow(text_input, question_input, student_answer_input):
+def is_alignment_uncertain(answer_analysis):
+    alignment = answer_analysis.get("overall_semantic_alignment")
+    if not isinstance(alignment, (int, float)):
+        return True
+    low, high = ALIGNMENT_UNCERTAIN_BAND
+    return low <= alignment <= high
+
+def is_score_near_grade_boundary(evaluation_scores):
+    total_score = evaluation_scores.get("total_score")
+    if not isinstance(total_score, (int, float)):
+        return True
+    return any(abs(total_score - boundary) <= GRADE_BOUNDARY_MARGIN for boundary in GRADE_BOUNDARIES)
+
+def call_agent_with_cascade(agent_function, agent_args: tuple, agent_name: str, agent_key: str, validation_context=None, is_uncertain=None):
     """
-    Orchestrates the full evaluation workflow and returns detailed step-by-step data.
+    Calls an agent through call_agent_with_retry with the agent's schema validator, starting on the
+    fastest model tier configured for agent_key and escalating to the next tier when the output fails
+    schema validation or when is_uncertain(parsed_output) is True. Without LLM_CASCADE only the first
+    tier is used.
     Returns:
-        A tuple (final_result, workflow_steps_details).
-        - final_result: The final JSON output if successful, else None.
-        - workflow_steps_details: A list of dictionaries, each detailing a step.
+        A tuple (parsed_output, raw_output_str, attempt_logs, success_flag, tier).
+        - tier: index of the model tier that produced the returned output.
     """
-    workflow_steps_details = []
-    current_step_data = {}
+    tiers = llm.model_tiers(agent_key) if CASCADE_ENABLED else llm.model_tiers(agent_key)[:1]
+    attempt_logs = []
+    for tier, model in enumerate(tiers):
+        parsed_output, raw_output, logs, success = call_agent_with_retry(
+            functools.partial(agent_function, tier=tier), agent_args, f"{agent_name} [{model}]",
+            validator=validation.make_validator(agent_key, validation_context)
+        )
+        attempt_logs.extend(logs)
+        if tier == len(tiers) - 1:
+            break
 
-    # --- Helper to add step data ---
-    def add_step_data(name, inputs, parsed_output, raw_output, logs, success):
-        status = "Success" if success and parsed_output is not None else "Failure"
-        error_msg = None
         if not success:
-            error_msg = logs[-1] if logs else "Unknown error"
-            if parsed_output is None and raw_output is None and "Agent function returned None directly" in error_msg:
-                 error_msg = f"{name} agent logic error: Returned None. Check agent's internal validation or inputs."
-            elif parsed_output is None: # JSON parsing failed or other exception
-                 error_msg = f"Failed to get valid JSON from {name}. Last attempt log: {error_msg}"
+            if raw_output is None:
+                # Agent logic error (e.g. invalid inputs): a larger model will not help.
+                break
+            reason = "no schema-valid output"
+        elif is_uncertain and is_uncertain(parsed_output):
+            reason = "output in uncertain band"
+        else:
+            break
+        attempt_logs.append(f"Cascade: escalating {agent_name} from {model} to {tiers[tier + 1]} ({reason}).")
 
+    return parsed_output, raw_output, attempt_logs, success, tier
 
-        workflow_steps_details.append({
-            "name": name,
-            "inputs": inputs,
-            "attempts_logs": logs,
-            "raw_output": raw_output,
-            "parsed_output": parsed_output,
-            "status": status,
-            "error_message_detail": error_msg if status == "Failure" else None
-        })
+
+def run_degraded_evaluation(text_input, question_input, student_answer_input, workflow_steps_details):
+    """
+    Grades the answer locally (rubric keyword matching and templated feedback) when the LLM backend is
+    unavailable. The result is flagged as provisional so that it can be regraded later.
+    Returns:
+        A tuple (final_result, workflow_steps_details) like run_evaluation_workflow.
+    """
+    cached_artifacts = get_pinned_question_artifacts(text_input, question_input) or get_cached_question_artifacts(text_input, question_input)
+    rubric = cached_artifacts["rubric"] if cached_artifacts else None
+    final_result = local_grading.degraded_evaluation(student_answer_input, rubric)
+    workflow_steps_details.append({
+        "name": "Degraded Grading", "status": "Success", "error_message_detail": None,
+        "inputs": {"student_answer_input": student_answer_input, "cached_rubric": rubric},
+        "attempts_logs": [
+            "LLM circuit breaker is open: grading locally.",
+            "Cached rubric found: keyword-based provisional score." if rubric else "No cached rubric: score deferred to regrading.",
+        ],
+        "raw_output": None, "parsed_output": final_result, "model": None, "model_tier": None
+    })
+    return final_result, workflow_steps_details
+
+def append_step_data(workflow_steps_details, name, inputs, parsed_output, raw_output, logs, success, agent_key=None, tier=None):
+    """Appends the trace of one agent call to workflow_steps_details."""
+    status = "Success" if success and parsed_output is not None else "Failure"
+    error_msg = None
+    if not success:
+        error_msg = logs[-1] if logs else "Unknown error"
+        if parsed_output is None and raw_output is None and "Agent function returned None directly" in error_msg:
+             error_msg = f"{name} agent logic error: Returned None. Check agent's internal validation or inputs."
+        elif parsed_output is None: # JSON parsing failed or other exception
+             error_msg = f"Failed to get valid JSON from {name}. Last attempt log: {error_msg}"
+
+    workflow_steps_details.append({
+        "name": name,
+        "inputs": inputs,
+        "attempts_logs": logs,
+        "raw_output": raw_output,
+        "parsed_output": parsed_output,
+        "status": status,
+        "error_message_detail": error_msg if status == "Failure" else None,
+        "model": llm.model_for(agent_key, tier) if agent_key and tier is not None else None,
+        "model_tier": tier
+    })
+
+def run_question_stages(text_input, question_input, workflow_steps_details=None):
+    """
+    Runs the question-level stages (1. Question Understanding, 2. Rubric Extraction), which do not depend
+    on the student's answer and can be shared by every answer to the same question.
+    Returns:
+        A tuple (question_artifacts, workflow_steps_details).
+        - question_artifacts: {"question_analysis": ..., "rubric": [...]} if successful, else None.
+        - workflow_steps_details: the given list (or a new one) with the steps appended.
+    """
+    if workflow_steps_details is None:
+        workflow_steps_details = []
+    add_step_data = functools.partial(append_step_data, workflow_steps_details)
 
     # --- 1. Agent de compréhension des questions ---
     step_name = "1. Question Understanding"
     step_inputs = {"text_input": text_input, "question_input": question_input}
-    question_analysis, raw_qst_str, qst_logs, qst_success = call_agent_with_retry(
-        question_understanding_agent.qst_understanding, (text_input, question_input), step_name
+    question_analysis, raw_qst_str, qst_logs, qst_success, qst_tier = call_agent_with_cascade(
+        question_understanding_agent.qst_understanding, (text_input, question_input), step_name,
+        "qst_understanding"
     )
-    add_step_data(step_name, step_inputs, question_analysis, raw_qst_str, qst_logs, qst_success)
+    add_step_data(step_name, step_inputs, question_analysis, raw_qst_str, qst_logs, qst_success, "qst_understanding", qst_tier)
     if not qst_success or question_analysis is None:
         return None, workflow_steps_details
     
@@ -145,10 +410,11 @@ def run_evaluation_workflow(text_input, question_input, student_answer_input):
     # --- 2. Agent d'extraction de rubriques ---
     step_name = "2. Rubric Extraction"
     step_inputs = {"text_input": text_input, "question_input": question_input, "key_concepts_expected": key_concepts_expected}
-    rubric_definition, raw_rubric_str, rubric_logs, rubric_success = call_agent_with_retry(
-        rubric_extraction_agent.rubric_extract, (text_input, question_input, key_concepts_expected), step_name
+    rubric_definition, raw_rubric_str, rubric_logs, rubric_success, rubric_tier = call_agent_with_cascade(
+        rubric_extraction_agent.rubric_extract, (text_input, question_input, key_concepts_expected), step_name,
+        "rubric_extraction"
     )
-    add_step_data(step_name, step_inputs, rubric_definition, raw_rubric_str, rubric_logs, rubric_success)
+    add_step_data(step_name, step_inputs, rubric_definition, raw_rubric_str, rubric_logs, rubric_success, "rubric_extraction", rubric_tier)
     if not rubric_success or rubric_definition is None:
         return None, workflow_steps_details
 
@@ -160,41 +426,316 @@ def run_evaluation_workflow(text_input, question_input, student_answer_input):
             "inputs": {"rubric_definition_output": rubric_definition}, "attempts_logs": [], "raw_output": None, "parsed_output": None
         })
         return None, workflow_steps_details
+    cache_question_artifacts(text_input, question_input, question_analysis, actual_rubric)
+
+    return {"question_analysis": question_analysis, "rubric": actual_rubric}, workflow_steps_details
+
+def pinned_artifacts_step(question_input, question_artifacts):
+    """Trace step recorded when pinned question artifacts replace stages 1-2."""
+    version = question_artifacts.get("rubric_version")
+    if question_artifacts.get("source") == PREPARED_SOURCE:
+        log = "Using the question analysis and rubric prepared when the question was displayed."
+    else:
+        log = f"Using the rubric pinned for this question (version {version})." if version else "Using the rubric pinned for this question."
+    return {
+        "name": "1-2. Question Stages (reused)", "status": "Success", "error_message_detail": None,
+        "inputs": {"question_input": question_input},
+        "attempts_logs": [log],
+        "raw_output": None, "parsed_output": question_artifacts, "model": None, "model_tier": None
+    }
+
+def cached_artifacts_step(question_input, question_artifacts):
+    """Trace step recorded when cached question artifacts (this node's or the shared cache) replace stages 1-2."""
+    return {
+        "name": "1-2. Question Stages (reused)", "status": "Success", "error_message_detail": None,
+        "inputs": {"question_input": question_input},
+        "attempts_logs": ["Using the question analysis and rubric cached from an earlier evaluation of this question."],
+        "raw_output": None, "parsed_output": question_artifacts, "model": None, "model_tier": None
+    }
+
+def run_prescreen(text_input, question_input, student_answer_input, question_artifacts, workflow_steps_details):
+    """
+    Local pre-screen of the answer (Agents/prescreen.py), recorded as step "0. Pre-screen".
+    Returns:
+        The final result of a rejected answer (graded 0 without any answer-level LLM call), or None if the
+        answer passes or the pre-screen is disabled.
+    """
+    if not prescreen.PRESCREEN_ENABLED:
+        return None
+    key_concepts_expected = question_artifacts["question_analysis"].get("key_concepts_expected", [])
+    report = prescreen.prescreen(student_answer_input, text_input, question_input, key_concepts_expected, question_artifacts["rubric"])
+    rejected = report["verdict"] == "reject"
+    workflow_steps_details.append({
+        "name": "0. Pre-screen", "status": "Success", "error_message_detail": None,
+        "inputs": {"student_answer_input": student_answer_input},
+        "attempts_logs": [f"Answer rejected by the pre-screen ({report['reason']})." if rejected else "Answer passed the pre-screen."],
+        "raw_output": None, "parsed_output": report, "model": None, "model_tier": None
+    })
+    return prescreen.rejected_result(report, question_artifacts["rubric"]) if rejected else None
+
+def templated_final_scoring(actual_rubric, rubric_based_score, grammar_penalty_percent, breakdown_scores, grammar_report,
+                            workflow_steps_details):
+    """
+    Stage 6 without the LLM (Agents/local_feedback.py), for clear-cut results or with FEEDBACK_MODE=template.
+    Returns:
+        The final output, or None if the feedback must be written by the final evaluation agent.
+    """
+    if not local_feedback.use_template(actual_rubric, breakdown_scores):
+        return None
+    grammar_errors = grammar_report.get("errors", [])
+    final_output = local_feedback.final_evaluation(actual_rubric, rubric_based_score, grammar_penalty_percent, breakdown_scores, grammar_errors)
+    outcome = local_feedback.clear_cut_outcome(actual_rubric, breakdown_scores)
+    workflow_steps_details.append({
+        "name": "6. Final Scoring", "status": "Success", "error_message_detail": None,
+        "inputs": {"rubric_based_score": rubric_based_score, "grammar_penalty_percent": grammar_penalty_percent,
+                   "breakdown_scores": breakdown_scores, "grammar_errors": grammar_errors},
+        "attempts_logs": [f"Feedback generated from templates ({f'clear-cut result: {outcome}' if outcome else 'FEEDBACK_MODE=template'})."],
+        "raw_output": None, "parsed_output": final_output, "model": None, "model_tier": None
+    })
+    return final_output
+
+def _prepare(text_input, question_input, question_id, tenant_id):
+    try:
+        with dispatcher.priority("normal"), tenants.tenant(tenant_id):
+            question_artifacts, _ = run_question_stages(text_input, question_input)
+        if question_artifacts is not None:
+            with _pinned_question_artifacts_lock:
+                # A rubric pinned meanwhile (e.g. by the teacher) is kept.
+                if question_id not in _pinned_question_artifacts:
+                    _pinned_question_artifacts[question_id] = dict(question_artifacts, source=PREPARED_SOURCE)
+            with _preparations_lock:
+                _prepared_question_ids[question_id] = True
+                _prepared_question_ids.move_to_end(question_id)
+                while len(_prepared_question_ids) > PREPARED_QUESTIONS_MAX_ENTRIES:
+                    evicted_id, _ = _prepared_question_ids.popitem(last=False)
+                    with _pinned_question_artifacts_lock:
+                        if _pinned_question_artifacts.get(evicted_id, {}).get("source") == PREPARED_SOURCE:
+                            del _pinned_question_artifacts[evicted_id]
+        return question_artifacts
+    finally:
+        with _preparations_lock:
+            _preparations.pop(question_id, None)
+
+def prepare_question(text_input, question_input):
+    """
+    Starts computing the question-level artifacts (stages 1-2) of a question in the background, unless
+    they are already pinned or being computed. Returns immediately.
+    Returns:
+        A tuple (question_id, status), status being "ready" (artifacts pinned) or "preparing".
+    """
+    question_id = question_key(text_input, question_input)
+    if question_id in _pinned_question_artifacts:
+        return question_id, "ready"
+    with _preparations_lock:
+        if question_id not in _preparations:
+            _preparations[question_id] = _prepare_executor.submit(
+                tracing.propagate(_prepare), text_input, question_input, question_id, tenants.current_tenant()
+            )
+    return question_id, "preparing"
+
+def wait_for_preparation(text_input, question_input, timeout_seconds=PREPARE_WAIT_SECONDS):
+    """
+    Waits for a running preparation of this question, if any.
+    Returns:
+        The prepared artifacts, or None if the question is not being prepared or the preparation failed.
+    """
+    with _preparations_lock:
+        future = _preparations.get(question_key(text_input, question_input))
+    if future is None:
+        return None
+    try:
+        future.result(timeout=timeout_seconds)
+    except Exception as e:
+        print(f"Question preparation not usable: {e!r}")
+        return None
+    return get_pinned_question_artifacts(text_input, question_input)
+
+def get_ready_question_artifacts(text_input, question_input):
+    """Pinned artifacts of the question, waiting for its preparation if one is running; None otherwise."""
+    return get_pinned_question_artifacts(text_input, question_input) or wait_for_preparation(text_input, question_input)
+
+def _load_or_create_checkpoint(workflow_id, text_input, question_input, student_answer_input):
+    """Returns the saved checkpoint of workflow_id if it was created for the same inputs, else a new one."""
+    checkpoint = workflow_checkpoints.checkpoint_store.load(workflow_id)
+    if checkpoint is None or checkpoint["inputs"] != {
+        "text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input
+    }:
+        checkpoint = workflow_checkpoints.new_checkpoint(workflow_id, text_input, question_input, student_answer_input)
+    return checkpoint
+
+def run_evaluation_workflow(text_input, question_input, student_answer_input, question_artifacts=None, workflow_id=None,
+                            trace_verbosity=None):
+    """
+    Orchestrates the full evaluation workflow and returns detailed step-by-step data.
+    If question_artifacts (as returned by run_question_stages) is given, stages 1-2 are skipped.
+    If workflow_id is given, each successful stage output is checkpointed under it, and a later call with the
+    same workflow_id and inputs (see resume_evaluation_workflow) restarts from the first failed stage.
+    trace_verbosity ("none", "summary" or "full", default TRACE_VERBOSITY) selects the step trace detail.
+    Returns:
+        A tuple (final_result, workflow_steps_details).
+        - final_result: The final JSON output if successful, else None.
+        - workflow_steps_details: A step_trace.StepTrace, a list of dictionaries each detailing a step.
+    """
+    with tracing.span("evaluation_workflow", workflow_id=workflow_id, tenant_id=tenants.current_tenant(),
+                      priority_class=dispatcher.current_priority(), question_artifacts_given=question_artifacts is not None) as workflow_span:
+        final_result, workflow_steps_details = _run_evaluation_workflow(
+            text_input, question_input, student_answer_input, question_artifacts, workflow_id
+        )
+        workflow_span.set_attributes(success=final_result is not None, grading_mode=(final_result or {}).get("grading_mode"))
+    return final_result, compact_steps(final_result, workflow_steps_details, trace_verbosity)
+
+def compact_steps(final_result, workflow_steps_details, trace_verbosity):
+    """
+    Compacts the steps of a run to the requested trace verbosity, after extracting the evaluation details
+    (rubric, grammar report, breakdown) from the full steps.
+    """
+    trace = step_trace.compact_trace(workflow_steps_details, trace_verbosity)
+    trace.evaluation_details = analytics.extract_evaluation_details(final_result, workflow_steps_details)
+    return trace
+
+def _run_evaluation_workflow(text_input, question_input, student_answer_input, question_artifacts, workflow_id):
+    workflow_steps_details = []
+
+    checkpoint = None
+    if workflow_id is not None:
+        checkpoint = _load_or_create_checkpoint(workflow_id, text_input, question_input, student_answer_input)
+    saved_stages = checkpoint["stages"] if checkpoint else {}
+
+    def degrade():
+        """Answers with a provisional local grade, recorded on the checkpoint so that a replay returns it."""
+        final_result, steps = run_degraded_evaluation(text_input, question_input, student_answer_input, workflow_steps_details)
+        if checkpoint is not None:
+            checkpoint["status"], checkpoint["degraded_result"] = "degraded", final_result
+            workflow_checkpoints.checkpoint_store.save(checkpoint)
+        return final_result, steps
+
+    if checkpoint is not None and checkpoint["status"] == "degraded":
+        workflow_steps_details.append({
+            "name": "Degraded Grading", "status": "Success", "error_message_detail": None,
+            "inputs": {"workflow_id": workflow_id},
+            "attempts_logs": [f"Provisional result restored from workflow checkpoint {workflow_id}."],
+            "raw_output": None, "parsed_output": checkpoint["degraded_result"], "model": None, "model_tier": None
+        })
+        return checkpoint["degraded_result"], workflow_steps_details
+    # With the question artifacts given, stages 1-2 do not run: only the answer agents' backends matter. A
+    # completed workflow restores every stage without LLM calls.
+    completed = checkpoint is not None and checkpoint["status"] == "completed"
+    if not completed and llm.is_unavailable(llm.ANSWER_AGENT_KEYS if question_artifacts is not None else None):
+        return degrade()
+
+    def save_stage(stage_key, output):
+        if checkpoint is not None:
+            saved_stages[stage_key] = output
+            workflow_checkpoints.checkpoint_store.save(checkpoint)
+
+    def restore_stage(stage_key, step_name):
+        """Returns a stage's checkpointed output (recording it as a step), or None if the stage must run."""
+        if stage_key not in saved_stages:
+            return None
+        workflow_steps_details.append({
+            "name": step_name, "status": "Success", "error_message_detail": None,
+            "inputs": {"workflow_id": workflow_id}, "attempts_logs": [f"Restored from workflow checkpoint {workflow_id}."],
+            "raw_output": None, "parsed_output": saved_stages[stage_key], "model": None, "model_tier": None
+        })
+        return saved_stages[stage_key]
+
+    def fail():
+        if checkpoint is not None:
+            checkpoint["status"] = "failed"
+            checkpoint["failed_stage"] = workflow_checkpoints.first_missing_stage(checkpoint)
+            workflow_checkpoints.checkpoint_store.save(checkpoint)
+        # If the LLM backend became unavailable during the run, answer with a provisional local grade.
+        if llm.is_unavailable():
+            return degrade()
+        return None, workflow_steps_details
+
+    # --- Helper to add step data ---
+    add_step_data = functools.partial(append_step_data, workflow_steps_details)
+
+    # --- 1-2. Question-level stages ---
+    pinned_artifacts = get_ready_question_artifacts(text_input, question_input) if question_artifacts is None else None
+    if question_artifacts is not None:
+        workflow_steps_details.append({
+            "name": "1-2. Question Stages (reused)", "status": "Success", "error_message_detail": None,
+            "inputs": {"question_input": question_input}, "attempts_logs": ["Reusing precomputed question analysis and rubric."],
+            "raw_output": None, "parsed_output": question_artifacts, "model": None, "model_tier": None
+        })
+    elif pinned_artifacts is not None:
+        question_artifacts = pinned_artifacts
+        workflow_steps_details.append(pinned_artifacts_step(question_input, question_artifacts))
+    else:
+        question_artifacts = restore_stage("question_stages", "1-2. Question Stages (reused)")
+        if question_artifacts is None:
+            question_artifacts = reusable_question_artifacts(text_input, question_input)
+            if question_artifacts is not None:
+                workflow_steps_details.append(cached_artifacts_step(question_input, question_artifacts))
+        if question_artifacts is None:
+            question_artifacts, _ = run_question_stages(text_input, question_input, workflow_steps_details)
+            if question_artifacts is None:
+                return fail()
+    if "question_stages" not in saved_stages:
+        save_stage("question_stages", question_artifacts)
+    key_concepts_expected = question_artifacts["question_analysis"].get("key_concepts_expected", [])
+    actual_rubric = question_artifacts["rubric"]
+
+    # --- 0. Pre-screen: empty or junk answers are graded without the answer-level LLM stages ---
+    prescreen_result = run_prescreen(text_input, question_input, student_answer_input, question_artifacts, workflow_steps_details)
+    if prescreen_result is not None:
+        if checkpoint is not None:
+            checkpoint["status"], checkpoint["failed_stage"] = "completed", None
+        save_stage("final_eval", prescreen_result)
+        return prescreen_result, workflow_steps_details
 
     # --- 3. Agent de compréhension des réponses ---
     step_name = "3. Answer Understanding"
-    step_inputs = {"text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input}
-    answer_analysis, raw_ans_str, ans_logs, ans_success = call_agent_with_retry(
-        answer_understanding_agent.ans_understanding, (text_input, question_input, student_answer_input), step_name
-    )
-    add_step_data(step_name, step_inputs, answer_analysis, raw_ans_str, ans_logs, ans_success)
-    if not ans_success or answer_analysis is None:
-        return None, workflow_steps_details
+    answer_analysis = restore_stage("ans_understanding", step_name)
+    if answer_analysis is None:
+        step_inputs = {"text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input}
+        answer_analysis, raw_ans_str, ans_logs, ans_success, ans_tier = call_agent_with_cascade(
+            answer_understanding_agent.ans_understanding, (text_input, question_input, student_answer_input), step_name,
+            "ans_understanding", is_uncertain=is_alignment_uncertain
+        )
+        add_step_data(step_name, step_inputs, answer_analysis, raw_ans_str, ans_logs, ans_success, "ans_understanding", ans_tier)
+        if not ans_success or answer_analysis is None:
+            return fail()
+        if SEMANTIC_ALIGNMENT_MODE in ("prompt", "replace"):
+            local_alignment = similarity.compute_alignment(text_input, key_concepts_expected, student_answer_input)
+            answer_analysis["local_semantic_alignment"] = local_alignment
+            if SEMANTIC_ALIGNMENT_MODE == "replace":
+                answer_analysis["overall_semantic_alignment"] = local_alignment
+        save_stage("ans_understanding", answer_analysis)
 
     # --- 4. Agent de grammaire et de langue ---
     step_name = "4. Grammar and Language"
-    step_inputs = {"student_answer_input": student_answer_input}
-    grammar_report, raw_grammar_str, grammar_logs, grammar_success = call_agent_with_retry(
-        grammar_language_agent.grammar, (student_answer_input,), step_name
-    )
-    add_step_data(step_name, step_inputs, grammar_report, raw_grammar_str, grammar_logs, grammar_success)
-    if not grammar_success or grammar_report is None:
-        return None, workflow_steps_details
+    grammar_report = restore_stage("grammar", step_name)
+    if grammar_report is None:
+        step_inputs = {"student_answer_input": student_answer_input}
+        grammar_report, raw_grammar_str, grammar_logs, grammar_success, grammar_tier = call_agent_with_cascade(
+            grammar_language_agent.grammar, (student_answer_input,), step_name,
+            "grammar"
+        )
+        add_step_data(step_name, step_inputs, grammar_report, raw_grammar_str, grammar_logs, grammar_success, "grammar", grammar_tier)
+        if not grammar_success or grammar_report is None:
+            return fail()
+        save_stage("grammar", grammar_report)
     grammar_penalty_percent = grammar_report.get("penalty", 0) # Default to 0 if not found
 
     # --- 5. Agent d'évaluation ---
     step_name = "5. Evaluation"
-    step_inputs = {
-        "text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input,
-        "actual_rubric": actual_rubric, "answer_analysis": answer_analysis
-    }
-    evaluation_scores, raw_eval_str, eval_logs, eval_success = call_agent_with_retry(
-        eval_agent.eval,
-        (text_input, question_input, student_answer_input, actual_rubric, answer_analysis), step_name
-    )
-    add_step_data(step_name, step_inputs, evaluation_scores, raw_eval_str, eval_logs, eval_success)
-    if not eval_success or evaluation_scores is None:
-        return None, workflow_steps_details
+    evaluation_scores = restore_stage("eval", step_name)
+    if evaluation_scores is None:
+        step_inputs = {
+            "text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input,
+            "actual_rubric": actual_rubric, "answer_analysis": answer_analysis
+        }
+        evaluation_scores, raw_eval_str, eval_logs, eval_success, eval_tier = call_agent_with_cascade(
+            eval_agent.eval,
+            (text_input, question_input, student_answer_input, actual_rubric, answer_analysis), step_name,
+            "eval", {"rubric": actual_rubric}, is_score_near_grade_boundary
+        )
+        add_step_data(step_name, step_inputs, evaluation_scores, raw_eval_str, eval_logs, eval_success, "eval", eval_tier)
+        if not eval_success or evaluation_scores is None:
+            return fail()
     
     rubric_based_score = evaluation_scores.get("total_score")
     breakdown_scores = evaluation_scores.get("scores")
@@ -204,26 +745,437 @@ def run_evaluation_workflow(text_input, question_input, student_answer_input):
             "error_message_detail": "Missing 'total_score' or 'scores' in the output of Evaluation Agent.",
             "inputs": {"evaluation_scores_output": evaluation_scores}, "attempts_logs": [], "raw_output": None, "parsed_output": None
         })
-        return None, workflow_steps_details
+        return fail()
+    if "eval" not in saved_stages:
+        save_stage("eval", evaluation_scores)
 
     # --- 6. Agent de notation finale ---
     step_name = "6. Final Scoring"
+    final_output = restore_stage("final_eval", step_name)
+    if final_output is None:
+        final_output = templated_final_scoring(actual_rubric, rubric_based_score, grammar_penalty_percent, breakdown_scores,
+                                               grammar_report, workflow_steps_details)
+    if final_output is None:
+        # Same calculation as the final evaluation agent; the validator pins the output's final_score to it.
+        expected_final_score = max(0, min(100, rubric_based_score * (1 - (grammar_penalty_percent / 100.0))))
+        step_inputs = {
+            "text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input,
+            "actual_rubric": actual_rubric, "answer_analysis": answer_analysis,
+            "rubric_based_score": rubric_based_score, "grammar_penalty_percent": grammar_penalty_percent,
+            "breakdown_scores": breakdown_scores
+        }
+        final_output, raw_final_str, final_logs, final_success, final_tier = call_agent_with_cascade(
+            final_eval_agent.final_eval,
+            (text_input, question_input, student_answer_input, actual_rubric, answer_analysis,
+             rubric_based_score, grammar_penalty_percent, breakdown_scores), step_name,
+            "final_eval", {"final_score": expected_final_score}
+        )
+        add_step_data(step_name, step_inputs, final_output, raw_final_str, final_logs, final_success, "final_eval", final_tier)
+        if not final_success or final_output is None:
+            return fail()
+    if "final_eval" not in saved_stages:
+        if checkpoint is not None:
+            checkpoint["status"], checkpoint["failed_stage"] = "completed", None
+        save_stage("final_eval", final_output)
+
+    return final_output, workflow_steps_details
+
+def resume_evaluation_workflow(workflow_id, trace_verbosity=None):
+    """
+    Resumes a checkpointed workflow from its first failed stage, reusing the saved outputs of the stages
+    that already succeeded. A completed workflow, or one answered by degraded grading, returns its saved
+    result without any LLM call.
+    Returns:
+        A tuple (final_result, workflow_steps_details) like run_evaluation_workflow.
+    Raises:
+        KeyError: if there is no checkpoint for workflow_id.
+    """
+    checkpoint = workflow_checkpoints.checkpoint_store.load(workflow_id)
+    if checkpoint is None:
+        raise KeyError(f"No checkpoint found for workflow {workflow_id}.")
+    inputs = checkpoint["inputs"]
+    return run_evaluation_workflow(
+        inputs["text_input"], inputs["question_input"], inputs["student_answer_input"], workflow_id=workflow_id,
+        trace_verbosity=trace_verbosity
+    )
+
+def plan_eval_packs(text_input, question_input, rubric, items):
+    """
+    Groups (answer_id, student_answer, answer_analysis) items into packs that fit the token budget: the shared
+    prefix (instructions, text, question, rubric) is counted once per pack, each answer block and its expected
+    output once per answer.
+    Returns:
+        A list of packs (lists of items), in the original order.
+    """
+    shared_tokens = eval_agent.estimate_tokens(
+        prompts.instructions("eval", eval_agent.PACKED_INSTRUCTIONS, eval_agent.COMPACT_PACKED_INSTRUCTIONS)
+        + eval_agent.format_shared_context(text_input, question_input, rubric)
+    )
+    output_tokens = EVAL_PACK_OUTPUT_TOKENS_PER_CONCEPT * (len(rubric) + 1)
+    packs, pack, pack_tokens = [], [], shared_tokens
+    for item in items:
+        answer_id, student_answer, answer_analysis = item
+        item_tokens = eval_agent.estimate_tokens(eval_agent.format_answer_block(len(pack), student_answer, answer_analysis)) + output_tokens
+        if pack and (pack_tokens + item_tokens > EVAL_PACK_TOKEN_BUDGET or len(pack) >= EVAL_PACK_MAX_ANSWERS):
+            packs.append(pack)
+            pack, pack_tokens = [], shared_tokens
+        pack.append(item)
+        pack_tokens += item_tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+def evaluate_pack(text_input, question_input, rubric, pack):
+    """
+    Grades a pack of (answer_id, student_answer, answer_analysis) items with one packed completion. If the
+    packed output cannot be repaired, the pack is split in halves which are graded separately; a single
+    answer is graded with the regular evaluation agent (and the model cascade).
+    Returns:
+        A dict answer_id -> (evaluation_scores or None, attempt_logs, tier).
+    """
+    if len(pack) == 1:
+        answer_id, student_answer, answer_analysis = pack[0]
+        evaluation_scores, _, eval_logs, eval_success, eval_tier = call_agent_with_cascade(
+            eval_agent.eval, (text_input, question_input, student_answer, rubric, answer_analysis), "5. Evaluation",
+            "eval", {"rubric": rubric}, is_score_near_grade_boundary
+        )
+        return {answer_id: (evaluation_scores if eval_success else None, eval_logs, eval_tier)}
+
+    answers = [student_answer for _, student_answer, _ in pack]
+    answer_analyses = [answer_analysis for _, _, answer_analysis in pack]
+    packed_output, _, pack_logs, pack_success = call_agent_with_retry(
+        functools.partial(eval_agent.eval_packed, tier=0), (text_input, question_input, answers, rubric, answer_analyses),
+        f"5. Evaluation (packed x{len(pack)})", max_retries=0,
+        validator=validation.make_packed_eval_validator(len(pack), {"rubric": rubric})
+    )
+    if pack_success:
+        return {
+            answer_id: (evaluation_scores, pack_logs, 0)
+            for (answer_id, _, _), evaluation_scores in zip(pack, packed_output["evaluations"])
+        }
+    if llm.is_unavailable(["eval"]):
+        return {answer_id: (None, pack_logs, 0) for answer_id, _, _ in pack}
+
+    middle = len(pack) // 2
+    split_log = f"Packed output for {len(pack)} answers unusable: splitting into packs of {middle} and {len(pack) - middle}."
+    results = {}
+    for half in (pack[:middle], pack[middle:]):
+        for answer_id, (evaluation_scores, logs, tier) in evaluate_pack(text_input, question_input, rubric, half).items():
+            results[answer_id] = (evaluation_scores, pack_logs + [split_log] + logs, tier)
+    return results
+
+def _run_answer_stages(text_input, question_input, student_answer_input, local_alignment, workflow_steps_details, grammar_report=None):
+    """
+    Stages 3-4 for one answer of a batch. local_alignment is the answer's precomputed local semantic alignment
+    (None unless SEMANTIC_ALIGNMENT_MODE is "prompt" or "replace"). Stage 4 is skipped if the answer's
+    grammar_report is already known.
+    Returns (answer_analysis, grammar_report), None on failure.
+    """
+    add_step_data = functools.partial(append_step_data, workflow_steps_details)
+
+    step_name = "3. Answer Understanding"
+    step_inputs = {"text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input}
+    answer_analysis, raw_ans_str, ans_logs, ans_success, ans_tier = call_agent_with_cascade(
+        answer_understanding_agent.ans_understanding, (text_input, question_input, student_answer_input), step_name,
+        "ans_understanding", is_uncertain=is_alignment_uncertain
+    )
+    add_step_data(step_name, step_inputs, answer_analysis, raw_ans_str, ans_logs, ans_success, "ans_understanding", ans_tier)
+    if not ans_success or answer_analysis is None:
+        return None
+    if local_alignment is not None:
+        answer_analysis["local_semantic_alignment"] = local_alignment
+        if SEMANTIC_ALIGNMENT_MODE == "replace":
+            answer_analysis["overall_semantic_alignment"] = local_alignment
+
+    if grammar_report is None:
+        grammar_report = _run_grammar_stage(student_answer_input, workflow_steps_details)
+    if grammar_report is None:
+        return None
+    return answer_analysis, grammar_report
+
+def _run_grammar_stage(student_answer_input, workflow_steps_details):
+    """Stage 4 for one answer of a batch. Returns the grammar report, None on failure."""
+    step_name = "4. Grammar and Language"
+    grammar_report, raw_grammar_str, grammar_logs, grammar_success, grammar_tier = call_agent_with_cascade(
+        grammar_language_agent.grammar, (student_answer_input,), step_name,
+        "grammar"
+    )
+    append_step_data(workflow_steps_details, step_name, {"student_answer_input": student_answer_input}, grammar_report,
+                     raw_grammar_str, grammar_logs, grammar_success, "grammar", grammar_tier)
+    return grammar_report if grammar_success else None
+
+def _run_final_stage(text_input, question_input, student_answer_input, actual_rubric, answer_analysis, grammar_report,
+                     evaluation_scores, workflow_steps_details):
+    """Stage 6 for one answer of a batch. Returns the final output, or None on failure."""
+    rubric_based_score = evaluation_scores["total_score"]
+    breakdown_scores = evaluation_scores["scores"]
+    grammar_penalty_percent = grammar_report.get("penalty", 0)
+    final_output = templated_final_scoring(actual_rubric, rubric_based_score, grammar_penalty_percent, breakdown_scores,
+                                           grammar_report, workflow_steps_details)
+    if final_output is not None:
+        return final_output
+    step_name = "6. Final Scoring"
+    expected_final_score = max(0, min(100, rubric_based_score * (1 - (grammar_penalty_percent / 100.0))))
     step_inputs = {
         "text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input,
         "actual_rubric": actual_rubric, "answer_analysis": answer_analysis,
         "rubric_based_score": rubric_based_score, "grammar_penalty_percent": grammar_penalty_percent,
         "breakdown_scores": breakdown_scores
     }
-    final_output, raw_final_str, final_logs, final_success = call_agent_with_retry(
+    final_output, raw_final_str, final_logs, final_success, final_tier = call_agent_with_cascade(
         final_eval_agent.final_eval,
         (text_input, question_input, student_answer_input, actual_rubric, answer_analysis,
-         rubric_based_score, grammar_penalty_percent, breakdown_scores), step_name
+         rubric_based_score, grammar_penalty_percent, breakdown_scores), step_name,
+        "final_eval", {"final_score": expected_final_score}
     )
-    add_step_data(step_name, step_inputs, final_output, raw_final_str, final_logs, final_success)
-    if not final_success or final_output is None:
-        return None, workflow_steps_details
+    append_step_data(workflow_steps_details, step_name, step_inputs, final_output, raw_final_str, final_logs, final_success, "final_eval", final_tier)
+    return final_output if final_success else None
 
-    return final_output, workflow_steps_details
+def cluster_step(assignment, member_count):
+    """Trace step recording the near-duplicate cluster of a batch answer (Agents/near_duplicates.py)."""
+    representative = assignment["representative"]
+    if assignment["is_representative"]:
+        log = f"Representative of cluster {assignment['cluster_id']} ({member_count} near-duplicate answer(s) reuse its content scores)."
+    else:
+        log = f"Near-duplicate of answer #{representative} (similarity {assignment['similarity']}): its content scores are reused."
+    return {
+        "name": "0. Near-duplicate Clustering", "status": "Success", "error_message_detail": None,
+        "inputs": {"similarity_threshold": near_duplicates.DEDUP_SIMILARITY_THRESHOLD}, "attempts_logs": [log],
+        "raw_output": None, "parsed_output": dict(assignment), "model": None, "model_tier": None
+    }
+
+def member_final_scoring(actual_rubric, representative_id, evaluation_scores, grammar_report, workflow_steps_details):
+    """
+    Stages 5-6 of a near-duplicate answer: the representative's content scores with the member's own grammar
+    penalty and errors, and template feedback (Agents/local_feedback.py), without any LLM call.
+    Returns:
+        The final output.
+    """
+    breakdown_scores = evaluation_scores["scores"]
+    grammar_penalty_percent = grammar_report.get("penalty", 0)
+    grammar_errors = grammar_report.get("errors", [])
+    workflow_steps_details.append({
+        "name": "5. Evaluation", "status": "Success", "error_message_detail": None,
+        "inputs": {"representative_answer_id": representative_id},
+        "attempts_logs": [f"Content scores reused from the cluster representative (answer #{representative_id})."],
+        "raw_output": None, "parsed_output": evaluation_scores, "model": None, "model_tier": None
+    })
+    final_output = local_feedback.final_evaluation(actual_rubric, evaluation_scores["total_score"], grammar_penalty_percent,
+                                                   breakdown_scores, grammar_errors)
+    workflow_steps_details.append({
+        "name": "6. Final Scoring", "status": "Success", "error_message_detail": None,
+        "inputs": {"rubric_based_score": evaluation_scores["total_score"], "grammar_penalty_percent": grammar_penalty_percent,
+                   "breakdown_scores": breakdown_scores, "grammar_errors": grammar_errors},
+        "attempts_logs": ["Near-duplicate answer: feedback generated from templates."],
+        "raw_output": None, "parsed_output": final_output, "model": None, "model_tier": None
+    })
+    return dict(final_output, breakdown_scores=breakdown_scores, grading_mode="near_duplicate")
+
+def set_thread_context(priority_class, tenant_id):
+    """ThreadPoolExecutor initializer: the worker's LLM calls get this priority class and tenant."""
+    dispatcher.set_thread_priority(priority_class)
+    tenants.set_thread_tenant(tenant_id)
+
+def run_batch_evaluation_workflow(text_input, question_input, student_answers, question_artifacts=None, trace_verbosity=None,
+                                  on_result=None, max_workers=None):
+    """
+    Grades several answers to the same question. Stages 1-2 run once; stages 3, 4 and 6 run per answer
+    (max_workers, default BATCH_WORKERS, in parallel); stage 5 grades the answers in packs (see plan_eval_packs
+    and evaluate_pack) so that the context text, question and rubric are sent once per pack instead of once per
+    answer. Each pack goes on to stage 6 as soon as it is evaluated.
+    Near-duplicate answers are clustered (Agents/near_duplicates.py, BATCH_DEDUP): only one representative per
+    cluster goes through stages 3, 5 and 6, the other members get their own grammar pass and reuse its content
+    scores. Every graded answer records its "cluster_id".
+    If given, on_result(answer_id, final_result, workflow_steps_details) is called in the calling thread as
+    soon as each answer is done (e.g. to show live progress).
+    Returns:
+        A list of (final_result, workflow_steps_details) tuples, in the order of student_answers.
+    """
+    with tracing.span("batch_evaluation_workflow", answers=len(student_answers), tenant_id=tenants.current_tenant(),
+                      priority_class=dispatcher.current_priority()):
+        return _run_batch_evaluation_workflow(text_input, question_input, student_answers, question_artifacts, trace_verbosity,
+                                              on_result, max_workers or BATCH_WORKERS)
+
+def _run_batch_evaluation_workflow(text_input, question_input, student_answers, question_artifacts, trace_verbosity, on_result,
+                                   max_workers):
+    def finish(results):
+        compacted = [(final_result, compact_steps(final_result, steps, trace_verbosity)) for final_result, steps in results]
+        if on_result is not None:
+            for answer_id, (final_result, steps) in enumerate(compacted):
+                on_result(answer_id, final_result, steps)
+        return compacted
+
+    def degraded(answer_ids, question_steps):
+        return {
+            answer_id: run_degraded_evaluation(text_input, question_input, student_answers[answer_id], list(question_steps))
+            for answer_id in answer_ids
+        }
+
+    if llm.is_unavailable(llm.ANSWER_AGENT_KEYS if question_artifacts is not None else None):
+        return finish(degraded(range(len(student_answers)), []).values())
+
+    question_steps = []
+    pinned_artifacts = get_ready_question_artifacts(text_input, question_input) if question_artifacts is None else None
+    if pinned_artifacts is not None:
+        question_artifacts = pinned_artifacts
+        question_steps.append(pinned_artifacts_step(question_input, question_artifacts))
+    elif question_artifacts is None:
+        question_artifacts = reusable_question_artifacts(text_input, question_input)
+        if question_artifacts is not None:
+            question_steps.append(cached_artifacts_step(question_input, question_artifacts))
+        else:
+            question_artifacts, _ = run_question_stages(text_input, question_input, question_steps)
+        if question_artifacts is None:
+            if llm.is_unavailable(llm.QUESTION_AGENT_KEYS):
+                return finish(degraded(range(len(student_answers)), question_steps).values())
+            return finish([(None, list(question_steps)) for _ in student_answers])
+    else:
+        question_steps.append({
+            "name": "1-2. Question Stages (reused)", "status": "Success", "error_message_detail": None,
+            "inputs": {"question_input": question_input}, "attempts_logs": ["Reusing precomputed question analysis and rubric."],
+            "raw_output": None, "parsed_output": question_artifacts, "model": None, "model_tier": None
+        })
+    key_concepts_expected = question_artifacts["question_analysis"].get("key_concepts_expected", [])
+    actual_rubric = question_artifacts["rubric"]
+
+    steps_by_answer = [list(question_steps) for _ in student_answers]
+    results = [None] * len(student_answers)
+
+    def finish_answer(answer_id):
+        final_result, steps = final_results[answer_id], steps_by_answer[answer_id]
+        if final_result is not None and answer_id in clusters:
+            final_result = dict(final_result, cluster_id=clusters[answer_id]["cluster_id"])
+        elif final_result is None and llm.is_unavailable():
+            # An answer that could not be graded because the backend became unavailable gets a provisional grade.
+            final_result, steps = run_degraded_evaluation(text_input, question_input, student_answers[answer_id], steps)
+        results[answer_id] = (final_result, compact_steps(final_result, steps, trace_verbosity))
+        if on_result is not None:
+            on_result(answer_id, *results[answer_id])
+
+    final_results = [
+        run_prescreen(text_input, question_input, student_answer, question_artifacts, steps_by_answer[answer_id])
+        for answer_id, student_answer in enumerate(student_answers)
+    ]
+    # Answers rejected by the pre-screen already have their final result.
+    screened_ids = [answer_id for answer_id, final_result in enumerate(final_results) if final_result is None]
+    clusters = {}
+    for answer_id, final_result in enumerate(final_results):
+        if final_result is not None:
+            finish_answer(answer_id)
+    if near_duplicates.DEDUP_ENABLED:
+        assignments = near_duplicates.cluster_answers([student_answers[answer_id] for answer_id in screened_ids], actual_rubric)
+        for answer_id, assignment in zip(screened_ids, assignments):
+            clusters[answer_id] = dict(assignment, representative=screened_ids[assignment["representative"]],
+                                       is_representative=screened_ids[assignment["representative"]] == answer_id)
+        member_counts = collections.Counter(cluster["representative"] for cluster in clusters.values() if not cluster["is_representative"])
+        for answer_id, cluster in clusters.items():
+            steps_by_answer[answer_id].append(cluster_step(cluster, member_counts[answer_id]))
+    representative_ids = [answer_id for answer_id in screened_ids if answer_id not in clusters or clusters[answer_id]["is_representative"]]
+    member_ids = [answer_id for answer_id in screened_ids if answer_id not in representative_ids]
+    members_by_representative = collections.defaultdict(list)
+    for answer_id in member_ids:
+        members_by_representative[clusters[answer_id]["representative"]].append(answer_id)
+    local_alignments = {}
+    if SEMANTIC_ALIGNMENT_MODE in ("prompt", "replace"):
+        # One matrix multiply for the whole batch (Agents/similarity.py) instead of one per answer.
+        alignments = similarity.compute_alignments(text_input, key_concepts_expected, [student_answers[answer_id] for answer_id in representative_ids])
+        local_alignments = dict(zip(representative_ids, alignments))
+
+    evaluations = {}
+
+    def record_evaluation(answer_id, evaluation, answer_analysis):
+        evaluations[answer_id] = evaluation
+        evaluation_scores, eval_logs, eval_tier = evaluation
+        step_inputs = {
+            "text_input": text_input, "question_input": question_input, "student_answer_input": student_answers[answer_id],
+            "actual_rubric": actual_rubric, "answer_analysis": answer_analysis
+        }
+        append_step_data(steps_by_answer[answer_id], "5. Evaluation", step_inputs, evaluation_scores,
+                         None, eval_logs, evaluation_scores is not None, "eval", eval_tier)
+
+    def grade_member_alone(answer_id):
+        """Stages 3, 5 and 6 of a near-duplicate whose representative could not be graded (own grammar report)."""
+        local_alignment = None
+        if SEMANTIC_ALIGNMENT_MODE in ("prompt", "replace"):
+            local_alignment = similarity.compute_alignments(text_input, key_concepts_expected, [student_answers[answer_id]])[0]
+        stages = _run_answer_stages(text_input, question_input, student_answers[answer_id], local_alignment,
+                                    steps_by_answer[answer_id], grammar_report=member_grammar[answer_id])
+        if stages is None:
+            return None
+        evaluation = evaluate_pack(text_input, question_input, actual_rubric, [(answer_id, student_answers[answer_id], stages[0])])[answer_id]
+        record_evaluation(answer_id, evaluation, stages[0])
+        if evaluation[0] is None:
+            return None
+        return _run_final_stage(text_input, question_input, student_answers[answer_id], actual_rubric, stages[0], stages[1],
+                                evaluation[0], steps_by_answer[answer_id])
+
+    def finish_cluster(representative_id):
+        """
+        Finishes a representative and, with its content scores, the members of its cluster. If the representative
+        could not be graded, its members (with a grammar report) are graded on their own instead.
+        """
+        finish_answer(representative_id)
+        evaluation_scores = evaluations.get(representative_id, (None,))[0]
+        for answer_id in members_by_representative[representative_id]:
+            if member_grammar[answer_id] is None:
+                finish_answer(answer_id)
+            elif evaluation_scores is not None:
+                final_results[answer_id] = member_final_scoring(actual_rubric, representative_id, evaluation_scores,
+                                                                member_grammar[answer_id], steps_by_answer[answer_id])
+                finish_answer(answer_id)
+            else:
+                next(step for step in steps_by_answer[answer_id] if step["name"] == "0. Near-duplicate Clustering")["attempts_logs"].append(
+                    f"Representative (answer #{representative_id}) could not be graded: graded on its own instead."
+                )
+                pending[executor.submit(tracing.propagate(grade_member_alone), answer_id)] = ("member", answer_id)
+
+    # Worker threads inherit the caller's priority class (Agents/dispatcher.py) and tenant (Agents/tenants.py).
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=set_thread_context,
+                            initargs=(dispatcher.current_priority(), tenants.current_tenant())) as executor:
+        # --- 3-4. Per-answer stages (grammar only for the near-duplicates) ---
+        # Worker spans are children of the batch span (tracing.propagate).
+        answer_stages = executor.map(
+            tracing.propagate(lambda answer_id: _run_answer_stages(text_input, question_input, student_answers[answer_id], local_alignments.get(answer_id),
+                                                                  steps_by_answer[answer_id])),
+            representative_ids
+        )
+        member_grammar = executor.map(
+            tracing.propagate(lambda answer_id: _run_grammar_stage(student_answers[answer_id], steps_by_answer[answer_id])), member_ids
+        )
+        answer_stages = dict(zip(representative_ids, answer_stages))
+        member_grammar = dict(zip(member_ids, member_grammar))
+        pending = {} # future -> (kind, answer id): packed evaluations, final stages and near-duplicates graded alone
+        for answer_id, stages in answer_stages.items():
+            if not stages:
+                finish_cluster(answer_id)
+
+        # --- 5. Packed evaluation, then 6. per-answer final scoring as each pack comes back ---
+        items = [(answer_id, student_answers[answer_id], stages[0]) for answer_id, stages in answer_stages.items() if stages]
+        packs = plan_eval_packs(text_input, question_input, actual_rubric, items)
+        evaluate = tracing.propagate(lambda pack: evaluate_pack(text_input, question_input, actual_rubric, pack))
+        final_stage = tracing.propagate(lambda answer_id: _run_final_stage(
+            text_input, question_input, student_answers[answer_id], actual_rubric, answer_stages[answer_id][0],
+            answer_stages[answer_id][1], evaluations[answer_id][0], steps_by_answer[answer_id]
+        ))
+        pending.update({executor.submit(evaluate, pack): ("pack", None) for pack in packs})
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, done_id = pending.pop(future)
+                if kind == "final":
+                    final_results[done_id] = future.result()
+                    finish_cluster(done_id)
+                elif kind == "member":
+                    final_results[done_id] = future.result()
+                    finish_answer(done_id)
+                else:
+                    for answer_id, evaluation in future.result().items():
+                        record_evaluation(answer_id, evaluation, answer_stages[answer_id][0])
+                        if evaluation[0] is not None:
+                            pending[executor.submit(final_stage, answer_id)] = ("final", answer_id)
+                        else:
+                            finish_cluster(answer_id)
+    return results
 
 if __name__ == "__main__":
     # This part is for direct execution of workflow.py, not used by Streamlit app
@@ -252,7 +1204,7 @@ fort en maths.
         for i, step in enumerate(steps_data):
             print(f"\n--- Step {i+1}: {step['name']} ---")
             print(f"Status: {step['status']}")
-            if step.get('inputs'): print(f"Inputs: {json.dumps(step['inputs'], indent=2, ensure_ascii=False)}")
+            if step.get('inputs'): print(f"Inputs: {json.dumps(steps_data.resolve_inputs(step), indent=2, ensure_ascii=False)}")
             if step.get('attempts_logs'):
                 print("Attempt Logs:")
                 for log in step['attempts_logs']: print(f"  {log}")
@@ -0,0 +1,126 @@
+# workflow_checkpoints.py
+# Per-step checkpoints of evaluation workflows, so that a failed workflow resumes from its first failed
+# stage instead of paying for every stage again. One JSON file per workflow id in WORKFLOW_CHECKPOINT_DIR:
+#   {"workflow_id", "inputs": {text_input, question_input, student_answer_input},
+#    "stages": {stage_key: parsed_output}, "status": "running" | "failed" | "completed" | "degraded",
+#    "failed_stage", "updated_at", "evaluation_id" (id of the saved evaluation document, once stored),
+#    "degraded_result" (the provisional result of a run answered by degraded grading)}
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+# Empty value disables checkpointing.
+WORKFLOW_CHECKPOINT_DIR = os.environ.get("WORKFLOW_CHECKPOINT_DIR", ".workflow_checkpoints")
+# Checkpoints older than this are deleted (checked at most once per WORKFLOW_CHECKPOINT_PRUNE_INTERVAL_SECONDS).
+WORKFLOW_CHECKPOINT_TTL_SECONDS = float(os.environ.get("WORKFLOW_CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+WORKFLOW_CHECKPOINT_PRUNE_INTERVAL_SECONDS = 600
+
+# Stage keys, in workflow order.
+STAGES = ["question_stages", "ans_understanding", "grammar", "eval", "final_eval"]
+
+_WORKFLOW_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def new_workflow_id():
+    return uuid.uuid4().hex
+
+def is_valid_workflow_id(workflow_id):
+    """Workflow ids come from clients and are used as file names: only [A-Za-z0-9_-], up to 64 characters."""
+    return isinstance(workflow_id, str) and bool(_WORKFLOW_ID_PATTERN.match(workflow_id))
+
+class WorkflowCheckpointStore:
+    """File-backed checkpoint store. Each write replaces the workflow's file atomically."""
+
+    def __init__(self, directory=WORKFLOW_CHECKPOINT_DIR, ttl_seconds=WORKFLOW_CHECKPOINT_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _path(self, workflow_id):
+        if not is_valid_workflow_id(workflow_id):
+            raise ValueError(f"Invalid workflow id: {workflow_id!r}")
+        return os.path.join(self.directory, f"{workflow_id}.json")
+
+    def load(self, workflow_id):
+        """Returns the checkpoint of a workflow, or None if there is none."""
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(workflow_id), encoding="utf-8") as checkpoint_file:
+                return json.load(checkpoint_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, checkpoint):
+        if not self.enabled:
+            return
+        checkpoint["updated_at"] = time.time()
+        path = self._path(checkpoint["workflow_id"])
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(self.directory, exist_ok=True)
+        with open(temporary_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file, ensure_ascii=False)
+        os.replace(temporary_path, path)
+        self._prune_expired()
+
+    def delete(self, workflow_id):
+        if self.enabled:
+            try:
+                os.remove(self._path(workflow_id))
+            except FileNotFoundError:
+                pass
+
+    def _prune_expired(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < WORKFLOW_CHECKPOINT_PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune = now
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith(".json") and now - entry.stat().st_mtime > self.ttl_seconds:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+def new_checkpoint(workflow_id, text_input, question_input, student_answer_input):
+    return {
+        "workflow_id": workflow_id,
+        "inputs": {"text_input": text_input, "question_input": question_input, "student_answer_input": student_answer_input},
+        "stages": {},
+        "status": "running",
+        "failed_stage": None,
+    }
+
+def first_missing_stage(checkpoint):
+    """First stage without a saved output (the stage a resumed workflow restarts from), or None if all are saved."""
+    for stage_key in STAGES:
+        if stage_key not in checkpoint["stages"]:
+            return stage_key
+    return None
+
+def saved_evaluation_id(workflow_id):
+    """
+    Id of the evaluation document already stored for a completed workflow, or for one answered by degraded
+    grading (a replayed request), or None.
+    """
+    checkpoint = checkpoint_store.load(workflow_id)
+    if checkpoint is None or checkpoint.get("status") not in ("completed", "degraded"):
+        return None
+    return checkpoint.get("evaluation_id")
+
+def record_saved_evaluation(workflow_id, evaluation_id):
+    """Records the id of the evaluation document stored for a finished workflow, so a replay does not store it again."""
+    checkpoint = checkpoint_store.load(workflow_id)
+    if checkpoint is not None:
+        checkpoint["evaluation_id"] = evaluation_id
+        checkpoint_store.save(checkpoint)
+
+checkpoint_store = WorkflowCheckpointStore()